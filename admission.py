@@ -0,0 +1,225 @@
+"""
+Admission Control - LLM / TTS 阶段的准入控制与削峰
+每个阶段限制同时执行的请求数，超出的请求进入有最大深度的等待队列，
+每个请求在队列中的等待时间有上限；队列已满或等待超时时立即以 503 + Retry-After 拒绝，
+避免突发流量在线程池与上游限流后堆积、最终一起超时。
+
+配置（STAGE 为 LLM / TTS）:
+    PHI_<STAGE>_CONCURRENCY    同时执行的请求数
+    PHI_<STAGE>_MAX_QUEUE      等待队列最大深度（0 表示不排队，满即拒绝）
+    PHI_<STAGE>_QUEUE_TIMEOUT  单个请求在队列中的最长等待秒数
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, AsyncIterator
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(HTTPException):
+    """阶段过载：以 503 + Retry-After 快速失败（沿用 HTTPException，端点既有的 `except HTTPException: raise` 会原样透传）"""
+
+    def __init__(self, stage: str, reason: str, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"服务繁忙（{stage} {reason}），请 {retry_after} 秒后再试~",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _percentile(values, pct: float) -> float:
+    """最近秩 (nearest-rank) 百分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class AdmissionStage:
+    """单个阶段的有界并发 + 有界等待队列"""
+
+    def __init__(
+        self,
+        name: str,
+        default_concurrency: int = 32,
+        concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        window: int = 500
+    ):
+        """
+        Args:
+            name: 阶段名（"llm" / "tts"）
+            default_concurrency: 未配置 PHI_<STAGE>_CONCURRENCY 时的并发数
+            concurrency: 同时执行的请求数 (PHI_<STAGE>_CONCURRENCY)
+            max_queue: 等待队列最大深度 (PHI_<STAGE>_MAX_QUEUE)
+            queue_timeout: 队列等待上限秒数 (PHI_<STAGE>_QUEUE_TIMEOUT)
+            window: 等待时间样本的滚动窗口大小
+        """
+        prefix = f"PHI_{name.upper()}"
+        if concurrency is None:
+            concurrency = int(os.getenv(f"{prefix}_CONCURRENCY", str(default_concurrency)))
+        if max_queue is None:
+            max_queue = int(os.getenv(f"{prefix}_MAX_QUEUE", "64"))
+        if queue_timeout is None:
+            queue_timeout = float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", "5"))
+
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # 空闲名额数；释放时若有人排队，名额直接交给队首（不回到空闲池），新到的请求无法插队
+        self._free = concurrency
+        self._waiters: deque = deque()
+
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        self._waits: deque = deque(maxlen=window)
+        # 占用时长的指数滑动平均，用于估算 Retry-After
+        self._service_time = 1.0
+
+    # ---- 准入 ----
+
+    def _retry_after(self) -> int:
+        """按当前排队深度与平均占用时长估算多久后可能有空位"""
+        backlog = (self.queued + 1) / max(self.concurrency, 1)
+        return max(1, math.ceil(backlog * self._service_time))
+
+    def _reject(self, reason: str) -> Overloaded:
+        self.rejected[reason] += 1
+        retry_after = self._retry_after()
+        logger.warning(f"🚦 Admission [{self.name}] rejected ({reason}): in_flight={self.in_flight}, queued={self.queued}")
+        return Overloaded(self.name, reason, retry_after)
+
+    def _saturated(self) -> bool:
+        return self._free <= 0 or bool(self._waiters)
+
+    def check(self):
+        """入口预检：队列已满时立即拒绝（不占位，用于在做任何工作之前快速失败）"""
+        if self._saturated() and self.queued >= self.max_queue:
+            raise self._reject("queue_full")
+
+    async def acquire(self):
+        """取得执行名额（先到先得）；队列已满或等待超时时抛出 Overloaded"""
+        if not self._saturated():
+            self._free -= 1
+            self._admit(0.0)
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        started = time.monotonic()
+        try:
+            # asyncio.wait 超时不会取消 waiter；返回后到判断之间没有 await，名额不会在此期间被交付
+            await asyncio.wait((waiter,), timeout=self.queue_timeout)
+        except BaseException:
+            # 调用方被取消：已交付的名额交还给下一位
+            self._abandon(waiter)
+            raise
+        finally:
+            self.queued -= 1
+        if not waiter.done():
+            self._abandon(waiter)
+            raise self._reject("queue_timeout")
+        self._admit(time.monotonic() - started)
+
+    def _abandon(self, waiter: asyncio.Future):
+        """放弃等待：尚未交付则移出队列，已交付则释放该名额"""
+        if waiter.done() and not waiter.cancelled():
+            self._release_slot()
+        else:
+            waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+    def _admit(self, waited: float):
+        self.in_flight += 1
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def release(self, held: float):
+        self.in_flight -= 1
+        self._service_time = 0.8 * self._service_time + 0.2 * held
+        self._release_slot()
+
+    @asynccontextmanager
+    async def admit(self):
+        """async with stage.admit(): ... —— 执行期间占用一个名额"""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    async def hold(self, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """在首次迭代时取得名额、流结束时释放（用于 StreamingResponse 的响应体）"""
+        async with self.admit():
+            async for chunk in stream:
+                yield chunk
+
+    # ---- 指标 ----
+
+    def stats(self) -> Dict:
+        waits = list(self._waits)
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_queue_depth_seen": self.max_queued,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected["queue_full"],
+            "rejected_queue_timeout": self.rejected["queue_timeout"],
+            "wait_p50_ms": round(_percentile(waits, 50) * 1000, 1),
+            "wait_p95_ms": round(_percentile(waits, 95) * 1000, 1),
+            "wait_max_ms": round(max(waits, default=0.0) * 1000, 1),
+            "avg_service_seconds": round(self._service_time, 3),
+        }
+
+
+class AdmissionController:
+    """LLM 与 TTS 两个阶段的准入控制"""
+
+    def __init__(self):
+        self.llm = AdmissionStage("llm", default_concurrency=32)
+        # 不超过 TTS 连接池的连接数 (PHI_TTS_MAX_CONNECTIONS，默认 20)
+        self.tts = AdmissionStage("tts", default_concurrency=16)
+
+    def check(self):
+        """入口预检：任一阶段已满即拒绝"""
+        self.llm.check()
+        self.tts.check()
+
+    def stats(self) -> Dict:
+        return {"llm": self.llm.stats(), "tts": self.tts.stats()}
@@ -0,0 +1,94 @@
+"""
+Audio Links - 短期有效的音讯链接
+/chat 先回传文字与一个音讯链接，浏览器请求该链接时才（经由 TTS 快取）合成并边合成边播放，
+音讯不再以 base64 嵌入 JSON，也不必在服务端完整缓冲。
+链接只保存合成所需的参数（文本与语音设置），过期后失效。
+多 worker 部署时登记在共享存储中，签发链接的 worker 与解析链接的 worker 可以不同；
+共享存储的读写是阻塞 I/O，事件循环中使用 aissue() / aresolve()。
+"""
+
+import os
+import time
+import asyncio
+import secrets
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from session_backend import SessionBackend
+
+logger = logging.getLogger(__name__)
+
+
+class AudioLinks:
+    """token -> (语音文本, 语音设置) 的短期登记表（按 TTL 过期，数量有上限）"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: int = 10000, backend: Optional[SessionBackend] = None):
+        """
+        Args:
+            ttl: 链接有效秒数 (PHI_AUDIO_LINK_TTL)
+            max_entries: 同时有效的链接数上限，超出时淘汰最早签发的（仅进程内登记）
+            backend: 多 worker 共享存储（为空时登记在进程内存）
+        """
+        if ttl is None:
+            ttl = float(os.getenv("PHI_AUDIO_LINK_TTL", "300"))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        self._links: "OrderedDict[str, Tuple[float, str, Dict]]" = OrderedDict()
+
+    def issue(self, speech_text: str, voice_settings: Dict) -> str:
+        """登记一次合成请求，返回 token"""
+        token = secrets.token_urlsafe(16)
+        if self.backend is not None:
+            self.backend.compare_and_set(
+                f"audio:{token}", 0, {"text": speech_text, "voice_settings": voice_settings}, ttl=self.ttl
+            )
+            return token
+        self._purge()
+        self._links[token] = (time.monotonic() + self.ttl, speech_text, dict(voice_settings))
+        while len(self._links) > self.max_entries:
+            self._links.popitem(last=False)
+        return token
+
+    async def aissue(self, speech_text: str, voice_settings: Dict) -> str:
+        """issue() 的异步版本（写入共享存储在 threadpool 中执行）"""
+        if self.backend is None:
+            return self.issue(speech_text, voice_settings)
+        return await asyncio.to_thread(self.issue, speech_text, voice_settings)
+
+    def resolve(self, token: str) -> Optional[Tuple[str, Dict]]:
+        """取得 token 对应的 (语音文本, 语音设置)；不存在或已过期时返回 None（有效期内可重复请求）"""
+        if self.backend is not None:
+            shared = self.backend.load(f"audio:{token}")
+            return (shared[1]["text"], shared[1]["voice_settings"]) if shared is not None else None
+        entry = self._links.get(token)
+        if entry is None:
+            return None
+        expires_at, speech_text, voice_settings = entry
+        if expires_at < time.monotonic():
+            del self._links[token]
+            return None
+        return speech_text, voice_settings
+
+    async def aresolve(self, token: str) -> Optional[Tuple[str, Dict]]:
+        """resolve() 的异步版本（读取共享存储在 threadpool 中执行）"""
+        if self.backend is None:
+            return self.resolve(token)
+        return await asyncio.to_thread(self.resolve, token)
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._links:
+            token, (expires_at, _, _) = next(iter(self._links.items()))
+            if expires_at >= now:
+                break
+            del self._links[token]
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def stats(self):
+        if self.backend is not None:
+            return {"backend": self.backend.name}
+        return {"backend": "memory", "links": len(self._links)}
@@ -0,0 +1,191 @@
+"""
+Audio Sweeper - static/output 临时音讯文件的生命周期管理
+生成的音讯文件登记到期时间，由单个周期性清扫任务统一删除，不再为每个文件挂一个睡眠协程。
+未登记的文件（如重启前生成、到期登记已丢失）按修改时间 + TTL 判定过期，启动时立即清扫一次，
+因此部署重启不会遗留文件；目录总大小超出配额时，从最旧的临时文件开始提前删除。
+TTS 缓存文件 (tts_ 前缀) 由 TTSCache 自行按 LRU 管理，这里只计入配额、不删除
+（写入中断遗留的 .tmp 文件除外；修改时间在宽限期内的 .tmp 可能正在写入，不会删除）。
+
+配置:
+    PHI_AUDIO_FILE_TTL       临时音讯文件的保留秒数，默认 600
+    PHI_AUDIO_SWEEP_INTERVAL 清扫间隔秒数，默认 60
+    PHI_OUTPUT_MAX_MB        输出目录总大小配额（MB），默认 500
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+from tts_cache import CACHE_FILE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 修改时间在此秒数内的 .tmp 文件视为正在写入（可能属于其他 worker），清扫与配额都跳过
+TMP_GRACE_SECONDS = 300
+
+
+class AudioSweeper:
+    """到期索引 + 周期清扫 + 目录配额"""
+
+    def __init__(
+        self,
+        output_dir: str,
+        ttl: Optional[float] = None,
+        interval: Optional[float] = None,
+        max_bytes: Optional[int] = None
+    ):
+        """
+        Args:
+            output_dir: 输出目录（static/output）
+            ttl: 未指定到期时间的文件保留秒数 (PHI_AUDIO_FILE_TTL)
+            interval: 清扫间隔秒数 (PHI_AUDIO_SWEEP_INTERVAL)
+            max_bytes: 目录总大小配额 (PHI_OUTPUT_MAX_MB)
+        """
+        if ttl is None:
+            ttl = float(os.getenv("PHI_AUDIO_FILE_TTL", "600"))
+        if interval is None:
+            interval = float(os.getenv("PHI_AUDIO_SWEEP_INTERVAL", "60"))
+        if max_bytes is None:
+            max_bytes = int(os.getenv("PHI_OUTPUT_MAX_MB", "500")) * 1024 * 1024
+
+        self.output_dir = output_dir
+        self.ttl = ttl
+        self.interval = interval
+        self.max_bytes = max_bytes
+
+        # 文件名 -> 到期时间（time.time()，与 mtime 同一时钟）
+        self._expiry: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.files = 0
+        self.bytes_on_disk = 0
+        self.sweeps = 0
+        self.reclaimed_files = 0
+        self.reclaimed_bytes = 0
+        self.quota_evictions = 0
+        self.last_sweep_ms = 0.0
+
+        os.makedirs(output_dir, exist_ok=True)
+
+    def register(self, file_path: str, ttl: Optional[float] = None):
+        """登记一个临时文件，到期后由清扫任务删除"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._expiry[os.path.basename(file_path)] = expires_at
+
+    # ---- 清扫 ----
+
+    def sweep(self) -> int:
+        """扫描目录，删除过期文件并执行配额；返回本次删除的文件数（同步，含磁盘 I/O）"""
+        started = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            expiry = dict(self._expiry)
+
+        total_bytes = 0
+        files = 0
+        removable = []  # (到期时间, 文件名, 大小)
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                total_bytes += stat.st_size
+                files += 1
+                if entry.name.endswith(".tmp"):
+                    if stat.st_mtime + TMP_GRACE_SECONDS > now:
+                        continue
+                elif entry.name.startswith(CACHE_FILE_PREFIX):
+                    continue
+                expires_at = expiry.get(entry.name, stat.st_mtime + self.ttl)
+                removable.append((expires_at, entry.name, stat.st_size))
+
+        removable.sort()
+        removed = 0
+        for expires_at, name, size in removable:
+            expired = expires_at <= now
+            if not expired and total_bytes <= self.max_bytes:
+                break
+            if self._remove(name, size):
+                total_bytes -= size
+                files -= 1
+                removed += 1
+                if not expired:
+                    self.quota_evictions += 1
+
+        # 清除已不存在的文件的登记
+        with self._lock:
+            for name in [name for name, expires_at in self._expiry.items() if expires_at <= now]:
+                if not os.path.exists(os.path.join(self.output_dir, name)):
+                    del self._expiry[name]
+
+        self.files = files
+        self.bytes_on_disk = total_bytes
+        self.sweeps += 1
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        if removed:
+            logger.info(f"🗑️ Audio sweeper reclaimed {removed} files ({files} files, {total_bytes} bytes left)")
+        if total_bytes > self.max_bytes:
+            logger.warning(f"⚠️ Output dir still over quota: {total_bytes} > {self.max_bytes} bytes (TTS cache files are not swept)")
+        return removed
+
+    def _remove(self, name: str, size: int) -> bool:
+        try:
+            os.remove(os.path.join(self.output_dir, name))
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f"Failed to cleanup file {name}: {e}")
+            return False
+        with self._lock:
+            self._expiry.pop(name, None)
+        self.reclaimed_files += 1
+        self.reclaimed_bytes += size
+        return True
+
+    # ---- 周期任务 ----
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Audio sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """启动周期清扫（首次清扫立即执行，回收重启前遗留的文件）"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._expiry)
+        return {
+            "pending": pending,
+            "files": self.files,
+            "bytes_on_disk": self.bytes_on_disk,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "sweeps": self.sweeps,
+            "reclaimed_files": self.reclaimed_files,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "quota_evictions": self.quota_evictions,
+            "last_sweep_ms": round(self.last_sweep_ms, 2),
+        }
@@ -0,0 +1,71 @@
+"""
+Boot - 启动阶段的环境加载与分阶段计时
+.env 在整个进程中只解析一次；启动过程按阶段计时，就绪时输出一行耗时明细，
+并在 /health 中提供，便于定位冷启动慢在哪一步。
+"""
+
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_env_loaded = False
+
+
+def load_env(base_dir: Optional[str] = None):
+    """
+    加载项目目录下的 .env（进程内只执行一次）
+
+    存在 .env 时覆盖同名环境变量（本地开发）；不存在时只使用系统环境变量（Railway/生产环境）。
+    以 utf-8-sig 读取，兼容 Windows 编辑器写入的 BOM。
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    env_path = os.path.join(base_dir, ".env")
+    if not os.path.exists(env_path):
+        logger.info("No .env file found, using system environment variables (Railway/production mode)")
+        return
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        logger.warning("python-dotenv 未安装，忽略 .env，使用系统环境变量")
+        return
+    load_dotenv(env_path, override=True, encoding="utf-8-sig")
+    logger.info(f"Loaded environment from {env_path}")
+
+
+class BootTimer:
+    """按阶段记录启动耗时（从创建到 ready() 为止）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_seconds: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """with boot.phase("imports"): ... —— 记录一个阶段的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def ready(self):
+        """标记就绪并输出各阶段耗时"""
+        self.ready_seconds = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        logger.info(f"🚀 Boot ready in {self.ready_seconds * 1000:.0f}ms ({breakdown})")
+
+    def stats(self) -> Dict:
+        return {
+            "ready_ms": round(self.ready_seconds * 1000, 1) if self.ready_seconds is not None else None,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases},
+        }
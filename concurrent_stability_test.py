@@ -1,77 +1,36 @@
-﻿import requests
-import threading
-import time
-from datetime import datetime
+﻿"""
+Concurrent Stability Test - 并发稳定性检查
+以离线压测套件 (load_test.py) 对各端点施加持续并发负载（默认 20 并发、每端点 100 个请求），
+任何请求失败或服务崩溃即判定失败。
 
-results = []
-lock = threading.Lock()
-errors = []
+用法: python concurrent_stability_test.py [load_test.py 的其他参数，如 --concurrency 50]
+"""
 
-def send_request(request_id):
-    url = "http://localhost:8000/tts"
-    payload = {
-        "text": f"撟嗅?瘚?霂瑟? {request_id}",
-        "text_language": "zh",
-        "arousal_level": 2
-    }
-    
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload, timeout=30)
-        elapsed = time.time() - start_time
-        
-        with lock:
-            results.append({
-                "id": request_id,
-                "status": response.status_code,
-                "time": elapsed,
-                "success": response.status_code == 200,
-                "size": len(response.content) if response.status_code == 200 else 0
-            })
-    except Exception as e:
-        elapsed = time.time() - start_time
-        with lock:
-            errors.append({
-                "id": request_id,
-                "error": str(e),
-                "time": elapsed
-            })
+import sys
+import asyncio
+import logging
 
-print("Sending 3 concurrent requests...")
-print()
-
-# Start 3 concurrent requests
-threads = []
-for i in range(1, 4):
-    t = threading.Thread(target=send_request, args=(i,))
-    threads.append(t)
-    t.start()
+from load_test import build_parser, run_load_test
 
-# Wait for all threads
-for t in threads:
-    t.join()
-
-# Report results
-print("=" * 60)
-print("Concurrent Test Results")
-print("=" * 60)
-print()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
-all_pass = True
-for result in results:
-    status_icon = "[PASS]" if result["success"] else "[FAIL]"
-    print(f"{status_icon} Request {result['id']}: {result['time']:.2f}s (Status: {result['status']}, Size: {result['size']} bytes)")
-
-for error in errors:
-    print(f"[FAIL] Request {error['id']}: Error after {error['time']:.2f}s - {error['error']}")
-    all_pass = False
+args = build_parser().parse_args(["--concurrency", "20", "--requests", "100"] + sys.argv[1:])
+try:
+    summaries = asyncio.run(run_load_test(args))
+except Exception as e:
+    print(f"FAIL: Load test aborted - {e}")
+    sys.exit(1)
 
 print()
-
-if len(results) == 3 and all(result["success"] for result in results):
-    print("PASS: All 3 concurrent requests succeeded")
+if all(s["errors"] == 0 for s in summaries):
+    total = sum(s["requests"] for s in summaries)
+    print(f"PASS: All {total} concurrent requests succeeded")
     print("PASS: No memory overflow or crash detected")
     sys.exit(0)
 else:
+    for s in summaries:
+        if s["errors"]:
+            print(f"[FAIL] {s['endpoint']}: {s['errors']}/{s['requests']} requests failed ({s['statuses']})")
     print("FAIL: Some requests failed or system crashed")
     sys.exit(1)
@@ -0,0 +1,120 @@
+"""
+Context Window - 按 token 预算裁剪对话历史，移出窗口的轮次折叠为滚动摘要
+历史按本地估算的 token 数（而非消息条数）裁剪，保证每轮提示词的大小有上限；
+被移出的轮次先进入待摘要队列，由后台任务（不在请求路径上）与旧摘要合并为一段简短的前情提要。
+
+配置:
+    PHI_HISTORY_TOKEN_BUDGET   历史部分的 token 预算，默认 2000
+    PHI_CONTEXT_WINDOW         最多保留的轮数（上限保护），默认 20
+    PHI_SUMMARY_MAX_TOKENS     滚动摘要的 token 上限，默认 300（0 表示关闭摘要，移出的轮次直接丢弃）
+"""
+
+import os
+import re
+import math
+from typing import Dict, List, Optional, Tuple
+
+# 中日韩文字、假名、韩文与全角符号：每个字约 1 个 token；其余字符约 4 个一个 token
+_WIDE_CHARS_RE = re.compile(
+    r"[\u2e80-\u2fdf\u3000-\u303f\u3040-\u30ff\u3100-\u31ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]+"
+)
+# 每条消息的固定开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算文本的 token 数（偏保守，适用于中文为主、夹杂英文与标签的文本）"""
+    if not text:
+        return 0
+    narrow = len(_WIDE_CHARS_RE.sub("", text))
+    return (len(text) - narrow) + math.ceil(narrow / 4)
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(MESSAGE_OVERHEAD_TOKENS + estimate_tokens(msg.get("content", "")) for msg in messages)
+
+
+class ContextWindow:
+    """历史裁剪策略（配置在初始化时读取一次）"""
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        max_turns: Optional[int] = None,
+        summary_max_tokens: Optional[int] = None
+    ):
+        """
+        Args:
+            token_budget: 历史部分的 token 预算 (PHI_HISTORY_TOKEN_BUDGET)
+            max_turns: 最多保留的轮数 (PHI_CONTEXT_WINDOW)
+            summary_max_tokens: 滚动摘要的 token 上限 (PHI_SUMMARY_MAX_TOKENS)
+        """
+        if token_budget is None:
+            token_budget = int(os.getenv("PHI_HISTORY_TOKEN_BUDGET", "2000"))
+        if max_turns is None:
+            max_turns = int(os.getenv("PHI_CONTEXT_WINDOW", "20"))
+        if summary_max_tokens is None:
+            summary_max_tokens = int(os.getenv("PHI_SUMMARY_MAX_TOKENS", "300"))
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_max_tokens = summary_max_tokens
+
+    @property
+    def summaries_enabled(self) -> bool:
+        return self.summary_max_tokens > 0
+
+    def trim(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        从最旧的轮次开始原地移除，直到历史不超过轮数上限与 token 预算；返回被移除的消息
+
+        以 user + assistant 为一轮整体移除，至少保留最近一轮。
+        """
+        tokens = estimate_message_tokens(history)
+        cut = 0
+        while len(history) - cut > 2 and (
+            len(history) - cut > self.max_turns * 2 or tokens > self.token_budget
+        ):
+            tokens -= estimate_message_tokens(history[cut:cut + 2])
+            cut += 2
+        evicted = history[:cut]
+        del history[:cut]
+        return evicted
+
+    # ---- 滚动摘要 ----
+
+    def summary_request(self, summary: str, evicted: List[Dict[str, str]]) -> Tuple[str, str]:
+        """
+        构建摘要请求
+
+        Returns:
+            (系统提示词动态尾部, 用户消息)；静态前缀沿用对话的人格前缀，以复用提供商的前缀缓存
+        """
+        limit_chars = self.summary_max_tokens
+        instruction = (
+            "【本次請求不是對話】請作為記錄員，把「已有摘要」與「新移出的對話」合併為一段新的前情提要。"
+            f"用第三人稱正體中文 (繁體中文)，保留稱呼、關係進展、約定、偏好與重要事實，省略寒暄與動作描寫，"
+            f"不超過 {limit_chars} 字，只輸出摘要正文，不要任何標籤或前後綴。"
+        )
+        transcript = "\n".join(
+            f"{'主人' if msg['role'] == 'user' else '菲菲'}：{msg.get('content', '')}" for msg in evicted
+        )
+        # 摘要會注入系統提示詞，與人格設定一致使用繁體中文
+        user_message = f"已有摘要：\n{summary or '（無）'}\n\n新移出的對話：\n{transcript}"
+        return instruction, user_message
+
+    def clamp_summary(self, text: str) -> str:
+        """把摘要限制在 token 上限内（模型未遵守字数要求时从尾部截断）"""
+        text = " ".join(text.split())
+        while text and estimate_tokens(text) > self.summary_max_tokens:
+            overflow = estimate_tokens(text) - self.summary_max_tokens
+            text = text[:max(len(text) - max(overflow, 1), 0)]
+        return text
+
+    def fallback_summary(self, summary: str, evicted: List[Dict[str, str]]) -> str:
+        """摘要请求失败时的本地兜底：保留每条主人消息的开头，拼接到旧摘要后并截断"""
+        snippets = [msg.get("content", "")[:40] for msg in evicted if msg.get("role") == "user"]
+        merged = (summary + " " if summary else "") + "主人曾提到：" + "；".join(snippets)
+        # 保留最新的内容：超出上限时从开头截断
+        while merged and estimate_tokens(merged) > self.summary_max_tokens:
+            merged = merged[max(estimate_tokens(merged) - self.summary_max_tokens, 1):]
+        return merged
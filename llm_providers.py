@@ -0,0 +1,951 @@
+"""
+LLM Providers - 大模型提供商适配层
+每个后端（OpenAI / OpenRouter、Claude、Gemini）一个适配器，对外统一为：
+
+    async for chunk in provider.stream(messages, system, params):
+        chunk.text / chunk.usage / chunk.finish_reason
+
+消息格式转换、限流、重试与错误解析只在这里实现一次，PhiBrain 只需选择适配器，
+流式、对冲、指标与缓存等能力可以在此接口之上对所有提供商统一构建。
+"""
+
+import os
+import time
+import hashlib
+import datetime
+import json
+import sys
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Optional, Dict, List, Tuple, AsyncIterator
+
+from rate_limiter import (
+    RETRYABLE_STATUSES, UpstreamLimiter, get_limiter, backoff_delay, max_retries, retry_after_from_error
+)
+from metrics import LLM_REQUESTS, LLM_TTFT, LLM_DURATION, LLM_TOKENS, UPSTREAM_RETRIES
+
+# 各提供商的 SDK 只在对应适配器建立时导入：导入 openai / anthropic / google.generativeai
+# 各需数百毫秒，未配置的提供商不应拖慢冷启动
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_MESSAGE = "API 请求频率过高（429）：已达到速率限制。主人~菲菲累了，请等 60 秒再找我~"
+
+# 各提供商的结束原因 -> 统一的结束原因 ("stop" / "length" / "safety" / "other")
+FINISH_REASONS = {
+    "stop": "stop",
+    "end_turn": "stop",
+    "stop_sequence": "stop",
+    "STOP": "stop",
+    "length": "length",
+    "max_tokens": "length",
+    "MAX_TOKENS": "length",
+    "content_filter": "safety",
+    "refusal": "safety",
+    "SAFETY": "safety",
+    "RECITATION": "safety",
+    "BLOCKLIST": "safety",
+    "PROHIBITED_CONTENT": "safety",
+    "SPII": "safety",
+}
+
+
+def normalize_finish_reason(reason) -> Optional[str]:
+    if not reason:
+        return None
+    return FINISH_REASONS.get(str(reason), "other")
+
+
+class ProviderError(ValueError):
+    """提供商调用失败（消息为面向用户的友好文本，沿用 ValueError 以兼容既有的错误处理）"""
+
+    def __init__(
+        self,
+        message: str,
+        status: Optional[int] = None,
+        retryable: bool = False,
+        retry_after: Optional[float] = None
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class SystemPrompt:
+    """系统提示词：静态前缀（可被提供商缓存）+ 每轮变化的动态尾部"""
+
+    __slots__ = ("static", "dynamic")
+
+    def __init__(self, static: str, dynamic: str = ""):
+        self.static = static
+        self.dynamic = dynamic
+
+
+class GenerationParams:
+    """单轮生成参数；session 为该轮所属的 SessionState（Gemini 用于复用常驻 ChatSession）"""
+
+    __slots__ = ("model", "temperature", "max_tokens", "session")
+
+    def __init__(self, model: str, temperature: float = 0.7, max_tokens: Optional[int] = None, session=None):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.session = session
+
+
+class TokenUsage:
+    """统一的 token 用量（cached_tokens 为命中提供商前缀缓存的输入 token 数）"""
+
+    __slots__ = ("input_tokens", "output_tokens", "cached_tokens")
+
+    def __init__(self, input_tokens: int = 0, output_tokens: int = 0, cached_tokens: int = 0):
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+        self.cached_tokens = cached_tokens or 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+        }
+
+
+class LLMChunk:
+    """
+    流式输出的一个分块：文本增量，以及（通常在最后出现的）用量与结束原因
+
+    usage 为截至该分块的累计用量，后出现的覆盖先出现的。
+    model 为实际生成该分块的模型（对冲时可能是次提供商的模型），为空表示请求的模型；
+    failed_models 为首 token 前已失败、由其他模型接手的模型（只出现在第一个分块上）。
+    """
+
+    __slots__ = ("text", "usage", "finish_reason", "model", "failed_models")
+
+    def __init__(
+        self,
+        text: str = "",
+        usage: Optional[TokenUsage] = None,
+        finish_reason: Optional[str] = None,
+        model: Optional[str] = None,
+        failed_models: Tuple[str, ...] = ()
+    ):
+        self.text = text
+        self.usage = usage
+        self.finish_reason = finish_reason
+        self.model = model
+        self.failed_models = failed_models
+
+
+class LLMResult:
+    """一次完整生成的结果（文本、用量、结束原因、实际回答的模型），也可由流式分块累积而成"""
+
+    __slots__ = ("_parts", "usage", "finish_reason", "model")
+
+    def __init__(self, text: str = "", usage: Optional[TokenUsage] = None, finish_reason: Optional[str] = None):
+        self._parts: List[str] = [text] if text else []
+        self.usage = usage
+        self.finish_reason = finish_reason
+        # 为空表示请求的模型
+        self.model: Optional[str] = None
+
+    def add(self, chunk: LLMChunk):
+        if chunk.text:
+            self._parts.append(chunk.text)
+        if chunk.model is not None:
+            self.model = chunk.model
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if chunk.finish_reason is not None:
+            self.finish_reason = chunk.finish_reason
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+
+class LLMProvider:
+    """
+    提供商适配器基类
+
+    子类实现:
+        _prepare(messages, system, params) -> 请求对象（各提供商自定义）
+        _complete_turn(request) -> LLMResult        （同步，一次调用）
+        _astream_turn(request) -> AsyncIterator[LLMChunk]（异步流式，一次调用）
+    可选覆盖 _aprepare / _rewind / _abort / commit_turn / translate_error。
+    子类在 __init__ 中设置 self.limiter = get_limiter(name, api_key)，同一 Key 的调用共享限流额度。
+
+    messages 为 OpenAI 风格的对话列表（历史 + 本轮用户消息，最后一条为 user）。
+
+    SDK 自带的隐式重试均已关闭；可重试错误（429、5xx、超时、连接失败）统一在这里
+    以带抖动的指数退避异步重试（尊重 Retry-After），重试次数见 PHI_UPSTREAM_MAX_RETRIES。
+    """
+
+    name = ""
+    label = "LLM"
+    key_env = ""
+    default_max_tokens = 600
+
+    model: Optional[str] = None
+    limiter: Optional[UpstreamLimiter] = None
+
+    # ---- 统一接口 ----
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        system: SystemPrompt,
+        params: GenerationParams
+    ) -> AsyncIterator[LLMChunk]:
+        """流式生成；只在尚未产出任何内容时重试，避免重复输出"""
+        began = time.monotonic()
+        request = await self._aprepare(messages, system, params)
+        budget = self._estimate_tokens(messages, system, params)
+        retries = max_retries()
+        first_token = False
+        try:
+            for attempt in range(retries + 1):
+                await self.limiter.acquire(budget)
+                started = False
+                usage = None
+                try:
+                    async for chunk in self._astream_turn(request):
+                        started = True
+                        if chunk.text and not first_token:
+                            first_token = True
+                            LLM_TTFT.observe(time.monotonic() - began, provider=self.name, model=params.model)
+                        usage = chunk.usage or usage
+                        yield chunk
+                    self._settle(budget, usage)
+                    self._observe(params, began, usage)
+                    return
+                except ProviderError:
+                    raise
+                except Exception as e:
+                    error = self.translate_error(e)
+                    if started or not self._should_retry(error, attempt, retries):
+                        raise error from e
+                    self.limiter.settle(budget, 0)
+                    self._rewind(request)
+                    await asyncio.sleep(self._retry_delay(error, attempt, retries))
+        except BaseException as e:
+            self._observe_failure(params, e)
+            self._abort(request)
+            raise
+
+    async def acomplete(
+        self,
+        messages: List[Dict[str, str]],
+        system: SystemPrompt,
+        params: GenerationParams
+    ) -> LLMResult:
+        """异步生成完整回复（累积 stream 的分块）"""
+        result = LLMResult()
+        async for chunk in self.stream(messages, system, params):
+            result.add(chunk)
+        return result
+
+    def complete(
+        self,
+        messages: List[Dict[str, str]],
+        system: SystemPrompt,
+        params: GenerationParams
+    ) -> LLMResult:
+        """同步生成完整回复（供脚本与测试使用）"""
+        began = time.monotonic()
+        request = self._prepare(messages, system, params)
+        budget = self._estimate_tokens(messages, system, params)
+        retries = max_retries()
+        try:
+            for attempt in range(retries + 1):
+                self.limiter.acquire_sync(budget)
+                try:
+                    result = self._complete_turn(request)
+                    self._settle(budget, result.usage)
+                    self._observe(params, began, result.usage)
+                    return result
+                except ProviderError:
+                    raise
+                except Exception as e:
+                    error = self.translate_error(e)
+                    if not self._should_retry(error, attempt, retries):
+                        raise error from e
+                    self.limiter.settle(budget, 0)
+                    self._rewind(request)
+                    time.sleep(self._retry_delay(error, attempt, retries))
+        except BaseException as e:
+            self._observe_failure(params, e)
+            self._abort(request)
+            raise
+
+    def commit_turn(self, session):
+        """本轮回复写入会话历史后调用（Gemini 用于同步常驻 ChatSession）"""
+
+    # ---- 子类实现 ----
+
+    def _prepare(self, messages: List[Dict[str, str]], system: SystemPrompt, params: GenerationParams):
+        raise NotImplementedError
+
+    async def _aprepare(self, messages: List[Dict[str, str]], system: SystemPrompt, params: GenerationParams):
+        return self._prepare(messages, system, params)
+
+    def _complete_turn(self, request) -> LLMResult:
+        raise NotImplementedError
+
+    def _astream_turn(self, request) -> AsyncIterator[LLMChunk]:
+        raise NotImplementedError
+
+    def _rewind(self, request):
+        """重试前清理上一次尝试残留的状态"""
+
+    def _abort(self, request):
+        """本轮失败或被取消时调用"""
+
+    # ---- 限流 ----
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]], system: SystemPrompt, params: GenerationParams) -> int:
+        """预估本次调用的 token 消耗（按字符数保守估计输入，加上输出上限），完成后按实际用量修正"""
+        prompt_chars = len(system.static) + len(system.dynamic) + sum(len(msg.get("content", "")) for msg in messages)
+        return prompt_chars + (params.max_tokens or self.default_max_tokens)
+
+    def _settle(self, budget: int, usage: Optional[TokenUsage]):
+        if usage is not None:
+            self.limiter.settle(budget, usage.input_tokens + usage.output_tokens)
+
+    # ---- 指标 ----
+
+    def _observe(self, params: GenerationParams, began: float, usage: Optional[TokenUsage]):
+        LLM_REQUESTS.inc(provider=self.name, model=params.model, status="ok")
+        LLM_DURATION.observe(time.monotonic() - began, provider=self.name, model=params.model)
+        if usage is not None:
+            LLM_TOKENS.inc(usage.input_tokens, provider=self.name, model=params.model, kind="input")
+            LLM_TOKENS.inc(usage.output_tokens, provider=self.name, model=params.model, kind="output")
+            LLM_TOKENS.inc(usage.cached_tokens, provider=self.name, model=params.model, kind="cached")
+
+    def _observe_failure(self, params: GenerationParams, error: BaseException):
+        if isinstance(error, ProviderError):
+            status = str(error.status or "error")
+        elif isinstance(error, Exception):
+            status = "error"
+        else:
+            # 被取消（对冲落败、客户端断开）或消费方提前关闭流
+            status = "cancelled"
+        LLM_REQUESTS.inc(provider=self.name, model=params.model, status=status)
+
+    # ---- 错误处理 ----
+
+    @staticmethod
+    def _should_retry(error: ProviderError, attempt: int, retries: int) -> bool:
+        return error.retryable and attempt < retries
+
+    def _retry_delay(self, error: ProviderError, attempt: int, retries: int) -> float:
+        """重试前的等待秒数；429 时按 Retry-After 暂停同一 Key 的所有调用，在再次触发限流前把请求平滑开"""
+        delay = backoff_delay(attempt, error.retry_after)
+        if error.status == 429:
+            self.limiter.penalize(delay)
+        UPSTREAM_RETRIES.inc(upstream=self.name, status=error.status or "connection")
+        logger.warning(
+            f"{self.label} API 错误 ({error.status or '连接失败'})，等待 {delay:.1f} 秒后重试 ({attempt + 1}/{retries})"
+        )
+        return delay
+
+    @staticmethod
+    def _error_status(error: Exception) -> Optional[int]:
+        """提取 HTTP 状态码（openai / anthropic 的 status_code，google.api_core 的 code）"""
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return status
+        code = getattr(error, "code", None)
+        return code if isinstance(code, int) else None
+
+    @staticmethod
+    def _error_detail(error: Exception) -> str:
+        """提取错误详情（优先使用响应体中的 error.message）"""
+        body = getattr(error, "body", None)
+        if isinstance(body, dict):
+            info = body.get("error", body)
+            if isinstance(info, dict) and info.get("message"):
+                return str(info["message"])
+            if isinstance(info, str):
+                return info
+        message = getattr(error, "message", None)
+        return str(message) if message else str(error)
+
+    def translate_error(self, error: Exception) -> ProviderError:
+        """将 SDK 异常转换为带友好消息的 ProviderError"""
+        status = self._error_status(error)
+        detail = self._error_detail(error)
+        lowered = detail.lower()
+        retry_after = retry_after_from_error(error)
+
+        if status == 429 or "429" in detail or "quota" in lowered or "rate limit" in lowered:
+            return ProviderError(RATE_LIMIT_MESSAGE, status=429, retryable=True, retry_after=retry_after)
+        if status == 401 or "401" in detail or "unauthorized" in lowered:
+            return ProviderError(self._auth_error_message(detail), status=401)
+        # 超时、连接失败与 5xx 为瞬时错误，可重试
+        retryable = status in RETRYABLE_STATUSES or isinstance(error, _connection_errors())
+        return ProviderError(
+            f"{self.label} API 错误 ({status or '未知'}): {detail}",
+            status=status,
+            retryable=retryable,
+            retry_after=retry_after
+        )
+
+    def _auth_error_message(self, detail: str) -> str:
+        return f"API 认证失败（401）：请检查 {self.key_env} 是否正确配置在 .env 文件中"
+
+
+def _connection_errors() -> Tuple[type, ...]:
+    """已加载 SDK 的连接错误类型（不为此导入尚未使用的 SDK）"""
+    errors: Tuple[type, ...] = (asyncio.TimeoutError,)
+    for module_name in ("openai", "anthropic"):
+        module = sys.modules.get(module_name)
+        if module is not None:
+            errors += (module.APIConnectionError,)
+    return errors
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI 兼容接口（OpenAI 与 OpenRouter）"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        openrouter: bool = False
+    ):
+        self.openrouter = openrouter
+        self.name = "openrouter" if openrouter else "openai"
+        self.label = "OpenRouter" if openrouter else "OpenAI"
+        self.key_env = "OPENROUTER_API_KEY" if openrouter else "OPENAI_API_KEY"
+
+        api_key = api_key or os.getenv(self.key_env)
+        if not api_key:
+            raise ValueError(f"未找到 {self.key_env}，请在 .env 文件中设置或通过参数传入")
+
+        if openrouter:
+            # OpenRouter 规范请求头
+            self.default_headers = {
+                "HTTP-Referer": os.getenv("OPENROUTER_REFERER", "https://github.com/Project-Phi"),
+                "X-Title": os.getenv("OPENROUTER_TITLE", "Project Phi")
+            }
+            base_url = base_url or "https://openrouter.ai/api/v1"
+
+            # 设置默认模型（优先使用 nitro 无过滤版本）
+            default_model = os.getenv("OPENROUTER_MODEL", "meta-llama/llama-3-70b-instruct:nitro")
+            if not model:
+                self.model = default_model if ":" in default_model else f"{default_model}:nitro"
+            else:
+                self.model = model
+        else:
+            self.default_headers = {}
+            self.model = model or "gpt-4"
+
+        import openai
+
+        # OpenRouter 使用 OpenAI 兼容接口，通过 default_headers 传递；
+        # 关闭 SDK 的隐式重试，由 LLMProvider 统一限流与退避
+        self.client = openai.OpenAI(
+            api_key=api_key, base_url=base_url, default_headers=self.default_headers or None, max_retries=0
+        )
+        self.async_client = openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url, default_headers=self.default_headers or None, max_retries=0
+        )
+        self.limiter = get_limiter(self.name, api_key)
+
+    def _prepare(self, messages, system, params) -> Dict:
+        # 静态前缀单独作为第一条 system 消息，动态尾部放在其后，
+        # 保证请求开头逐字节稳定，以命中服务端的自动前缀缓存
+        return {
+            "model": params.model,
+            "messages": [
+                {"role": "system", "content": system.static},
+                {"role": "system", "content": system.dynamic},
+            ] + messages,
+            "temperature": params.temperature,
+            "max_tokens": params.max_tokens or self.default_max_tokens,
+            "extra_body": {
+                "transforms": [],  # 禁用 OpenRouter 的內部審查過濾器
+                "repetition_penalty": 1.15  # 防止重复（非标准参数，SDK 只能经由 extra_body 传递）
+            },
+        }
+
+    @staticmethod
+    def _usage(usage) -> Optional[TokenUsage]:
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        return TokenUsage(
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cached_tokens=getattr(details, "cached_tokens", 0) if details is not None else 0,
+        )
+
+    def _complete_turn(self, request) -> LLMResult:
+        response = self.client.chat.completions.create(**request)
+        choice = response.choices[0]
+        return LLMResult(
+            choice.message.content or "",
+            self._usage(response.usage),
+            normalize_finish_reason(choice.finish_reason),
+        )
+
+    async def _astream_turn(self, request) -> AsyncIterator[LLMChunk]:
+        stream = await self.async_client.chat.completions.create(
+            **request,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            text, finish_reason = "", None
+            if chunk.choices:
+                choice = chunk.choices[0]
+                text = choice.delta.content or ""
+                finish_reason = normalize_finish_reason(choice.finish_reason)
+            usage = self._usage(chunk.usage)
+            if text or usage or finish_reason:
+                yield LLMChunk(text, usage, finish_reason)
+
+    def _auth_error_message(self, detail: str) -> str:
+        # 检查是否是 "User not found" 错误（API Key 无效）
+        if "user not found" in detail.lower():
+            return "API Key 无效或已过期（401）：当前 OPENROUTER_API_KEY 无效，请前往 https://openrouter.ai/keys 获取新的 API Key 并更新 .env 文件"
+        return super()._auth_error_message(detail)
+
+
+class ClaudeProvider(LLMProvider):
+    """Anthropic Claude"""
+
+    name = "claude"
+    label = "Claude"
+    key_env = "ANTHROPIC_API_KEY"
+    default_max_tokens = 500
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        api_key = api_key or os.getenv(self.key_env)
+        if not api_key:
+            raise ValueError("未找到 ANTHROPIC_API_KEY，请在 .env 文件中设置或通过参数传入")
+        from anthropic import Anthropic, AsyncAnthropic
+
+        self.client = Anthropic(api_key=api_key, max_retries=0)
+        self.async_client = AsyncAnthropic(api_key=api_key, max_retries=0)
+        self.limiter = get_limiter(self.name, api_key)
+        self.model = model or "claude-3-opus-20240229"
+
+    def _prepare(self, messages, system, params) -> Dict:
+        return {
+            "model": params.model,
+            "max_tokens": params.max_tokens or self.default_max_tokens,
+            # 在静态前缀末尾设置 cache_control 断点，动态尾部不参与缓存
+            "system": [
+                {"type": "text", "text": system.static, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": system.dynamic},
+            ],
+            "messages": messages,
+            # 当前 SDK 的 create()/stream() 不再提供 temperature 参数，经由 extra_body 传递
+            "extra_body": {"temperature": params.temperature},
+        }
+
+    @staticmethod
+    def _usage(usage) -> Optional[TokenUsage]:
+        if usage is None:
+            return None
+        return TokenUsage(
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cached_tokens=getattr(usage, "cache_read_input_tokens", 0),
+        )
+
+    def _complete_turn(self, request) -> LLMResult:
+        response = self.client.messages.create(**request)
+        text = "".join(block.text for block in response.content if block.type == "text")
+        return LLMResult(text, self._usage(response.usage), normalize_finish_reason(response.stop_reason))
+
+    async def _astream_turn(self, request) -> AsyncIterator[LLMChunk]:
+        async with self.async_client.messages.stream(**request) as stream:
+            async for text in stream.text_stream:
+                yield LLMChunk(text)
+            final = await stream.get_final_message()
+        yield LLMChunk("", self._usage(final.usage), normalize_finish_reason(final.stop_reason))
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini
+
+    静态前缀优先走 CachedContent，模型实例按 (模型, 前缀哈希, 安全设置) 缓存复用；
+    每个会话常驻一个 ChatSession，每轮只发送新消息，动态尾部作为本轮用户消息的第一个 part。
+    """
+
+    name = "gemini"
+    label = "Gemini"
+    key_env = "GEMINI_API_KEY"
+
+    # 无过滤安全设置 (Critical)
+    SAFETY_SETTINGS = [
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+    ]
+
+    # 关闭 google.api_core 对 503 的隐式重试（默认退避最长 600 秒），由 LLMProvider 统一重试
+    REQUEST_OPTIONS = {"retry": None}
+
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        api_key = api_key or os.getenv(self.key_env)
+        if not api_key:
+            raise ValueError("未找到 GEMINI_API_KEY，请在 .env 文件中设置或通过参数传入")
+
+        try:
+            import google.generativeai as genai
+        except ImportError:
+            raise ImportError("google-generativeai 未安装，请运行: pip install google-generativeai") from None
+
+        genai.configure(api_key=api_key)
+        self.client = genai
+        self.limiter = get_limiter(self.name, api_key)
+        # PhiBrain 的 model 参数默认值是 OpenRouter 模型名，此时改用 GEMINI_MODEL
+        if not model or model == "meta-llama/llama-3-70b-instruct":
+            self.model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+        else:
+            self.model = model
+        self.safety_settings = list(self.SAFETY_SETTINGS)
+        self._safety_key = json.dumps(self.safety_settings, sort_keys=True)
+
+        # CachedContent 句柄、模型实例缓存：(模型, 前缀哈希, 安全设置) -> (CachedContent 名称, 模型实例)
+        self.context_cache = os.getenv("PHI_GEMINI_CONTEXT_CACHE", "1") != "0"
+        self.cache_ttl = int(os.getenv("PHI_GEMINI_CACHE_TTL", "3600"))
+        # 瞬时错误（5xx、超时、429）后暂停创建的秒数，到期后重试
+        self.cache_retry_seconds = float(os.getenv("PHI_GEMINI_CACHE_RETRY", "60"))
+        self._caches: Dict[Tuple[str, str], Tuple[object, float]] = {}
+        # 永久不可用：模型不支持缓存时记模型名，前缀低于最小 token 数时记 (模型, 前缀哈希)
+        self._cache_unsupported = set()
+        self._cache_retry_at: Dict[Tuple[str, str], float] = {}
+        # 同一键的冷创建只发一次请求，其余线程等待结果
+        self._cache_inflight: Dict[Tuple[str, str], Future] = {}
+        self._cache_lock = threading.Lock()
+        self._models: Dict[Tuple[str, str, str], Tuple[Optional[str], object]] = {}
+        self._prompt_digests: Dict[str, str] = {}
+
+        logger.info(f"Gemini 配置完成，模型: {self.model}, 安全设置: BLOCK_NONE")
+
+    # ---- 模型与前缀缓存 ----
+
+    def _prompt_digest(self, prompt: str) -> str:
+        """提示词的 SHA-256（按字符串缓存，静态前缀每个人格只计算一次）"""
+        digest = self._prompt_digests.get(prompt)
+        if digest is None:
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+            self._prompt_digests[prompt] = digest
+        return digest
+
+    def _cached_content(self, model_name: str, static_prompt: str):
+        """
+        获取（必要时创建）静态前缀对应的 Gemini CachedContent
+
+        按 (模型, 前缀哈希) 复用，临近过期时重建；并发的冷创建合并为一次请求。
+        模型不支持或前缀低于最小 token 数时永久记住并返回 None，之后直接走普通 system_instruction；
+        其他错误只暂停 cache_retry_seconds，之后再尝试创建。
+        """
+        if not self.context_cache or model_name in self._cache_unsupported:
+            return None
+
+        cache_key = (model_name, self._prompt_digest(static_prompt))
+        with self._cache_lock:
+            if cache_key in self._cache_unsupported or self._cache_retry_at.get(cache_key, 0.0) > time.monotonic():
+                return None
+            entry = self._caches.get(cache_key)
+            # 预留 60 秒余量，避免请求途中缓存过期
+            if entry is not None and entry[1] - 60 > time.monotonic():
+                return entry[0]
+            future = self._cache_inflight.get(cache_key)
+            if future is not None:
+                owner = False
+            else:
+                owner = True
+                future = self._cache_inflight[cache_key] = Future()
+
+        # 本函数在 threadpool（或同步调用方）中执行，阻塞等待不会占用事件循环
+        if not owner:
+            return future.result()
+
+        cached_content = None
+        try:
+            cached_content = self._create_cached_content(cache_key, static_prompt)
+        finally:
+            with self._cache_lock:
+                self._cache_inflight.pop(cache_key, None)
+            future.set_result(cached_content)
+        return cached_content
+
+    def _create_cached_content(self, cache_key: Tuple[str, str], static_prompt: str):
+        model_name = cache_key[0]
+        try:
+            cached_content = self.client.caching.CachedContent.create(
+                model=model_name,
+                display_name=f"phi-static-{cache_key[1][:12]}",
+                system_instruction=static_prompt,
+                ttl=datetime.timedelta(seconds=self.cache_ttl),
+            )
+        except Exception as e:
+            unsupported = self._cache_unsupported_scope(e)
+            with self._cache_lock:
+                if unsupported == "model":
+                    self._cache_unsupported.add(model_name)
+                elif unsupported == "prompt":
+                    self._cache_unsupported.add(cache_key)
+                else:
+                    self._cache_retry_at[cache_key] = time.monotonic() + self.cache_retry_seconds
+            if unsupported:
+                logger.warning(f"Gemini context cache unavailable for {model_name}, using plain system_instruction: {e}")
+            else:
+                logger.warning(
+                    f"Gemini context cache creation failed for {model_name}, "
+                    f"retrying in {self.cache_retry_seconds:.0f}s: {e}"
+                )
+            return None
+
+        with self._cache_lock:
+            self._caches[cache_key] = (cached_content, time.monotonic() + self.cache_ttl)
+            self._cache_retry_at.pop(cache_key, None)
+        logger.info(f"🧊 Gemini context cache created for {model_name} (ttl={self.cache_ttl}s)")
+        return cached_content
+
+    def _cache_unsupported_scope(self, error: Exception) -> Optional[str]:
+        """
+        判断 CachedContent 创建失败是否为永久性错误
+
+        Returns:
+            "model"（模型或 SDK 不支持缓存）、"prompt"（前缀低于最小 token 数），
+            瞬时错误（5xx、超时、429 等）返回 None
+        """
+        if isinstance(error, (AttributeError, NotImplementedError)):
+            return "model"
+        status = self._error_status(error)
+        if status not in (None, 400, 404):
+            return None
+        lowered = self._error_detail(error).lower()
+        if "token" in lowered and ("minimum" in lowered or "min_total_token_count" in lowered or "too small" in lowered):
+            return "prompt"
+        if "not supported" in lowered or "unsupported" in lowered or "does not support" in lowered:
+            return "model"
+        return None
+
+    def _model_for_turn(self, model_name: str, static_prompt: str) -> Tuple[object, Tuple]:
+        """
+        取得本轮使用的模型实例（按模型、前缀哈希与安全设置缓存复用）
+
+        Returns:
+            (模型实例, 模型键)；模型键用于判断会话内的 ChatSession 能否继续复用
+        """
+        cached_content = self._cached_content(model_name, static_prompt)
+        cache_name = getattr(cached_content, "name", None) if cached_content is not None else None
+        model_key = (model_name, self._prompt_digest(static_prompt), self._safety_key)
+
+        entry = self._models.get(model_key)
+        if entry is not None and entry[0] == cache_name:
+            return entry[1], model_key + (cache_name,)
+
+        model_instance = None
+        if cached_content is not None:
+            try:
+                model_instance = self.client.GenerativeModel.from_cached_content(
+                    cached_content=cached_content,
+                    safety_settings=self.safety_settings
+                )
+            except Exception as e:
+                logger.warning(f"Gemini cached model init failed, using plain system_instruction: {e}")
+
+        if model_instance is None:
+            model_instance = self.client.GenerativeModel(
+                model_name=model_name,
+                safety_settings=self.safety_settings,
+                system_instruction=static_prompt  # 继承 System Prompt（包含无过滤指令）
+            )
+
+        self._models[model_key] = (cache_name, model_instance)
+        return model_instance, model_key + (cache_name,)
+
+    # ---- 会话内常驻 ChatSession ----
+
+    @staticmethod
+    def _build_history(messages: List[Dict[str, str]]) -> List[Dict]:
+        """将 OpenAI 风格的对话历史转换为 Gemini 的 parts 格式"""
+        gemini_messages = []
+        for msg in messages:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            if role == "user":
+                gemini_messages.append({"role": "user", "parts": [content]})
+            elif role == "assistant":
+                gemini_messages.append({"role": "model", "parts": [content]})
+        return gemini_messages
+
+    def _chat_for_turn(self, session, model_instance, model_key: Tuple, history: List[Dict[str, str]]):
+        """
+        取得本轮使用的 ChatSession
+
+        会话内常驻的 ChatSession 与 history 同步且模型未变时直接复用，每轮只追加新消息；
+        模型切换或不同步时从 history 重建。同一会话已有请求在途时，使用临时 ChatSession。
+        """
+        if session is None:
+            return model_instance.start_chat(history=self._build_history(history))
+
+        chat = session.gemini_chat
+        if (
+            chat is not None
+            and not session.gemini_chat_busy
+            and session.gemini_chat_key == model_key
+            and session.gemini_chat_version == session.history_version
+        ):
+            session.gemini_chat_busy = True
+            return chat
+
+        chat = model_instance.start_chat(history=self._build_history(history))
+        if not session.gemini_chat_busy:
+            session.gemini_chat = chat
+            session.gemini_chat_key = model_key
+            session.gemini_chat_version = session.history_version
+            session.gemini_chat_busy = True
+        return chat
+
+    def commit_turn(self, session):
+        """
+        本轮写入 history 后同步常驻 ChatSession
+
+        用纯净文本替换 SDK 自动追加的本轮内容（含动态尾部与标签），并按滑动窗口裁剪，
+        使 ChatSession 的历史与 session.history 保持一致。
+        """
+        chat = session.gemini_chat
+        if chat is None or not session.gemini_chat_busy:
+            return
+        session.gemini_chat_busy = False
+        if session.history_version != session.gemini_chat_version + 1:
+            return
+
+        if chat.last is not None:
+            chat.rewind()
+        chat_history = chat.history
+        for msg in session.history[-2:]:
+            role = "model" if msg["role"] == "assistant" else "user"
+            chat_history.append(self.client.protos.Content(role=role, parts=[self.client.protos.Part(text=msg["content"])]))
+        overflow = len(chat_history) - len(session.history)
+        if overflow > 0:
+            del chat_history[:overflow]
+        session.gemini_chat_version = session.history_version
+
+    # ---- 请求 ----
+
+    def _start_turn(self, model_instance, model_key: Tuple, messages, system, params) -> Dict:
+        chat = self._chat_for_turn(params.session, model_instance, model_key, messages[:-1])
+        return {
+            "chat": chat,
+            "session": params.session,
+            # 动态尾部作为本轮用户消息的第一个 part 发送
+            "parts": [system.dynamic, messages[-1]["content"]],
+            "generation_config": {
+                "temperature": params.temperature,
+                "max_output_tokens": params.max_tokens or self.default_max_tokens,
+            },
+        }
+
+    def _prepare(self, messages, system, params) -> Dict:
+        model_instance, model_key = self._model_for_turn(params.model, system.static)
+        return self._start_turn(model_instance, model_key, messages, system, params)
+
+    async def _aprepare(self, messages, system, params) -> Dict:
+        # 创建/刷新 CachedContent 涉及同步网络请求，放到 threadpool 执行
+        model_instance, model_key = await asyncio.to_thread(self._model_for_turn, params.model, system.static)
+        return self._start_turn(model_instance, model_key, messages, system, params)
+
+    @staticmethod
+    def _usage(response) -> Optional[TokenUsage]:
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None or not (usage.prompt_token_count or usage.candidates_token_count):
+            return None
+        return TokenUsage(
+            input_tokens=usage.prompt_token_count,
+            output_tokens=usage.candidates_token_count,
+            cached_tokens=usage.cached_content_token_count,
+        )
+
+    @staticmethod
+    def _finish_reason(response) -> Optional[str]:
+        if not response.candidates:
+            return None
+        reason = response.candidates[0].finish_reason
+        if not reason:
+            return None
+        return normalize_finish_reason(getattr(reason, "name", reason))
+
+    @staticmethod
+    def _chunk_text(chunk, finish_reason: Optional[str]) -> str:
+        """分块文本；只带结束原因的收尾分块没有 parts，此时返回空串（被安全过滤拦截时照常抛错）"""
+        if chunk.candidates and not chunk.candidates[0].content.parts and finish_reason in (None, "stop", "length"):
+            return ""
+        return chunk.text
+
+    def _complete_turn(self, request) -> LLMResult:
+        response = request["chat"].send_message(
+            request["parts"],
+            generation_config=request["generation_config"],
+            request_options=self.REQUEST_OPTIONS
+        )
+        return LLMResult(response.text, self._usage(response), self._finish_reason(response))
+
+    async def _astream_turn(self, request) -> AsyncIterator[LLMChunk]:
+        response = await request["chat"].send_message_async(
+            request["parts"],
+            generation_config=request["generation_config"],
+            request_options=self.REQUEST_OPTIONS,
+            stream=True
+        )
+        async for chunk in response:
+            finish_reason = self._finish_reason(chunk)
+            text = self._chunk_text(chunk, finish_reason)
+            usage = self._usage(chunk)
+            if text or usage or finish_reason:
+                yield LLMChunk(text, usage, finish_reason)
+
+    def _rewind(self, request):
+        # 丢弃流式响应残留在 ChatSession 中的本轮内容后重试
+        chat = request["chat"]
+        if chat.last is not None:
+            chat.rewind()
+
+    def _abort(self, request):
+        """本轮失败时丢弃常驻 ChatSession（其中可能残留未完成的本轮内容），下轮重建"""
+        session = request["session"]
+        if session is not None and request["chat"] is session.gemini_chat:
+            session.gemini_chat = None
+            session.gemini_chat_busy = False
+
+    def translate_error(self, error: Exception) -> ProviderError:
+        translated = super().translate_error(error)
+        detail = str(error)
+        if translated.status != 429 and ("safety" in detail.lower() or "blocked" in detail.lower()):
+            return ProviderError(f"Gemini 安全过滤器阻止了内容生成。请检查 safety_settings 配置。错误: {detail}")
+        return translated
+
+
+def create_provider(
+    api_type: str,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    model: Optional[str] = None
+) -> LLMProvider:
+    """按 api_type 创建适配器（"openrouter"、"openai"、"claude" 或 "gemini"）"""
+    if api_type == "openrouter":
+        return OpenAIProvider(api_key=api_key, base_url=base_url, model=model, openrouter=True)
+    elif api_type == "openai":
+        return OpenAIProvider(api_key=api_key, base_url=base_url, model=model)
+    elif api_type == "claude":
+        return ClaudeProvider(api_key=api_key, model=model)
+    elif api_type == "gemini":
+        return GeminiProvider(api_key=api_key, model=model)
+    raise ValueError(f"不支持的 API 类型: {api_type}，支持: openrouter, openai, claude, gemini")
@@ -0,0 +1,424 @@
+"""
+Load Test - 离线压测套件
+启动上游替身 (load_test_stubs.py) 与指向替身的 voice_bridge，按设定并发驱动
+/chat、/api/v1/phi_voice、/api/v1/chat，报告各端点的延迟 p50/p95/p99、
+首字节时间 (TTFB)、吞吐量与错误率。全程不需要真实 API Key。
+
+用法:
+    python load_test.py --provider gemini --concurrency 20 --requests 200
+    python load_test.py --provider openai --endpoints chat,phi_voice --ttft 0.8 --llm-error-rate 0.05
+    python load_test.py --json load_test_report.json
+    python load_test.py --workers 4     # 多个 voice_bridge 进程共享端口与 SQLite 会话存储
+
+通过 --ttft / --token-rate / --tts-ttfb / --audio-rate / --*-error-rate 调整替身行为，
+详见 python load_test.py --help。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import asyncio
+import argparse
+import logging
+import shutil
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+from load_test_stubs import StubConfig
+
+logger = logging.getLogger(__name__)
+
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(_base_dir, "static/output")
+
+BRIDGE_API_KEY = "load-test-bridge-key"
+USER_MESSAGES = [
+    "菲菲，今天過得好嗎？",
+    "想我了嗎？",
+    "靠過來一點好不好？",
+    "你在做什麼呀？",
+    "要不要陪我聊天？",
+    "今天穿什麼衣服？",
+]
+
+def _chat_body(delivery: str):
+    return lambda i, sid: {"text": USER_MESSAGES[i % len(USER_MESSAGES)], "session_id": sid, "audio_delivery": delivery}
+
+
+# 端点名称 -> (路径, 请求体构造函数, 是否需要 X-API-KEY, 是否继续请求回传的音讯连结)
+ENDPOINTS = {
+    "chat": ("/chat", _chat_body("url"), False, True),
+    "chat_stream": ("/chat", _chat_body("stream"), False, False),
+    "chat_base64": ("/chat", _chat_body("base64"), False, False),
+    "chat_sse": ("/chat/stream", _chat_body("url"), False, False),
+    "phi_voice": ("/api/v1/phi_voice", lambda i, sid: {"user_input": USER_MESSAGES[i % len(USER_MESSAGES)], "session_id": sid}, False, False),
+    "api_chat": ("/api/v1/chat", lambda i, sid: {"message": USER_MESSAGES[i % len(USER_MESSAGES)], "user_id": sid}, True, False),
+}
+DEFAULT_ENDPOINTS = ("chat", "phi_voice", "api_chat")
+# WebSocket 会话：每个 worker 保持一条长连接，逐轮发送消息，TTFB 计到第一个音讯帧
+WS_ENDPOINT = "ws"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩 (nearest-rank) 百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class EndpointResult:
+    """单个端点的压测样本"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.ttfbs: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self.bytes_received = 0
+        self.elapsed = 0.0
+
+    def record(self, status: str, ok: bool, latency: float, ttfb: Optional[float], nbytes: int):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.bytes_received += nbytes
+        if not ok:
+            self.errors += 1
+            return
+        self.latencies.append(latency)
+        if ttfb is not None:
+            self.ttfbs.append(ttfb)
+
+    def summary(self) -> Dict:
+        total = len(self.latencies) + self.errors
+        return {
+            "endpoint": self.name,
+            "requests": total,
+            "errors": self.errors,
+            "error_rate": self.errors / total if total else 0.0,
+            "throughput_rps": len(self.latencies) / self.elapsed if self.elapsed else 0.0,
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p95": percentile(self.latencies, 95),
+            "latency_p99": percentile(self.latencies, 99),
+            "ttfb_p50": percentile(self.ttfbs, 50),
+            "ttfb_p95": percentile(self.ttfbs, 95),
+            "ttfb_p99": percentile(self.ttfbs, 99),
+            "bytes_received": self.bytes_received,
+            "kb_per_request": self.bytes_received / 1024 / total if total else 0.0,
+            "statuses": self.statuses,
+        }
+
+
+async def run_endpoint(client: httpx.AsyncClient, name: str, total: int, concurrency: int, sessions: int) -> EndpointResult:
+    """以固定并发（闭环：每个 worker 完成一个请求后立即发下一个）驱动单个端点"""
+    path, build_body, needs_key, follow_audio = ENDPOINTS[name]
+    headers = {"X-API-KEY": BRIDGE_API_KEY} if needs_key else {}
+    result = EndpointResult(name)
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            body = build_body(i, f"lt-{name}-{i % sessions}")
+            start = time.perf_counter()
+            ttfb = None
+            nbytes = 0
+            try:
+                async with client.stream("POST", path, json=body, headers=headers) as response:
+                    payload = b""
+                    async for chunk in response.aiter_raw():
+                        if ttfb is None and not follow_audio:
+                            ttfb = time.perf_counter() - start
+                        nbytes += len(chunk)
+                        if follow_audio:
+                            payload += chunk
+                if follow_audio and response.is_success:
+                    # 回传的是音讯连结：TTFB 计到音讯的第一个字节
+                    async with client.stream("GET", json.loads(payload)["audio"]) as response:
+                        async for chunk in response.aiter_raw():
+                            if ttfb is None:
+                                ttfb = time.perf_counter() - start
+                            nbytes += len(chunk)
+                latency = time.perf_counter() - start
+                result.record(str(response.status_code), response.is_success, latency, ttfb, nbytes)
+            except httpx.HTTPError as e:
+                result.record(type(e).__name__, False, time.perf_counter() - start, None, nbytes)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+async def run_ws_endpoint(base_url: str, total: int, concurrency: int, timeout: float) -> EndpointResult:
+    """以固定并发驱动 /ws/session/{id}：每个 worker 一条长连接（一个会话），每轮等待 turn_end"""
+    import websockets
+
+    result = EndpointResult(WS_ENDPOINT)
+    counter = iter(range(total))
+
+    async def worker(w: int):
+        url = base_url.replace("http", "ws", 1) + f"/ws/session/lt-ws-{w}"
+        async with websockets.connect(url, max_size=None) as ws:
+            json.loads(await ws.recv())  # ready
+            for i in counter:
+                await ws.send(json.dumps({"type": "message", "text": USER_MESSAGES[i % len(USER_MESSAGES)]}))
+                start = time.perf_counter()
+                ttfb = None
+                nbytes = 0
+                status = "ok"
+                try:
+                    while True:
+                        frame = await asyncio.wait_for(ws.recv(), timeout=timeout)
+                        if isinstance(frame, bytes):
+                            if ttfb is None:
+                                ttfb = time.perf_counter() - start
+                            nbytes += len(frame)
+                            continue
+                        event = json.loads(frame)
+                        if event["type"] == "error":
+                            status = str(event.get("status"))
+                            if "seq" not in event:
+                                break
+                        elif event["type"] == "turn_end":
+                            break
+                except asyncio.TimeoutError:
+                    status = "TimeoutError"
+                result.record(status, status == "ok", time.perf_counter() - start, ttfb, nbytes)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def print_report(summaries: List[Dict], upstream: Dict, settings: Dict):
+    print("\n" + "=" * 108)
+    print(f"Phi Voice Bridge 压测报告  provider={settings['provider']}  concurrency={settings['concurrency']}  "
+          f"requests/endpoint={settings['requests']}")
+    print("=" * 108)
+    print(f"{'endpoint':<12}{'reqs':>6}{'errors':>8}{'err%':>7}{'rps':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttfb50':>9}{'ttfb95':>9}{'ttfb99':>9}{'KB/req':>8}  statuses")
+    for s in summaries:
+        statuses = ",".join(f"{k}:{v}" for k, v in sorted(s["statuses"].items()))
+        print(f"{s['endpoint']:<12}{s['requests']:>6}{s['errors']:>8}{s['error_rate'] * 100:>6.1f}%{s['throughput_rps']:>8.1f}"
+              f"{_fmt(s['latency_p50']):>9}{_fmt(s['latency_p95']):>9}{_fmt(s['latency_p99']):>9}"
+              f"{_fmt(s['ttfb_p50']):>9}{_fmt(s['ttfb_p95']):>9}{_fmt(s['ttfb_p99']):>9}{s['kb_per_request']:>8.1f}  {statuses}")
+    print(f"\n上游替身调用: {json.dumps(upstream, ensure_ascii=False)}")
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    """轮询直到服务可用（子进程提前退出时立即报错）"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"进程提前退出 (code {process.returncode}): {url}")
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"等待服务就绪超时: {url}")
+
+
+def bridge_env(args, http_port: int, gemini_port: int) -> Dict[str, str]:
+    """voice_bridge 子进程的环境变量：全部上游指向本机替身"""
+    return {
+        "GEMINI_API_KEY": "load-test-gemini-key",
+        "ELEVENLABS_API_KEY": "load-test-elevenlabs-key",
+        "ELEVENLABS_BASE_URL": f"http://127.0.0.1:{http_port}",
+        "BRIDGE_API_KEY": BRIDGE_API_KEY,
+        "PHI_GEMINI_CONTEXT_CACHE": "0",
+        "PHI_TTS_CACHE_ENABLED": "1" if args.tts_cache else "0",
+        "PHI_LOAD_TEST_PROVIDER": args.provider,
+        "PHI_LOAD_TEST_OPENAI_URL": f"http://127.0.0.1:{http_port}/v1",
+        "PHI_LOAD_TEST_GEMINI_ENDPOINT": f"127.0.0.1:{gemini_port}",
+    }
+
+
+def serve_bridge(port: int, reuse_port: bool = False):
+    """
+    （子进程）运行指向替身的 voice_bridge
+
+    .env 会覆盖进程环境变量，因此导入 voice_bridge 后重新套用压测设定。
+    reuse_port 时以 SO_REUSEPORT 绑定，多个进程共用同一端口，由内核分配连接（模拟 uvicorn --workers）。
+    """
+    stub_env = {k: v for k, v in os.environ.items() if k.startswith(("PHI_", "ELEVENLABS_", "BRIDGE_"))}
+    import uvicorn
+    import voice_bridge
+    from phi_brain import PhiBrain, PersonalityMode
+    from load_test_stubs import configure_gemini_client
+
+    os.environ.update(stub_env)
+    voice_bridge.tts_cache.enabled = stub_env.get("PHI_TTS_CACHE_ENABLED") != "0"
+    provider = stub_env["PHI_LOAD_TEST_PROVIDER"]
+
+    async def main():
+        if provider == "openai":
+            voice_bridge.brain = PhiBrain(
+                api_type="openai",
+                api_key="load-test-openai-key",
+                base_url=stub_env["PHI_LOAD_TEST_OPENAI_URL"],
+                model="stub-model",
+                personality=PersonalityMode.MIXED,
+                session_backend=voice_bridge.session_backend
+            )
+        else:
+            if voice_bridge.brain is None:
+                raise RuntimeError(f"PhiBrain 初始化失败: {voice_bridge.brain_init_error}")
+            voice_bridge.brain.provider.context_cache = False
+            configure_gemini_client(stub_env["PHI_LOAD_TEST_GEMINI_ENDPOINT"])
+
+        server = uvicorn.Server(uvicorn.Config(voice_bridge.app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+        if reuse_port:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("127.0.0.1", port))
+            await server.serve(sockets=[sock])
+        else:
+            await server.serve()
+
+    asyncio.run(main())
+
+
+def _terminate(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run_load_test(args) -> List[Dict]:
+    """启动替身与 voice_bridge，依次压测各端点，返回各端点的统计摘要"""
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS and name != WS_ENDPOINT]
+    if unknown:
+        raise ValueError(f"未知端点: {unknown}（可选: {', '.join(ENDPOINTS)}, {WS_ENDPOINT}）")
+
+    http_port, gemini_port, bridge_port = free_port(), free_port(), free_port()
+    quiet = None if args.verbose else subprocess.DEVNULL
+    existing_files = set(os.listdir(OUTPUT_DIR)) if os.path.isdir(OUTPUT_DIR) else set()
+    stubs = None
+    bridges: List[subprocess.Popen] = []
+    session_dir = None
+    try:
+        stubs = subprocess.Popen(
+            [sys.executable, os.path.join(_base_dir, "load_test_stubs.py"),
+             "--http-port", str(http_port), "--gemini-port", str(gemini_port),
+             "--seed", str(args.seed)] + StubConfig.from_args(args).to_argv(),
+            stdout=quiet, stderr=quiet
+        )
+        await wait_ready(f"http://127.0.0.1:{http_port}/stats", stubs)
+
+        env = dict(os.environ)
+        env.update(bridge_env(args, http_port, gemini_port))
+        serve_argv = [sys.executable, os.path.abspath(__file__), "--serve-bridge", str(bridge_port)]
+        if args.workers > 1:
+            # 多个 worker 共享一个临时 SQLite 会话存储（除非已通过 PHI_SESSION_BACKEND 指定）
+            if not env.get("PHI_SESSION_BACKEND"):
+                session_dir = tempfile.mkdtemp(prefix="phi_sessions_")
+                env["PHI_SESSION_BACKEND"] = f"sqlite:///{os.path.join(session_dir, 'sessions.db')}"
+            serve_argv.append("--reuse-port")
+        for _ in range(args.workers):
+            bridges.append(subprocess.Popen(serve_argv, env=env, cwd=_base_dir, stdout=quiet, stderr=quiet))
+        for bridge in bridges:
+            await wait_ready(f"http://127.0.0.1:{bridge_port}/health", bridge)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        summaries = []
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{bridge_port}", timeout=args.timeout, limits=limits) as client:
+            for name in endpoints:
+                logger.info(f"🚀 压测 {name}: {args.requests} 个请求, 并发 {args.concurrency}")
+                if name == WS_ENDPOINT:
+                    result = await run_ws_endpoint(f"http://127.0.0.1:{bridge_port}", args.requests, args.concurrency, args.timeout)
+                else:
+                    result = await run_endpoint(client, name, args.requests, args.concurrency, args.sessions)
+                summaries.append(result.summary())
+            upstream = (await client.get(f"http://127.0.0.1:{http_port}/stats")).json()
+            if args.metrics:
+                with open(args.metrics, "w", encoding="utf-8") as f:
+                    f.write((await client.get("/metrics")).text)
+
+        if args.workers > 1:
+            print(f"worker 进程: {args.workers}  会话存储: {env['PHI_SESSION_BACKEND']}")
+        print_report(summaries, upstream, vars(args))
+        if args.metrics:
+            print(f"/metrics 快照已写入 {args.metrics}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"settings": vars(args), "endpoints": summaries, "upstream": upstream}, f, ensure_ascii=False, indent=2)
+            print(f"报告已写入 {args.json}")
+        return summaries
+    finally:
+        for bridge in bridges:
+            _terminate(bridge)
+        _terminate(stubs)
+        if session_dir is not None:
+            shutil.rmtree(session_dir, ignore_errors=True)
+        # 清理压测期间生成的音讯文件
+        if os.path.isdir(OUTPUT_DIR):
+            for name in set(os.listdir(OUTPUT_DIR)) - existing_files:
+                try:
+                    os.remove(os.path.join(OUTPUT_DIR, name))
+                except OSError:
+                    pass
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Phi Voice Bridge 离线压测（上游 API 全部由本机替身提供）")
+    parser.add_argument("--provider", choices=["gemini", "openai"], default="gemini", help="大脑使用的上游 LLM 替身")
+    parser.add_argument("--endpoints", default=",".join(DEFAULT_ENDPOINTS), help=f"要压测的端点，逗号分隔（{', '.join(ENDPOINTS)}, {WS_ENDPOINT}）")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发数")
+    parser.add_argument("--requests", type=int, default=50, help="每个端点的请求数")
+    parser.add_argument("--sessions", type=int, default=20, help="轮替使用的会话数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求超时（秒）")
+    parser.add_argument("--tts-cache", action="store_true", help="启用 voice_bridge 的 TTS 快取（默认关闭）")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="任一端点错误率超过此值时以非零状态退出")
+    parser.add_argument("--json", help="将报告另存为 JSON")
+    parser.add_argument("--metrics", help="压测结束时将 voice_bridge 的 /metrics 快照写入此文件")
+    parser.add_argument("--verbose", action="store_true", help="显示替身与 voice_bridge 的日志")
+    parser.add_argument("--workers", type=int, default=1, help="voice_bridge 进程数（>1 时共享端口与 SQLite 会话存储）")
+    parser.add_argument("--serve-bridge", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--reuse-port", action="store_true", help=argparse.SUPPRESS)
+    StubConfig.add_arguments(parser)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.serve_bridge:
+        serve_bridge(args.serve_bridge, reuse_port=args.reuse_port)
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    summaries = asyncio.run(run_load_test(args))
+    if args.max_error_rate is not None and any(s["error_rate"] > args.max_error_rate for s in summaries):
+        print(f"❌ 错误率超过上限 {args.max_error_rate:.1%}")
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""
+Load Test Stubs - 压测用的上游 API 替身
+在本机启动 OpenAI 兼容、Gemini（gRPC）与 ElevenLabs 兼容的替身服务，
+可设定首 token 延迟、token 速率、音讯首字节延迟与字节速率，并按比例注入错误，
+压测时不需要真实 API Key，也不消耗配额。
+
+用法:
+    python load_test_stubs.py --http-port 9100 --gemini-port 9101 --ttft 0.4 --token-rate 40
+    （通常由 load_test.py 自动启动）
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from typing import Dict, List
+
+import grpc
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+# 替身回复的组成片段：模拟真实回复中的 STATE 标签、语音标签与括号动作
+REPLY_OPENERS = ["[STATE:1]", "[STATE:2]", "[STATE:3]", "[STATE:2][giggle]", "[STATE:4][gasp]"]
+REPLY_FRAGMENTS = [
+    "主人", "你來啦", "！", "菲菲", "好想你", "。", "(害羞地低下頭)", "今天", "要陪我嗎", "？",
+    "嗯", "...", "(輕輕拉住主人的衣角)", "討厭啦", "，", "你又", "欺負人家", "～", "（脸红到耳根）",
+    "主人的手", "好溫暖", "(貼近主人)", "菲菲", "只屬於", "主人喔", "[sigh]", "再", "抱緊一點",
+]
+
+
+class StubConfig:
+    """替身服务的行为参数"""
+
+    def __init__(
+        self,
+        ttft: float = 0.4,
+        token_rate: float = 40.0,
+        reply_tokens: int = 30,
+        tts_ttfb: float = 0.25,
+        audio_rate: int = 160000,
+        audio_bytes_per_char: int = 2000,
+        llm_error_rate: float = 0.0,
+        tts_error_rate: float = 0.0,
+        error_status: int = 429,
+        seed: int = 0
+    ):
+        """
+        Args:
+            ttft: LLM 首 token 延迟（秒）
+            token_rate: LLM 每秒输出 token 数
+            reply_tokens: 每次回复的 token 数
+            tts_ttfb: TTS 首字节延迟（秒）
+            audio_rate: TTS 音讯输出速率（字节/秒）
+            audio_bytes_per_char: 每个输入字符对应的音讯字节数（128kbps 下约 0.12 秒/字）
+            llm_error_rate / tts_error_rate: 注入错误的概率 (0-1)
+            error_status: 注入错误的 HTTP 状态码（Gemini 按对应的 gRPC 状态返回）
+        """
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.tts_ttfb = tts_ttfb
+        self.audio_rate = audio_rate
+        self.audio_bytes_per_char = audio_bytes_per_char
+        self.llm_error_rate = llm_error_rate
+        self.tts_error_rate = tts_error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        """在命令行参数中加入替身行为参数（load_test.py 共用）"""
+        defaults = cls()
+        parser.add_argument("--ttft", type=float, default=defaults.ttft, help="LLM 首 token 延迟（秒）")
+        parser.add_argument("--token-rate", type=float, default=defaults.token_rate, help="LLM 每秒 token 数")
+        parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens, help="每次回复的 token 数")
+        parser.add_argument("--tts-ttfb", type=float, default=defaults.tts_ttfb, help="TTS 首字节延迟（秒）")
+        parser.add_argument("--audio-rate", type=int, default=defaults.audio_rate, help="TTS 音讯速率（字节/秒）")
+        parser.add_argument("--audio-bytes-per-char", type=int, default=defaults.audio_bytes_per_char, help="每个字符的音讯字节数")
+        parser.add_argument("--llm-error-rate", type=float, default=defaults.llm_error_rate, help="LLM 错误注入概率")
+        parser.add_argument("--tts-error-rate", type=float, default=defaults.tts_error_rate, help="TTS 错误注入概率")
+        parser.add_argument("--error-status", type=int, default=defaults.error_status, help="注入错误的 HTTP 状态码")
+        parser.add_argument("--seed", type=int, default=0, help="随机种子")
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "StubConfig":
+        return cls(
+            ttft=args.ttft,
+            token_rate=args.token_rate,
+            reply_tokens=args.reply_tokens,
+            tts_ttfb=args.tts_ttfb,
+            audio_rate=args.audio_rate,
+            audio_bytes_per_char=args.audio_bytes_per_char,
+            llm_error_rate=args.llm_error_rate,
+            tts_error_rate=args.tts_error_rate,
+            error_status=args.error_status,
+            seed=args.seed,
+        )
+
+    def to_argv(self) -> List[str]:
+        """转换回命令行参数（用于启动子进程）"""
+        return [
+            "--ttft", str(self.ttft),
+            "--token-rate", str(self.token_rate),
+            "--reply-tokens", str(self.reply_tokens),
+            "--tts-ttfb", str(self.tts_ttfb),
+            "--audio-rate", str(self.audio_rate),
+            "--audio-bytes-per-char", str(self.audio_bytes_per_char),
+            "--llm-error-rate", str(self.llm_error_rate),
+            "--tts-error-rate", str(self.tts_error_rate),
+            "--error-status", str(self.error_status),
+        ]
+
+    def reply_tokens_list(self) -> List[str]:
+        """生成一段替身回复（每次不同，避免 TTS 快取命中让结果失真）"""
+        tokens = [self.rng.choice(REPLY_OPENERS)]
+        while len(tokens) < self.reply_tokens:
+            tokens.append(self.rng.choice(REPLY_FRAGMENTS))
+        return tokens
+
+    def should_fail(self, rate: float) -> bool:
+        return rate > 0 and self.rng.random() < rate
+
+
+class StubStats:
+    """替身服务的调用计数（经由 GET /stats 查询）"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+
+    def incr(self, name: str):
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+
+async def _token_stream(config: StubConfig):
+    """按首 token 延迟与 token 速率逐个产出 token"""
+    await asyncio.sleep(config.ttft)
+    interval = 1.0 / config.token_rate if config.token_rate > 0 else 0
+    for index, token in enumerate(config.reply_tokens_list()):
+        if index and interval:
+            await asyncio.sleep(interval)
+        yield token
+
+
+def create_http_app(config: StubConfig, stats: StubStats) -> FastAPI:
+    """OpenAI 兼容 (/v1/chat/completions) 与 ElevenLabs 兼容 (/v1/text-to-speech/...) 的替身"""
+    app = FastAPI(title="Phi Load Test Stubs")
+
+    def error_response(kind: str) -> JSONResponse:
+        stats.incr(f"{kind}_injected_errors")
+        return JSONResponse(
+            status_code=config.error_status,
+            content={"error": {"message": f"Injected {config.error_status} error", "code": config.error_status}},
+            headers={"Retry-After": "1"},
+        )
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.counters
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats.incr("llm_requests")
+        if config.should_fail(config.llm_error_rate):
+            return error_response("llm")
+
+        model = body.get("model", "stub-model")
+        created = int(time.time())
+        completion_id = f"chatcmpl-stub-{created}"
+
+        if not body.get("stream"):
+            text = "".join([token async for token in _token_stream(config)])
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": config.reply_tokens, "total_tokens": config.reply_tokens},
+            }
+
+        async def sse():
+            async for token in _token_stream(config):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    async def text_to_speech(voice_id: str, request: Request):
+        body = await request.json()
+        stats.incr("tts_requests")
+        if config.should_fail(config.tts_error_rate):
+            return error_response("tts")
+
+        total = max(len(body.get("text", "")), 1) * config.audio_bytes_per_char
+        chunk_size = 4096
+
+        async def audio():
+            await asyncio.sleep(config.tts_ttfb)
+            sent = 0
+            while sent < total:
+                size = min(chunk_size, total - sent)
+                if config.audio_rate > 0:
+                    await asyncio.sleep(size / config.audio_rate)
+                yield (b"ID3" + bytes(size - 3)) if sent == 0 and size > 3 else bytes(size)
+                sent += size
+
+        return StreamingResponse(audio(), media_type="audio/mpeg")
+
+    app.add_api_route("/v1/text-to-speech/{voice_id}", text_to_speech, methods=["POST"])
+    app.add_api_route("/v1/text-to-speech/{voice_id}/stream", text_to_speech, methods=["POST"])
+    return app
+
+
+def create_gemini_server(config: StubConfig, stats: StubStats, port: int) -> grpc.aio.Server:
+    """Gemini 替身：以明文 gRPC 实现 GenerateContent / StreamGenerateContent"""
+    from google.ai import generativelanguage_v1beta as glm
+
+    def make_response(text: str, finished: bool):
+        finish_reason = glm.Candidate.FinishReason.STOP if finished else glm.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED
+        return glm.GenerateContentResponse(candidates=[
+            glm.Candidate(
+                content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+                finish_reason=finish_reason,
+            )
+        ])
+
+    async def maybe_fail(context):
+        if config.should_fail(config.llm_error_rate):
+            stats.incr("llm_injected_errors")
+            code = grpc.StatusCode.RESOURCE_EXHAUSTED if config.error_status == 429 else grpc.StatusCode.UNAVAILABLE
+            await context.abort(code, f"{config.error_status} Injected error (quota)")
+
+    async def generate_content(request, context):
+        stats.incr("llm_requests")
+        await maybe_fail(context)
+        text = "".join([token async for token in _token_stream(config)])
+        return make_response(text, finished=True)
+
+    async def stream_generate_content(request, context):
+        stats.incr("llm_requests")
+        await maybe_fail(context)
+        # 延后一个 token 发送，使最后一个分块带上 STOP
+        last = None
+        async for token in _token_stream(config):
+            if last is not None:
+                yield make_response(last, finished=False)
+            last = token
+        if last is not None:
+            yield make_response(last, finished=True)
+
+    handler = grpc.method_handlers_generic_handler(GEMINI_SERVICE, {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        ),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            stream_generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        ),
+    })
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((handler,))
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    return server
+
+
+def configure_gemini_client(endpoint: str):
+    """
+    将 google-generativeai 的生成服务客户端指向明文 gRPC 替身端点
+
+    SDK 只支持以 TLS 连接官方端点，这里为 SDK 预先注册使用明文通道的客户端。
+    必须在将要发出请求的事件循环中调用（gRPC aio 通道绑定创建时的事件循环）。
+    """
+    from google.ai import generativelanguage_v1beta as glm
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+        GenerativeServiceGrpcAsyncIOTransport,
+        GenerativeServiceGrpcTransport,
+    )
+    from google.generativeai import client as genai_client
+
+    manager = genai_client._client_manager
+    manager.clients["generative"] = glm.GenerativeServiceClient(
+        transport=GenerativeServiceGrpcTransport(host=endpoint, channel=grpc.insecure_channel(endpoint))
+    )
+    manager.clients["generative_async"] = glm.GenerativeServiceAsyncClient(
+        transport=GenerativeServiceGrpcAsyncIOTransport(host=endpoint, channel=grpc.aio.insecure_channel(endpoint))
+    )
+
+
+async def serve_stubs(config: StubConfig, http_port: int, gemini_port: int):
+    """在同一事件循环中运行 HTTP 替身与 Gemini gRPC 替身"""
+    stats = StubStats()
+    gemini_server = create_gemini_server(config, stats, gemini_port)
+    await gemini_server.start()
+    http_server = uvicorn.Server(uvicorn.Config(
+        create_http_app(config, stats),
+        host="127.0.0.1",
+        port=http_port,
+        log_level="warning",
+        access_log=False,
+    ))
+    logger.info(f"Stubs ready: http=127.0.0.1:{http_port} gemini=127.0.0.1:{gemini_port}")
+    try:
+        await http_server.serve()
+    finally:
+        await gemini_server.stop(grace=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phi 压测上游替身 (OpenAI / Gemini / ElevenLabs)")
+    parser.add_argument("--http-port", type=int, default=9100, help="OpenAI 与 ElevenLabs 替身端口")
+    parser.add_argument("--gemini-port", type=int, default=9101, help="Gemini gRPC 替身端口")
+    StubConfig.add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(serve_stubs(StubConfig.from_args(args), args.http_port, args.gemini_port))
+
+
+if __name__ == '__main__':
+    main()
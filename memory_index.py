@@ -0,0 +1,207 @@
+"""
+Memory Index - 长期记忆的分块检索
+记忆文档在加载时按段落切块，建立字符 n-gram 的 BM25 词法索引（中文无需分词）；
+每轮只把与当前消息及最近对话最相关的 top-k 块注入提示词，并受 token 上限约束。
+主记忆文件开头的一小段身份设定作为核心记忆，始终放在静态前缀中。
+
+配置:
+    LONG_TERM_MEMORY_PATH      主记忆文件，默认 k/FAY024.md
+    PHI_MEMORY_DIR             其他记忆文档所在目录（*.md / *.txt），默认与主记忆文件相同
+    PHI_MEMORY_CORE_CHARS      核心记忆字数上限（主记忆文件开头的完整段落），默认 400
+    PHI_MEMORY_CHUNK_CHARS     每块的目标字数，默认 300
+    PHI_MEMORY_TOP_K           每轮最多注入的块数，默认 4
+    PHI_MEMORY_TOKEN_BUDGET    每轮注入记忆的 token 上限，默认 600
+"""
+
+import os
+import re
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+from context_window import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字连续片段（取字符二元组）与其他语言的单词（按小写整词）
+_WIDE_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 得分低于最高分的这个比例的块视为噪声（只命中“你的”“什麼”之类常见二元组）
+MIN_RELATIVE_SCORE = 0.3
+
+
+def tokenize(text: str) -> List[str]:
+    """字符二元组（中日韩）+ 单字（只有一个字的片段）+ 小写单词"""
+    terms = []
+    for run in _WIDE_RUN_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    terms.extend(word.lower() for word in _WORD_RE.findall(text))
+    return terms
+
+
+class MemoryChunk:
+    """一个记忆块"""
+
+    __slots__ = ("source", "position", "text", "tokens", "terms", "length")
+
+    def __init__(self, source: str, position: int, text: str):
+        self.source = source
+        self.position = position
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.terms = Counter(tokenize(text))
+        self.length = sum(self.terms.values())
+
+
+def split_paragraphs(text: str, chunk_chars: int) -> List[str]:
+    """按空行切分段落，把过短的相邻段落合并到约 chunk_chars 字"""
+    chunks: List[str] = []
+    current = ""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > chunk_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class MemoryIndex:
+    """核心记忆 + 记忆块的 BM25 索引"""
+
+    def __init__(
+        self,
+        primary_path: Optional[str],
+        memory_dir: Optional[str] = None,
+        core_chars: Optional[int] = None,
+        chunk_chars: Optional[int] = None,
+        top_k: Optional[int] = None,
+        token_budget: Optional[int] = None
+    ):
+        """
+        Args:
+            primary_path: 主记忆文件（开头的段落作为核心记忆）
+            memory_dir: 其他记忆文档所在目录 (PHI_MEMORY_DIR)
+            core_chars: 核心记忆字数上限 (PHI_MEMORY_CORE_CHARS)
+            chunk_chars: 每块的目标字数 (PHI_MEMORY_CHUNK_CHARS)
+            top_k: 每轮最多注入的块数 (PHI_MEMORY_TOP_K)
+            token_budget: 每轮注入记忆的 token 上限 (PHI_MEMORY_TOKEN_BUDGET)
+        """
+        if memory_dir is None:
+            memory_dir = os.getenv("PHI_MEMORY_DIR") or (os.path.dirname(primary_path) if primary_path else None)
+        self.core_chars = core_chars if core_chars is not None else int(os.getenv("PHI_MEMORY_CORE_CHARS", "400"))
+        self.chunk_chars = chunk_chars if chunk_chars is not None else int(os.getenv("PHI_MEMORY_CHUNK_CHARS", "300"))
+        self.top_k = top_k if top_k is not None else int(os.getenv("PHI_MEMORY_TOP_K", "4"))
+        self.token_budget = token_budget if token_budget is not None else int(os.getenv("PHI_MEMORY_TOKEN_BUDGET", "600"))
+
+        self.core = ""
+        self.chunks: List[MemoryChunk] = []
+        self.total_chars = 0
+        self.sources: List[str] = []
+
+        for path in self._document_paths(primary_path, memory_dir):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read().strip()
+            except OSError as e:
+                logger.warning(f"Error loading memory file {path}: {e}")
+                continue
+            self.sources.append(path)
+            self.total_chars += len(text)
+            self._add_document(path, text, is_primary=(path == primary_path))
+
+        # 文档频率与平均块长
+        self._df: Counter = Counter()
+        for chunk in self.chunks:
+            self._df.update(chunk.terms.keys())
+        self._avg_length = sum(chunk.length for chunk in self.chunks) / len(self.chunks) if self.chunks else 0.0
+
+    @staticmethod
+    def _document_paths(primary_path: Optional[str], memory_dir: Optional[str]) -> List[str]:
+        paths = []
+        if primary_path and os.path.exists(primary_path):
+            paths.append(primary_path)
+        if memory_dir and os.path.isdir(memory_dir):
+            for name in sorted(os.listdir(memory_dir)):
+                path = os.path.join(memory_dir, name)
+                if name.endswith((".md", ".txt")) and os.path.isfile(path) and path not in paths:
+                    paths.append(path)
+        return paths
+
+    def _add_document(self, path: str, text: str, is_primary: bool):
+        paragraphs = [p.strip() for p in _PARAGRAPH_RE.split(text) if p.strip()]
+        if is_primary:
+            # 开头的完整段落（不超过 core_chars 字）作为核心记忆，始终注入
+            core = []
+            while paragraphs and len("\n\n".join(core + [paragraphs[0]])) <= self.core_chars:
+                core.append(paragraphs.pop(0))
+            self.core = "\n\n".join(core)
+        source = os.path.basename(path)
+        for text_chunk in split_paragraphs("\n\n".join(paragraphs), self.chunk_chars):
+            self.chunks.append(MemoryChunk(source, len(self.chunks), text_chunk))
+
+    # ---- 检索 ----
+
+    def _score(self, chunk: MemoryChunk, query_terms: Counter) -> float:
+        score = 0.0
+        n = len(self.chunks)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * chunk.length / (self._avg_length or 1.0))
+        for term in query_terms:
+            tf = chunk.terms.get(term)
+            if not tf:
+                continue
+            df = self._df[term]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return score
+
+    def search(self, query: str, top_k: Optional[int] = None, token_budget: Optional[int] = None) -> List[MemoryChunk]:
+        """返回与 query 最相关的记忆块（按文档顺序排列，总 token 数不超过上限）"""
+        top_k = self.top_k if top_k is None else top_k
+        token_budget = self.token_budget if token_budget is None else token_budget
+        query_terms = Counter(tokenize(query))
+        if not query_terms or not self.chunks or top_k <= 0:
+            return []
+
+        scored = sorted(
+            ((self._score(chunk, query_terms), chunk) for chunk in self.chunks),
+            key=lambda item: -item[0]
+        )
+        if not scored or scored[0][0] <= 0:
+            return []
+        threshold = scored[0][0] * MIN_RELATIVE_SCORE
+
+        selected: List[MemoryChunk] = []
+        used = 0
+        for score, chunk in scored:
+            if len(selected) >= top_k or score < threshold:
+                break
+            if used + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+        return sorted(selected, key=lambda chunk: chunk.position)
+
+    def stats(self) -> Dict:
+        return {
+            "sources": [os.path.basename(path) for path in self.sources],
+            "total_chars": self.total_chars,
+            "core_chars": len(self.core),
+            "chunks": len(self.chunks),
+            "top_k": self.top_k,
+            "token_budget": self.token_budget,
+        }
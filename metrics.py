@@ -0,0 +1,209 @@
+"""
+Metrics - Prometheus 文本格式的指标
+零依赖实现 Counter / Histogram，供 /metrics 端点输出 (text/plain; version=0.0.4)。
+各模块在关键路径上直接调用 observe()/inc()；连接池、限流器、准入控制等已有的统计
+通过 register_collector() 在抓取时转换为指标，避免重复计数。
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认桶（秒）：覆盖上游调用的毫秒级到分钟级
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 本地 CPU / 磁盘操作（文本处理、base64、文件写入）
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """累计桶直方图"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数..., 总和, 总数]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with histogram.time(step="render"): ... —— 记录代码块耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        lines = []
+        for key, series in items:
+            for bound, count in zip(self.buckets + (float("inf"),), series[:len(self.buckets)] + [series[-1]]):
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(series[-1])}")
+        return lines
+
+
+# 抓取时收集的指标：(名称, 类型, 说明, [(标签字典, 值), ...])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_metrics: List[_Metric] = []
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+
+def _register(metric: _Metric) -> _Metric:
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(collector: Callable[[], Iterable[Sample]]):
+    """注册抓取时调用的收集函数（把各组件已有的 stats() 转换为指标）"""
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """输出全部指标（Prometheus 文本格式）"""
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ============================================
+# 各阶段指标
+# ============================================
+
+HTTP_REQUESTS = _register(Counter(
+    "phi_http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")
+))
+HTTP_LATENCY = _register(Histogram(
+    "phi_http_request_duration_seconds", "Time until the response starts (streaming bodies excluded).", ("method", "route")
+))
+
+LLM_REQUESTS = _register(Counter(
+    "phi_llm_requests_total", "LLM calls by provider, model and outcome.", ("provider", "model", "status")
+))
+LLM_TTFT = _register(Histogram(
+    "phi_llm_time_to_first_token_seconds", "LLM time to first token.", ("provider", "model")
+))
+LLM_DURATION = _register(Histogram(
+    "phi_llm_duration_seconds", "LLM total generation time.", ("provider", "model")
+))
+LLM_TOKENS = _register(Counter(
+    "phi_llm_tokens_total", "LLM tokens reported by the provider.", ("provider", "model", "kind")
+))
+MODEL_ROUTES = _register(Counter(
+    "phi_model_route_decisions_total", "Model routing decisions by chosen model and reason.", ("model", "reason")
+))
+UPSTREAM_RETRIES = _register(Counter(
+    "phi_upstream_retries_total", "Retries of upstream API calls.", ("upstream", "status")
+))
+
+TEXT_PROCESSING = _register(Histogram(
+    "phi_text_processing_seconds", "Reply text post-processing time.", ("step",), buckets=FAST_BUCKETS
+))
+
+TTS_REQUESTS = _register(Counter(
+    "phi_tts_requests_total", "Upstream TTS calls by outcome.", ("status",)
+))
+TTS_TTFB = _register(Histogram(
+    "phi_tts_time_to_first_byte_seconds", "Upstream TTS time to first audio byte.", ()
+))
+TTS_DURATION = _register(Histogram(
+    "phi_tts_duration_seconds", "Upstream TTS total synthesis time.", ()
+))
+AUDIO_IO = _register(Histogram(
+    "phi_audio_io_seconds", "Audio base64 encoding and file write time.", ("op",), buckets=FAST_BUCKETS
+))
@@ -0,0 +1,180 @@
+"""
+Model Router - 按实测延迟决定深层对话是否使用深层模型
+每个模型维护首 token 延迟、总耗时与错误率的指数滑动平均 (EWMA)；
+深层需求的轮次只在深层模型的预期延迟不超过单次请求的延迟预算、且错误率正常时才使用它，
+否则回退到基础模型。超预算后每隔一段时间放行一次探测请求，以便在深层模型恢复后重新启用。
+
+配置:
+    PHI_DEEP_MODEL               深层模型，默认 gemini-1.5-pro（留空表示不切换）
+    PHI_DEEP_LATENCY_BUDGET      深层模型的总耗时预算（秒），默认 8
+    PHI_DEEP_TTFT_BUDGET         深层模型的首 token 延迟预算（秒），默认 3
+    PHI_ROUTER_EWMA_ALPHA        EWMA 平滑系数，默认 0.2
+    PHI_ROUTER_MAX_ERROR_RATE    深层模型错误率 EWMA 上限，默认 0.2
+    PHI_ROUTER_PROBE_INTERVAL    超预算时放行探测请求的间隔秒数，默认 60
+"""
+
+import os
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+from metrics import MODEL_ROUTES
+
+logger = logging.getLogger(__name__)
+
+# 样本数少于此值时不按延迟判断（先放行以收集数据）
+MIN_SAMPLES = 3
+
+
+class ModelLatency:
+    """单个模型的滚动延迟与错误统计"""
+
+    __slots__ = ("ttft", "total", "error_rate", "samples", "failures", "last_attempt")
+
+    def __init__(self):
+        self.ttft: Optional[float] = None
+        self.total: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.failures = 0
+        self.last_attempt = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "ttft_ewma_seconds": round(self.ttft, 3) if self.ttft is not None else None,
+            "total_ewma_seconds": round(self.total, 3) if self.total is not None else None,
+            "error_rate_ewma": round(self.error_rate, 3),
+            "samples": self.samples,
+            "failures": self.failures,
+        }
+
+
+class ModelRouter:
+    """基础模型 / 深层模型的延迟感知路由"""
+
+    def __init__(
+        self,
+        base_model: str,
+        deep_model: Optional[str] = None,
+        latency_budget: Optional[float] = None,
+        ttft_budget: Optional[float] = None,
+        alpha: Optional[float] = None,
+        max_error_rate: Optional[float] = None,
+        probe_interval: Optional[float] = None
+    ):
+        """
+        Args:
+            base_model: 基础模型
+            deep_model: 深层模型 (PHI_DEEP_MODEL)
+            latency_budget: 深层模型的总耗时预算秒数 (PHI_DEEP_LATENCY_BUDGET)
+            ttft_budget: 深层模型的首 token 延迟预算秒数 (PHI_DEEP_TTFT_BUDGET)
+            alpha: EWMA 平滑系数 (PHI_ROUTER_EWMA_ALPHA)
+            max_error_rate: 深层模型错误率上限 (PHI_ROUTER_MAX_ERROR_RATE)
+            probe_interval: 超预算时放行探测请求的间隔秒数 (PHI_ROUTER_PROBE_INTERVAL)
+        """
+        if deep_model is None:
+            deep_model = os.getenv("PHI_DEEP_MODEL", "gemini-1.5-pro")
+        if latency_budget is None:
+            latency_budget = float(os.getenv("PHI_DEEP_LATENCY_BUDGET", "8"))
+        if ttft_budget is None:
+            ttft_budget = float(os.getenv("PHI_DEEP_TTFT_BUDGET", "3"))
+        if alpha is None:
+            alpha = float(os.getenv("PHI_ROUTER_EWMA_ALPHA", "0.2"))
+        if max_error_rate is None:
+            max_error_rate = float(os.getenv("PHI_ROUTER_MAX_ERROR_RATE", "0.2"))
+        if probe_interval is None:
+            probe_interval = float(os.getenv("PHI_ROUTER_PROBE_INTERVAL", "60"))
+
+        self.base_model = base_model
+        self.deep_model = deep_model or None
+        self.latency_budget = latency_budget
+        self.ttft_budget = ttft_budget
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.probe_interval = probe_interval
+
+        self.models: Dict[str, ModelLatency] = {}
+        self.decisions: Dict[str, int] = {}
+        # 深层轮次相对基础模型多花的时间（实测总耗时 - 当时基础模型的 EWMA）
+        self.deep_extra_seconds = 0.0
+
+    def _stats(self, model: str) -> ModelLatency:
+        stats = self.models.get(model)
+        if stats is None:
+            stats = self.models[model] = ModelLatency()
+        return stats
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else current + self.alpha * (value - current)
+
+    # ---- 路由 ----
+
+    def _deep_verdict(self) -> Tuple[bool, str]:
+        stats = self._stats(self.deep_model)
+        if stats.samples < MIN_SAMPLES:
+            return True, "warmup"
+        if stats.error_rate > self.max_error_rate:
+            reason = "errors"
+        elif stats.ttft is not None and stats.ttft > self.ttft_budget:
+            reason = "over_ttft_budget"
+        elif stats.total is not None and stats.total > self.latency_budget:
+            reason = "over_budget"
+        else:
+            return True, "within_budget"
+        # 只有新数据才能让深层模型回到预算内：定期放行一次探测
+        if time.monotonic() - stats.last_attempt >= self.probe_interval:
+            return True, "probe"
+        return False, reason
+
+    def route(self, wants_deep: bool) -> Tuple[str, str]:
+        """
+        选择本轮使用的模型
+
+        Returns:
+            (模型, 原因)；原因为 standard / warmup / within_budget / probe（使用深层模型）
+            或 errors / over_ttft_budget / over_budget（回退到基础模型）
+        """
+        if not wants_deep or not self.deep_model or self.deep_model == self.base_model:
+            model, reason = self.base_model, "standard"
+        else:
+            use_deep, reason = self._deep_verdict()
+            model = self.deep_model if use_deep else self.base_model
+            if use_deep:
+                self._stats(self.deep_model).last_attempt = time.monotonic()
+            else:
+                logger.info(f"🧭 Deep model {self.deep_model} skipped ({reason}), using {self.base_model}")
+        self.decisions[reason] = self.decisions.get(reason, 0) + 1
+        MODEL_ROUTES.inc(model=model, reason=reason)
+        return model, reason
+
+    # ---- 观测 ----
+
+    def observe(self, model: str, total: float, ttft: Optional[float] = None):
+        """记录一次成功的生成（ttft 为空表示非流式调用，只更新总耗时）"""
+        stats = self._stats(model)
+        if model == self.deep_model and model != self.base_model:
+            base_total = self._stats(self.base_model).total
+            if base_total is not None:
+                self.deep_extra_seconds += total - base_total
+        stats.samples += 1
+        stats.total = self._ewma(stats.total, total)
+        if ttft is not None:
+            stats.ttft = self._ewma(stats.ttft, ttft)
+        stats.error_rate = self._ewma(stats.error_rate, 0.0)
+
+    def observe_failure(self, model: str):
+        stats = self._stats(model)
+        stats.samples += 1
+        stats.failures += 1
+        stats.error_rate = self._ewma(stats.error_rate, 1.0)
+
+    def stats(self) -> Dict:
+        return {
+            "base_model": self.base_model,
+            "deep_model": self.deep_model,
+            "latency_budget": self.latency_budget,
+            "ttft_budget": self.ttft_budget,
+            "decisions": dict(self.decisions),
+            "deep_extra_seconds": round(self.deep_extra_seconds, 3),
+            "models": {model: stats.to_dict() for model, stats in self.models.items()},
+        }
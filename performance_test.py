@@ -1,74 +1,46 @@
-﻿import requests
-import time
-import threading
-from datetime import datetime
+﻿"""
+Performance Test - 延迟门槛检查
+以离线压测套件 (load_test.py) 对各端点发送 3 个并发请求，
+所有请求成功且 p95 延迟不超过 2 秒即通过。
+默认使用快速的上游替身（低首 token 延迟、高 token 与音讯速率），门槛主要衡量桥接层本身的开销。
 
-results = []
-lock = threading.Lock()
+用法: python performance_test.py [load_test.py 的其他参数，如 --provider openai]
+"""
 
-def send_request(request_id):
-    url = "http://localhost:8000/tts"
-    payload = {
-        "text": f"瘚?霂瑟? {request_id}",
-        "text_language": "zh",
-        "arousal_level": 2
-    }
-    
-    start_time = time.time()
-    try:
-        response = requests.post(url, json=payload, timeout=30)
-        elapsed = time.time() - start_time
-        
-        with lock:
-            results.append({
-                "id": request_id,
-                "status": response.status_code,
-                "time": elapsed,
-                "success": response.status_code == 200
-            })
-    except Exception as e:
-        elapsed = time.time() - start_time
-        with lock:
-            results.append({
-                "id": request_id,
-                "status": "ERROR",
-                "time": elapsed,
-                "success": False,
-                "error": str(e)
-            })
+import sys
+import asyncio
+import logging
 
-# Start 3 concurrent requests
-threads = []
-for i in range(1, 4):
-    t = threading.Thread(target=send_request, args=(i,))
-    threads.append(t)
-    t.start()
+from load_test import build_parser, run_load_test
 
-# Wait for all threads
-for t in threads:
-    t.join()
+THRESHOLD_SECONDS = 2.0
 
-# Report results
-print("=" * 60)
-print("Performance Test Results")
-print("=" * 60)
-print()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+args = build_parser().parse_args(
+    ["--concurrency", "3", "--requests", "3", "--ttft", "0.1", "--token-rate", "200", "--tts-ttfb", "0.1", "--audio-rate", "1000000"]
+    + sys.argv[1:]
+)
+summaries = asyncio.run(run_load_test(args))
 
+print()
 all_pass = True
-for result in results:
-    status_icon = "[PASS]" if result["success"] else "[FAIL]"
-    print(f"{status_icon} Request {result['id']}: {result['time']:.2f}s (Status: {result['status']})")
-    
-    if result["time"] > 2.0:
-        print(f"  WARN: Response time {result['time']:.2f}s exceeds 2s threshold")
+for s in summaries:
+    p95 = s["latency_p95"]
+    if s["errors"]:
+        print(f"[FAIL] {s['endpoint']}: {s['errors']}/{s['requests']} requests failed ({s['statuses']})")
         all_pass = False
-    elif not result["success"]:
+    elif p95 is None or p95 > THRESHOLD_SECONDS:
+        print(f"[FAIL] {s['endpoint']}: p95 {p95:.2f}s exceeds {THRESHOLD_SECONDS:.0f}s threshold")
         all_pass = False
+    else:
+        print(f"[PASS] {s['endpoint']}: p95 {p95:.2f}s")
 
 print()
 if all_pass:
-    print("PASS: All requests completed within 2s threshold")
-    exit(0)
+    print(f"PASS: All requests completed within {THRESHOLD_SECONDS:.0f}s threshold")
+    sys.exit(0)
 else:
     print("FAIL: Some requests failed or exceeded threshold")
-    exit(1)
+    sys.exit(1)
@@ -0,0 +1,250 @@
+"""
+Provider Hedging - 跨提供商的对冲请求
+主提供商在对冲延迟内（默认取其首 token 延迟的滚动 p90）仍未产出首 token 时，
+把同一提示词再发给次提供商；先开始输出的一方胜出，另一方被取消。
+按滚动窗口限制对冲比例，避免成本失控，并统计对冲率与胜率。
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, List, AsyncIterator
+
+from llm_providers import LLMProvider, LLMChunk, LLMResult, SystemPrompt, GenerationParams
+
+logger = logging.getLogger(__name__)
+
+# 流结束标记
+_END = object()
+
+
+class _Racer:
+    """参赛的一路流式请求：后台任务把分块搬进队列，便于同时等待多路的首个分块"""
+
+    def __init__(self, label: str, model: str, stream: AsyncIterator[LLMChunk]):
+        self.label = label
+        self.model = model
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump(stream))
+
+    async def _pump(self, stream: AsyncIterator[LLMChunk]):
+        try:
+            async for chunk in stream:
+                self.queue.put_nowait(chunk)
+            self.queue.put_nowait(_END)
+        except Exception as e:
+            self.queue.put_nowait(e)
+        finally:
+            await stream.aclose()
+
+    def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    """最近秩 (nearest-rank) 百分位数"""
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class HedgedProvider(LLMProvider):
+    """
+    对冲包装器：对外与普通适配器相同，PhiBrain 无需感知
+
+    每个分块的 model 标注实际回答的模型；主提供商在首 token 前失败时，第一个分块的
+    failed_models 带上主模型。同步 complete() 不做对冲，直接使用主提供商。
+    """
+
+    def __init__(
+        self,
+        primary: LLMProvider,
+        secondary: LLMProvider,
+        delay: Optional[str] = None,
+        initial_delay: Optional[float] = None,
+        min_delay: Optional[float] = None,
+        max_rate: Optional[float] = None,
+        window: int = 200,
+        min_samples: int = 20
+    ):
+        """
+        Args:
+            primary / secondary: 主、次提供商适配器
+            delay: 对冲延迟 (PHI_HEDGE_DELAY)，"p90" 等表示取主提供商首 token 延迟的滚动百分位，数字表示固定秒数
+            initial_delay: 样本不足 min_samples 时使用的延迟 (PHI_HEDGE_INITIAL_DELAY)
+            min_delay: 对冲延迟下限 (PHI_HEDGE_MIN_DELAY)
+            max_rate: 滚动窗口内对冲请求的比例上限 (PHI_HEDGE_MAX_RATE)，超过后暂停对冲
+            window: 首 token 延迟样本与对冲比例的滚动窗口大小（请求数）
+        """
+        if delay is None:
+            delay = os.getenv("PHI_HEDGE_DELAY", "p90")
+        if initial_delay is None:
+            initial_delay = float(os.getenv("PHI_HEDGE_INITIAL_DELAY", "2.0"))
+        if min_delay is None:
+            min_delay = float(os.getenv("PHI_HEDGE_MIN_DELAY", "0.2"))
+        if max_rate is None:
+            max_rate = float(os.getenv("PHI_HEDGE_MAX_RATE", "0.15"))
+
+        self.primary = primary
+        self.secondary = secondary
+        self.name = f"{primary.name}+{secondary.name}"
+        self.label = primary.label
+        self.model = primary.model
+
+        delay = delay.strip().lower()
+        self.delay_percentile = float(delay[1:]) if delay.startswith("p") else None
+        self.fixed_delay = None if self.delay_percentile is not None else float(delay)
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+
+        # 主提供商首 token 延迟样本；被对冲取消时记录取消前已等待的时间（真实值只会更大）
+        self._ttft_samples: deque = deque(maxlen=window)
+        # 最近请求是否触发了对冲（用于预算控制）
+        self._recent_hedges: deque = deque(maxlen=window)
+
+        self.requests = 0
+        self.hedged = 0
+        self.wins = {"primary": 0, "secondary": 0}
+        self.budget_skips = 0
+
+    # ---- 对冲策略 ----
+
+    def current_delay(self) -> float:
+        """当前的对冲延迟（秒）"""
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        if len(self._ttft_samples) < self.min_samples:
+            return self.initial_delay
+        return max(_percentile(list(self._ttft_samples), self.delay_percentile), self.min_delay)
+
+    def _within_budget(self) -> bool:
+        if self.max_rate >= 1 or not self._recent_hedges:
+            return self.max_rate > 0
+        return sum(self._recent_hedges) / len(self._recent_hedges) < self.max_rate
+
+    def _secondary_params(self, params: GenerationParams) -> GenerationParams:
+        # 次提供商使用自己的模型，且不接触会话内的提供商状态（如 Gemini 常驻 ChatSession）
+        return GenerationParams(
+            model=self.secondary.model,
+            temperature=params.temperature,
+            max_tokens=params.max_tokens
+        )
+
+    # ---- 统一接口 ----
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        system: SystemPrompt,
+        params: GenerationParams
+    ) -> AsyncIterator[LLMChunk]:
+        self.requests += 1
+        started = time.monotonic()
+        may_hedge = self._within_budget()
+        if not may_hedge:
+            self.budget_skips += 1
+
+        primary = _Racer("primary", params.model, self.primary.stream(messages, system, params))
+        racers = [primary]
+        waiting = {asyncio.ensure_future(primary.queue.get()): primary}
+        timeout = self.current_delay() if may_hedge else None
+        hedged = False
+        primary_failed = False
+        winner = None
+        first = None
+
+        def hedge():
+            nonlocal hedged, timeout
+            hedged = True
+            timeout = None
+            secondary_params = self._secondary_params(params)
+            secondary = _Racer(
+                "secondary", secondary_params.model, self.secondary.stream(messages, system, secondary_params)
+            )
+            racers.append(secondary)
+            waiting[asyncio.ensure_future(secondary.queue.get())] = secondary
+
+        try:
+            while winner is None:
+                done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 主提供商在对冲延迟内未产出首 token：同一提示词发给次提供商
+                    logger.info(f"🪃 Hedging to {self.secondary.name} after {time.monotonic() - started:.2f}s")
+                    hedge()
+                    continue
+
+                for future in done:
+                    racer = waiting.pop(future)
+                    item = future.result()
+                    if not isinstance(item, Exception):
+                        winner, first = racer, item
+                        break
+                    primary_failed = primary_failed or racer is primary
+                    if waiting:
+                        # 一路失败，等待另一路
+                        logger.warning(f"Hedged {racer.label} failed before first token: {item}")
+                    elif may_hedge and not hedged:
+                        # 主提供商在首 token 前失败：立即转给次提供商
+                        logger.warning(f"Primary failed before first token, hedging to {self.secondary.name}: {item}")
+                        hedge()
+                    else:
+                        raise item
+
+            self._record(winner, hedged, primary_failed, time.monotonic() - started)
+            for racer in racers:
+                if racer is not winner:
+                    racer.cancel()
+
+            # 标注实际回答的模型与首 token 前失败的主模型，PhiBrain 据此只把主模型自己的结果计入模型路由
+            if primary_failed:
+                first.failed_models = (primary.model,)
+            item = first
+            while item is not _END:
+                if isinstance(item, Exception):
+                    raise item
+                if item.model is None:
+                    item.model = winner.model
+                yield item
+                item = await winner.queue.get()
+        finally:
+            for future in waiting:
+                future.cancel()
+            for racer in racers:
+                racer.cancel()
+
+    def _record(self, winner: _Racer, hedged: bool, primary_failed: bool, elapsed: float):
+        if not primary_failed:
+            # 主提供商胜出时即其真实首 token 延迟；落败时只知道至少等待了 elapsed
+            self._ttft_samples.append(elapsed)
+        self._recent_hedges.append(hedged)
+        if hedged:
+            self.hedged += 1
+            self.wins[winner.label] += 1
+
+    def complete(self, messages, system, params) -> LLMResult:
+        return self.primary.complete(messages, system, params)
+
+    def commit_turn(self, session):
+        self.primary.commit_turn(session)
+
+    def stats(self) -> Dict:
+        """对冲率、胜率与当前延迟"""
+        return {
+            "primary": self.primary.name,
+            "secondary": self.secondary.name,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "primary_wins": self.wins["primary"],
+            "secondary_wins": self.wins["secondary"],
+            "secondary_win_rate": self.wins["secondary"] / self.hedged if self.hedged else 0.0,
+            "budget_skips": self.budget_skips,
+            "max_rate": self.max_rate,
+            "current_delay": round(self.current_delay(), 3),
+        }
@@ -0,0 +1,219 @@
+"""
+Rate Limiter - 上游 API 的客户端限流与重试退避
+按 (上游, API Key) 共享令牌桶，同时限制每分钟请求数与每分钟 token 数，
+在触发 429 之前就把请求平滑开；收到 429 时按 Retry-After 暂停该上游的所有请求。
+重试使用带抖动的指数退避，并尊重 Retry-After。
+
+配置（未设置或为 0 表示不限制）:
+    PHI_RATE_<UPSTREAM>_RPM   每分钟请求数，如 PHI_RATE_GEMINI_RPM=60
+    PHI_RATE_<UPSTREAM>_TPM   每分钟 token 数（ElevenLabs 为字符数）
+    UPSTREAM: GEMINI / OPENAI / OPENROUTER / CLAUDE / ELEVENLABS
+    PHI_RATE_BURST_SECONDS    令牌桶容量（允许的突发量，按秒计），默认 2
+    PHI_RETRY_BASE_DELAY / PHI_RETRY_MAX_DELAY  退避基数与上限（秒），默认 0.5 / 20
+    PHI_UPSTREAM_MAX_RETRIES  最大重试次数，默认 3
+"""
+
+import os
+import re
+import time
+import random
+import hashlib
+import asyncio
+import logging
+import threading
+import email.utils
+from typing import Optional, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Gemini (gRPC) 429 错误消息中的 RetryInfo，如 "retry_delay {\n  seconds: 37\n}"
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)")
+
+
+def max_retries() -> int:
+    return int(os.getenv("PHI_UPSTREAM_MAX_RETRIES", "3"))
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """从响应头解析等待秒数（retry-after-ms、retry-after 秒数或 HTTP 日期）"""
+    if not headers:
+        return None
+    if isinstance(headers, dict):
+        headers = {str(key).lower(): value for key, value in headers.items()}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """从 SDK 异常中提取服务端建议的等待秒数"""
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    retry_after = parse_retry_after(headers)
+    if retry_after is not None:
+        return retry_after
+    match = _RETRY_DELAY_RE.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    第 attempt 次重试（从 0 开始）前的等待秒数
+
+    指数退避 + 全抖动；服务端给出 Retry-After 时至少等待该时长，再加少量抖动避免同时重试。
+    """
+    base = float(os.getenv("PHI_RETRY_BASE_DELAY", "0.5"))
+    cap = float(os.getenv("PHI_RETRY_MAX_DELAY", "20"))
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, base)
+    return delay
+
+
+class TokenBucket:
+    """
+    令牌桶（预约式）：reserve() 立即扣除并返回需要等待的秒数，余额可为负（排队中的预约）
+
+    不持有等待中的协程，同步与异步调用方共用，线程安全。
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发量）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, amount: float):
+        """归还多预约的令牌（amount 为负时补扣）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class UpstreamLimiter:
+    """单个 (上游, API Key) 的限流器：请求数桶 + token 桶 + 429 暂停"""
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None, burst_seconds: float = 2.0):
+        self.name = name
+        self.rpm = rpm or None
+        self.tpm = tpm or None
+        self.requests = TokenBucket(self.rpm / 60.0, max(1.0, self.rpm / 60.0 * burst_seconds)) if self.rpm else None
+        self.tokens = TokenBucket(self.tpm / 60.0, max(1.0, self.tpm / 60.0 * burst_seconds)) if self.tpm else None
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.penalties = 0
+
+    def reserve(self, tokens: float = 0) -> float:
+        """预约一次调用（tokens 为预计消耗），返回需要等待的秒数"""
+        wait = max(self._paused_until - time.monotonic(), 0.0)
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        self.acquired += 1
+        if wait > 0:
+            self.throttled += 1
+            self.throttled_seconds += wait
+        return wait
+
+    async def acquire(self, tokens: float = 0):
+        """异步等待直到可以发出调用（不占用事件循环）"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.debug(f"Rate limiter [{self.name}] smoothing call by {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: float = 0):
+        """同步等待（仅供同步代码路径使用）"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def settle(self, reserved: float, actual: Optional[float]):
+        """调用完成后按实际 token 用量修正预约"""
+        if self.tokens is not None and actual is not None:
+            self.tokens.refund(reserved - actual)
+
+    def penalize(self, retry_after: float):
+        """收到 429 后暂停该上游的所有调用，直到 Retry-After 到期"""
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        self.penalties += 1
+        logger.warning(f"Rate limiter [{self.name}] paused for {retry_after:.1f}s (Retry-After)")
+
+    def stats(self) -> Dict:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "penalties": self.penalties,
+            "paused_for": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+        }
+
+
+# (上游, API Key 摘要) -> 限流器；同一进程内使用同一 Key 的客户端共享额度
+_limiters: Dict[Tuple[str, str], UpstreamLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream: str, api_key: Optional[str] = None) -> UpstreamLimiter:
+    """取得 (上游, API Key) 对应的共享限流器"""
+    key_digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+    cache_key = (upstream, key_digest)
+    with _limiters_lock:
+        limiter = _limiters.get(cache_key)
+        if limiter is None:
+            prefix = f"PHI_RATE_{upstream.upper()}"
+            limiter = UpstreamLimiter(
+                name=f"{upstream}:{key_digest[:6]}",
+                rpm=float(os.getenv(f"{prefix}_RPM", "0")),
+                tpm=float(os.getenv(f"{prefix}_TPM", "0")),
+                burst_seconds=float(os.getenv("PHI_RATE_BURST_SECONDS", "2")),
+            )
+            _limiters[cache_key] = limiter
+        return limiter
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    """所有限流器的统计"""
+    with _limiters_lock:
+        return {limiter.name: limiter.stats() for limiter in _limiters.values()}
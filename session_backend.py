@@ -0,0 +1,348 @@
+"""
+Session Backend - 多 worker / 多副本共享的会话存储
+会话的可序列化部分（兴奋度、人格、模型、对话历史）保存在所有 worker 都能访问的存储中，
+每个 worker 的 SessionStore 只作为本地缓存（同时保存 Gemini ChatSession 等不可序列化的对象）。
+
+每条记录带版本号，写入使用比较并交换 (compare-and-set)：版本不匹配说明其他 worker 已先写入，
+调用方重新读取最新状态、重放本次修改后再写，同一会话的并发请求不会互相覆盖历史。
+
+配置:
+    PHI_SESSION_BACKEND   未设置: 仅进程内存（单 worker）
+                          sqlite:///绝对路径/sessions.db 或 sqlite:///./相对路径.db（同一主机的多个 worker，WAL 模式）
+                          redis://host:6379/0（多副本；需要 pip install redis）
+    PHI_SESSION_TTL       会话闲置过期秒数（与本地 SessionStore 共用），默认 3600
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import contextlib
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 写入冲突时重读并重放修改的最大次数
+MAX_CAS_ATTEMPTS = 5
+
+
+class SessionBackend:
+    """
+    带版本号的键值存储接口
+
+    版本号从 1 开始，0 表示记录不存在；compare_and_set 仅在当前版本等于 expected_version 时写入。
+    """
+
+    name = "base"
+
+    def load(self, key: str) -> Optional[Tuple[int, Dict]]:
+        """返回 (版本号, 数据)；不存在或已过期时返回 None"""
+        raise NotImplementedError
+
+    def compare_and_set(self, key: str, expected_version: int, data: Dict, ttl: Optional[float] = None) -> Optional[int]:
+        """版本匹配时写入并返回新版本号，否则返回 None"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """本机共享的 SQLite 文件（WAL 模式：读写互不阻塞，同一主机的多个 worker 共用）"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, ttl: float):
+        """
+        Args:
+            path: 数据库文件路径
+            ttl: 记录闲置过期秒数，0 表示不过期
+        """
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # 每个线程一个连接（同步接口可能在线程池中调用）
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS phi_kv ("
+                "key TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, key: str) -> Optional[Tuple[int, Dict]]:
+        row = self._connect().execute(
+            "SELECT version, data, expires_at FROM phi_kv WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        version, data, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return version, json.loads(data)
+
+    def compare_and_set(self, key: str, expected_version: int, data: Dict, ttl: Optional[float] = None) -> Optional[int]:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl > 0 else None
+        payload = json.dumps(data, ensure_ascii=False)
+        conn = self._connect()
+        if expected_version == 0:
+            # 不存在或已过期的记录都视为版本 0
+            cursor = conn.execute(
+                "INSERT INTO phi_kv (key, version, data, expires_at) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET version = 1, data = excluded.data, expires_at = excluded.expires_at "
+                "WHERE phi_kv.expires_at IS NOT NULL AND phi_kv.expires_at < ?",
+                (key, payload, expires_at, time.time())
+            )
+            new_version = 1
+        else:
+            cursor = conn.execute(
+                "UPDATE phi_kv SET version = version + 1, data = ?, expires_at = ? WHERE key = ? AND version = ?",
+                (payload, expires_at, key, expected_version)
+            )
+            new_version = expected_version + 1
+        if cursor.rowcount != 1:
+            return None
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self._purge()
+        return new_version
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM phi_kv WHERE key = ?", (key,))
+
+    def _purge(self):
+        """清除已过期的记录"""
+        self._connect().execute("DELETE FROM phi_kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+    def stats(self) -> Dict:
+        (count,) = self._connect().execute("SELECT COUNT(*) FROM phi_kv").fetchone()
+        return {"path": self.path, "records": count}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisSessionBackend(SessionBackend):
+    """Redis（或兼容协议的存储），多副本共享；版本检查与写入在 Lua 脚本中原子执行"""
+
+    name = "redis"
+
+    # KEYS[1]=键  ARGV[1]=期望版本  ARGV[2]=数据  ARGV[3]=TTL 毫秒（0 为不过期）
+    _CAS_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+current = tonumber(current) or 0
+if current ~= tonumber(ARGV[1]) then
+    return -1
+end
+local version = current + 1
+redis.call('HSET', KEYS[1], 'version', version, 'data', ARGV[2])
+if tonumber(ARGV[3]) > 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+else
+    redis.call('PERSIST', KEYS[1])
+end
+return version
+"""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "phi:"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("Redis 会话存储需要 redis 套件，请运行: pip install redis") from None
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._cas = self.client.register_script(self._CAS_SCRIPT)
+
+    def load(self, key: str) -> Optional[Tuple[int, Dict]]:
+        version, data = self.client.hmget(self.prefix + key, "version", "data")
+        if version is None or data is None:
+            return None
+        return int(version), json.loads(data)
+
+    def compare_and_set(self, key: str, expected_version: int, data: Dict, ttl: Optional[float] = None) -> Optional[int]:
+        ttl = self.ttl if ttl is None else ttl
+        result = self._cas(
+            keys=[self.prefix + key],
+            args=[expected_version, json.dumps(data, ensure_ascii=False), int(ttl * 1000) if ttl > 0 else 0]
+        )
+        return None if int(result) < 0 else int(result)
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def stats(self) -> Dict:
+        return {"url": self.url.split("@")[-1]}
+
+    def close(self):
+        self.client.close()
+
+
+def create_session_backend(url: Optional[str] = None) -> Optional[SessionBackend]:
+    """按 PHI_SESSION_BACKEND 建立共享存储；未配置时返回 None（仅进程内存）"""
+    url = url if url is not None else os.getenv("PHI_SESSION_BACKEND", "")
+    if not url or url == "memory":
+        return None
+    ttl = float(os.getenv("PHI_SESSION_TTL", "3600"))
+    if url.startswith("sqlite:///"):
+        backend = SQLiteSessionBackend(url[len("sqlite:///"):], ttl)
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        backend = RedisSessionBackend(url, ttl)
+    else:
+        raise ValueError(f"不支持的 PHI_SESSION_BACKEND: {url}（可用 sqlite:///路径 或 redis://主机）")
+    logger.info(f"🗄️ Shared session backend: {backend.name}")
+    return backend
+
+
+class SharedSessions:
+    """
+    SessionState 与共享存储之间的同步
+
+    refresh() 在每轮开始时拉取其他 worker 写入的新版本；save() 以比较并交换写回，
+    版本冲突时重新拉取并重放本次修改（mutation），直到写入成功。
+    存储访问是阻塞 I/O：事件循环中使用 arefresh() / aupdate()，读写放到 threadpool 执行，
+    SessionState 的读取与修改仍在事件循环线程中进行。
+    """
+
+    def __init__(self, backend: SessionBackend):
+        self.backend = backend
+        self.loads = 0
+        self.refreshed = 0
+        self.saves = 0
+        self.conflicts = 0
+        self.failures = 0
+        # session_id -> [asyncio.Lock, 使用者数]
+        self._locks: Dict[str, list] = {}
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def refresh(self, state) -> bool:
+        """存储中的版本比本地新时覆盖本地状态；返回是否有更新"""
+        self.loads += 1
+        return self._apply(state, self.backend.load(self._key(state.session_id)))
+
+    async def arefresh(self, state) -> bool:
+        """refresh() 的异步版本（读取在 threadpool 中执行）"""
+        async with self._session_lock(state.session_id):
+            return await self._arefresh(state)
+
+    async def _arefresh(self, state) -> bool:
+        self.loads += 1
+        entry = await asyncio.to_thread(self.backend.load, self._key(state.session_id))
+        return self._apply(state, entry)
+
+    def _apply(self, state, entry: Optional[Tuple[int, Dict]]) -> bool:
+        if entry is None:
+            # 存储中的记录已过期（或尚未写入）：本地缓存从版本 0 重新开始
+            state.store_version = 0
+            return False
+        version, data = entry
+        if version == state.store_version:
+            return False
+        state.apply_snapshot(data, version)
+        self.refreshed += 1
+        return True
+
+    def save(self, state, mutation: Callable[[object], None]):
+        """
+        写回本地已应用 mutation 的状态
+
+        Args:
+            state: 已执行过 mutation 的 SessionState
+            mutation: 本次修改；冲突时在重新拉取的最新状态上再次执行
+        """
+        key = self._key(state.session_id)
+        for attempt in range(MAX_CAS_ATTEMPTS):
+            version = self.backend.compare_and_set(key, state.store_version, state.to_snapshot())
+            if version is not None:
+                state.store_version = version
+                self.saves += 1
+                return
+            self._conflict(state, attempt)
+            # 只有拉取到其他 worker 的新版本时才需要重放；记录过期或缺失时本地状态已含本次修改，直接重试写入
+            if self.refresh(state):
+                mutation(state)
+        self._failed(state)
+
+    async def aupdate(self, state, mutation: Callable[[object], None]):
+        """
+        执行 mutation 并写回（异步版本：读写在 threadpool 中执行，修改与重放在事件循环线程中进行）
+
+        与 save() 不同，mutation 由本方法执行：同一会话的读取、修改与写回在会话锁内完成，
+        等待存储期间本 worker 的其他请求不会用拉取到的快照覆盖尚未写回的修改。
+        """
+        key = self._key(state.session_id)
+        async with self._session_lock(state.session_id):
+            mutation(state)
+            for attempt in range(MAX_CAS_ATTEMPTS):
+                version = await asyncio.to_thread(
+                    self.backend.compare_and_set, key, state.store_version, state.to_snapshot()
+                )
+                if version is not None:
+                    state.store_version = version
+                    self.saves += 1
+                    return
+                self._conflict(state, attempt)
+                if await self._arefresh(state):
+                    mutation(state)
+            self._failed(state)
+
+    @contextlib.asynccontextmanager
+    async def _session_lock(self, session_id: str):
+        """同一会话的异步读写在本 worker 内串行执行（锁在无人使用时移除）"""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+    def _conflict(self, state, attempt: int):
+        self.conflicts += 1
+        logger.info(f"Session write conflict, replaying on latest version (session: {state.session_id}, attempt {attempt + 1})")
+
+    def _failed(self, state):
+        self.failures += 1
+        logger.error(f"❌ Session write failed after {MAX_CAS_ATTEMPTS} conflicts (session: {state.session_id})")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.backend.name,
+            "loads": self.loads,
+            "refreshed": self.refreshed,
+            "saves": self.saves,
+            "conflicts": self.conflicts,
+            "failures": self.failures,
+            **self.backend.stats(),
+        }
@@ -0,0 +1,150 @@
+"""
+Session Store - 有界的会话存储
+按最近使用顺序 (LRU) 保存 SessionState，限制最大会话数并淘汰闲置超时的会话，
+同时维护每个会话的近似内存占用，避免进程 RSS 随 session_id 数量无限增长。
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每条消息的固定开销估算（dict 与字符串对象头），单位：字节
+MESSAGE_OVERHEAD_BYTES = 240
+# 每个会话对象本身的固定开销估算
+SESSION_OVERHEAD_BYTES = 1024
+
+
+def estimate_session_bytes(state) -> int:
+    """估算会话占用的内存（消息内容的 UTF-8 长度 + 固定开销）"""
+    history_bytes = 0
+    for msg in state.history:
+        history_bytes += MESSAGE_OVERHEAD_BYTES + len(msg.get("content", "").encode("utf-8"))
+    total = SESSION_OVERHEAD_BYTES + history_bytes
+    # 滚动摘要与待折叠的消息
+    total += len(getattr(state, "summary", "").encode("utf-8"))
+    for msg in getattr(state, "summary_pending", ()):
+        total += MESSAGE_OVERHEAD_BYTES + len(msg.get("content", "").encode("utf-8"))
+    # Gemini 常驻 ChatSession 中保存着同一份历史的副本
+    if getattr(state, "gemini_chat", None) is not None:
+        total += history_bytes
+    return total
+
+
+class SessionStore:
+    """有界的内存会话存储：最大会话数 + 闲置 TTL + LRU 淘汰 + 内存统计"""
+
+    def __init__(self, max_sessions: Optional[int] = None, idle_ttl: Optional[float] = None):
+        """
+        Args:
+            max_sessions: 最多保留的会话数 (PHI_MAX_SESSIONS)，超出后淘汰最久未用的会话
+            idle_ttl: 会话闲置多少秒后过期 (PHI_SESSION_TTL)，0 表示不过期
+        """
+        if max_sessions is None:
+            max_sessions = int(os.getenv("PHI_MAX_SESSIONS", "1000"))
+        if idle_ttl is None:
+            idle_ttl = float(os.getenv("PHI_SESSION_TTL", "3600"))
+
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+
+        # session_id -> (SessionState, 最后访问时间)，顺序即 LRU 顺序
+        self._sessions: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        # session_id -> 近似字节数
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+
+        self.lru_evictions = 0
+        self.ttl_evictions = 0
+
+    def get(self, session_id: str):
+        """获取会话并刷新其 LRU 位置；不存在或已过期时返回 None"""
+        self._expire()
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        state = entry[0]
+        self._sessions[session_id] = (state, time.monotonic())
+        self._sessions.move_to_end(session_id)
+        return state
+
+    def put(self, state):
+        """加入（或替换）会话，必要时按 LRU 淘汰最久未用的会话"""
+        session_id = state.session_id
+        self._sessions[session_id] = (state, time.monotonic())
+        self._sessions.move_to_end(session_id)
+        self.commit(state)
+
+        while len(self._sessions) > self.max_sessions:
+            evicted_id = next(iter(self._sessions))
+            self._remove(evicted_id)
+            self.lru_evictions += 1
+            logger.info(f"Session evicted (LRU): {evicted_id}")
+
+    def commit(self, state):
+        """会话历史变化后更新其近似内存占用（若该会话在请求进行期间被淘汰，则重新加入）"""
+        session_id = state.session_id
+        if session_id not in self._sessions:
+            self.put(state)
+            return
+        size = estimate_session_bytes(state)
+        self._total_bytes += size - self._sizes.get(session_id, 0)
+        self._sizes[session_id] = size
+
+    def pop(self, session_id: str):
+        """移除并返回会话"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        self._remove(session_id)
+        return entry[0]
+
+    def _remove(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._total_bytes -= self._sizes.pop(session_id, 0)
+
+    def _expire(self):
+        """淘汰闲置超时的会话（LRU 头部即最久未访问的会话）"""
+        if self.idle_ttl <= 0:
+            return
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if last_access > deadline:
+                break
+            self._remove(session_id)
+            self.ttl_evictions += 1
+            logger.info(f"Session expired (idle TTL): {session_id}")
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __getitem__(self, session_id: str):
+        state = self.get(session_id)
+        if state is None:
+            raise KeyError(session_id)
+        return state
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._sessions))
+
+    def items(self):
+        return [(session_id, entry[0]) for session_id, entry in self._sessions.items()]
+
+    def stats(self) -> Dict:
+        """会话数量、总内存估算与淘汰计数"""
+        self._expire()
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "approx_bytes": self._total_bytes,
+            "lru_evictions": self.lru_evictions,
+            "ttl_evictions": self.ttl_evictions,
+        }
@@ -0,0 +1,96 @@
+"""
+Startup 冷启动基准
+每轮启动一个全新的 Python 进程：导入 voice_bridge 并执行 lifespan 启动阶段，
+测量进程启动到就绪、import 到就绪的耗时与各阶段明细，并列出实际加载的上游 SDK。
+不发出任何上游请求；未配置 API Key 时使用占位 Key（构造客户端不会联网）。
+
+用法:
+    python startup_benchmark.py [--runs 5] [--recover-deps] [--max-ready-ms 3000]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import logging
+
+SDK_MODULES = ("google.generativeai", "openai", "anthropic", "elevenlabs")
+
+
+def child():
+    """子进程：导入 voice_bridge 并运行 lifespan 启动，输出一行 JSON"""
+    logging.disable(logging.CRITICAL)
+    started = time.perf_counter()
+    import voice_bridge
+    imported = time.perf_counter()
+
+    async def start():
+        async with voice_bridge.lifespan(voice_bridge.app):
+            return time.perf_counter()
+
+    ready = asyncio.run(start())
+    print(json.dumps({
+        "import_ms": (imported - started) * 1000,
+        "ready_ms": (ready - started) * 1000,
+        "phases_ms": voice_bridge.boot.stats()["phases_ms"],
+        "sdks": [name for name in SDK_MODULES if name in sys.modules],
+        "brain_ready": voice_bridge.brain is not None,
+    }))
+
+
+def run_once(env) -> dict:
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"],
+        env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    # 进程总耗时包含解释器启动与退出
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="voice_bridge 冷启动基准")
+    parser.add_argument("--runs", type=int, default=5, help="冷启动次数")
+    parser.add_argument("--recover-deps", action="store_true", help="启用 PHI_RECOVER_DEPS=1（旧的运行时依赖修复）作对比")
+    parser.add_argument("--max-ready-ms", type=float, help="import 到就绪的中位数超过此值时以非零状态退出")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark-placeholder-key")
+    env.setdefault("ELEVENLABS_API_KEY", "benchmark-placeholder-key")
+    env["PHI_RECOVER_DEPS"] = "1" if args.recover_deps else "0"
+
+    results = [run_once(env) for _ in range(args.runs)]
+
+    print(f"Cold starts: {args.runs}  PHI_RECOVER_DEPS={env['PHI_RECOVER_DEPS']}  brain_ready={results[-1]['brain_ready']}")
+    print(f"{'metric':<24}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    rows = [("process -> exit", [r["process_ms"] for r in results]),
+            ("import", [r["import_ms"] for r in results]),
+            ("import -> ready", [r["ready_ms"] for r in results])]
+    for phase in results[0]["phases_ms"]:
+        rows.append((f"  phase {phase}", [r["phases_ms"].get(phase, 0.0) for r in results]))
+    for name, values in rows:
+        print(f"{name:<24}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    print(f"Loaded SDKs: {', '.join(results[-1]['sdks']) or '-'}")
+
+    ready_median = statistics.median(r["ready_ms"] for r in results)
+    if args.max_ready_ms is not None and ready_median > args.max_ready_ms:
+        print(f"❌ import -> ready median {ready_median:.0f}ms exceeds {args.max_ready_ms:.0f}ms")
+        sys.exit(1)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""
+Text Engine - 回复文本处理引擎
+将大脑回复的后处理（生理校正、情绪标签、美化）与语音桥接端的清理（UI 文字、TTS 文字、
+STATE / <emotion> / 括号情绪提取）集中在一处。所有正则在导入时编译，
+每段文本只经过少量融合后的扫描，不再有函数内 import、嵌套括号的不动点循环与占位符切片。
+
+输出与旧实现逐字节一致（见 text_engine_golden_test.py）。
+"""
+
+import re
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cartesia 语音标签白名单（ElevenLabs 不支持，送入 TTS 前需移除）
+VOICE_TAGS = ("laughter", "sigh", "chuckle", "gasp", "uh-huh", "hmm", "wink", "giggle", "moan", "squeal")
+
+# 兴奋度等级 (ArousalLevel.value) -> 可自动插入的情绪标签
+AROUSAL_TAGS = {
+    0: [],  # CALM：冷静状态，不添加标签
+    1: ["[sigh]"],
+    2: ["[giggle]", "[laughter]"],
+    3: ["[gasp]", "[moan]"],
+    4: ["[gasp]", "[moan]", "[squeal]"],
+}
+
+# 括号关键词 -> (positivity, curiosity, stability)，按顺序取第一个命中的关键词
+BRACKET_EMOTIONS = {
+    "娇媚": ("high", "high", "medium"),
+    "诱惑": ("high", "high", "medium"),
+    "挑逗": ("high", "high", "low"),
+    "害羞": ("medium", "medium", "low"),
+    "脸红": ("medium", "medium", "low"),
+    "紧张": ("medium", "medium", "low"),
+    "兴奋": ("high", "high", "low"),
+    "激动": ("high", "high", "low"),
+    "渴望": ("high", "high", "low"),
+    "喘息": ("high", "medium", "low"),
+    "娇嗔": ("high", "medium", "low"),
+    "呻吟": ("high", "low", "low"),
+    "咬着": ("high", "medium", "low"),
+    "舔": ("high", "medium", "low"),
+    "揉": ("high", "medium", "low"),
+    "吮": ("high", "medium", "low"),
+}
+
+# 生理常识校正：对「小豆豆/陰核」的插入类动作 -> 正确动作
+_CLITORIS_FIXES = {"干": "舔弄小豆豆", "幹": "舔弄小豆豆", "插": "撥弄小豆豆", "捅": "揉搓小豆豆"}
+# 语音桥接端的兜底校正（与大脑端用词不同）
+_PHYSIOLOGY_FIXES = [
+    (err, err.replace("幹", "瘋狂舔弄").replace("插", "高速撥弄").replace("捅", "用力吮吸"))
+    for err in ("幹小豆豆", "插小豆豆", "捅小豆豆", "幹陰核", "插陰核", "捅陰核")
+]
+
+_VOICE_TAG_ALT = "|".join(re.escape(tag) for tag in VOICE_TAGS)
+
+# --- 大脑端 ---
+_WRONG_VERB = re.compile(r'([干幹插捅])\s*(小?豆豆|陰核)')
+_STATE_ANY = re.compile(r'\[STATE\s*:\s*(\d+)\]', re.IGNORECASE)
+_STATE_STRICT = re.compile(r'(\[STATE:\d+\])')
+_STATE_BEFORE_CLAUSE = re.compile(r'(\[STATE:\d+\])([^，。！？\n]+)')
+_VOICE_TAG = re.compile(r'\[(?:' + _VOICE_TAG_ALT + r')\]', re.IGNORECASE)
+_BRACKET_RUN = re.compile(r'([(（].*?[)）]){2,}')
+_BRACKET_PART = re.compile(r'[(（](.*?)[)）]')
+# 注意：原实现的字符类写作 [^\\n[(（]，排除的是反斜线与字母 n，这里保持一致
+_ACTION_BREAK = re.compile(r'([^\\n[(（]+)\s*([(（].{10,}[)）])')
+_MEMORY_COLON_TAG = re.compile(r'\[\w+:[^\]]+\]')
+_MEMORY_PARAM_TAG = re.compile(r'\[\w+=[\w.]+\]')
+
+# --- 语音桥接端 ---
+_EMOTION_TAG = re.compile(r'<emotion\s+value=["\']([^"\']+)["\']\s*/>')
+_DISPLAY_SQUARE = re.compile(r'\[.*?\]')
+_DISPLAY_ANGLE = re.compile(r'<.*?>')
+# *笑聲* 描述、英文字母、表情符号 (非 BMP 字符) 一次扫描移除
+_DISPLAY_NOISE = re.compile(r'\*[^\*]+\*|[a-zA-Z]+|[^\u0000-\uFFFF]')
+_PAREN_CONTENT = re.compile(r'\(([^)]+)\)|（([^）]+)）')
+_SPEECH_STATE = re.compile(r'\[STATE:\d\]')
+# 括号内容（替换为空格）与英文字母（直接移除）一次扫描；无需循环，一遍之后不会再产生新的匹配
+_SPEECH_BRACKETS = re.compile(r'\(.*?\)|（.*?）|\[.*?\]|【.*?】|\{.*?\}|([a-zA-Z]+)')
+_SPEECH_PUNCT = re.compile(r'\.{3,}|([!?。！？])\1+')
+_SPEECH_RESIDUE = re.compile(r'<[^>]*>|[^\u0000-\uFFFF]')
+_SPEAKABLE = re.compile(r'[^\s\W_]')
+
+
+def refine_logic(text: str) -> str:
+    """生理常识预审：「幹/插/捅」+「小豆豆/陰核」修正为正确的动作（一次扫描）"""
+    if "豆豆" not in text and "陰核" not in text:
+        return text
+
+    def fix(match):
+        verb, organ = match.group(1), match.group(2)
+        replacement = "舔弄陰核" if organ == "陰核" else _CLITORIS_FIXES[verb]
+        logger.info(f"Logic Refiner: {match.group(0)} -> {replacement} (位置: {match.start()}-{match.end()})")
+        return replacement
+
+    return _WRONG_VERB.sub(fix, text)
+
+
+def map_emotion_tags(text: str, arousal_value: int) -> str:
+    """根据兴奋度等级补全 [STATE:n] 与情绪标签（已有情绪标签时不重复添加）"""
+    tags_for_level = AROUSAL_TAGS.get(arousal_value, [])
+    if not tags_for_level:
+        return text
+
+    if not _STATE_ANY.search(text):
+        text = f"[STATE:{arousal_value}]{text}"
+
+    if _VOICE_TAG.search(text):
+        return text
+
+    tag = tags_for_level[0]
+    if arousal_value >= 3:
+        # 高兴奋度：在 STATE 标签后、文本前插入
+        text = _STATE_STRICT.sub(lambda m: m.group(1) + tag, text, count=1)
+    elif arousal_value == 2:
+        # 兴奋状态：插入在 STATE 标签与第一个子句之间
+        text = _STATE_BEFORE_CLAUSE.sub(lambda m: m.group(1) + tag + m.group(2), text, count=1)
+    return text
+
+
+def beautify(text: str) -> str:
+    """合并连续的括号动作 (A)(B) -> （A，B），较长的动作描写另起一行"""
+    if "(" not in text and "（" not in text:
+        return text.strip()
+
+    def merge_brackets(match):
+        inner = match.group(0)
+        parts = _BRACKET_PART.findall(inner)
+        if len(parts) > 1:
+            return f"（{ '，'.join(parts) }）"
+        return inner
+
+    text = _BRACKET_RUN.sub(merge_brackets, text)
+    text = _ACTION_BREAK.sub(r'\1\n\2', text)
+    return text.strip()
+
+
+def strip_tags_for_memory(text: str) -> str:
+    """移除 STATE / SoVITS / 语音标签，得到写入对话历史的纯净文本"""
+    if "[" not in text:
+        return text.strip()
+    text = _MEMORY_COLON_TAG.sub('', text).strip()
+    text = _MEMORY_PARAM_TAG.sub('', text).strip()
+    return _VOICE_TAG.sub('', text).strip()
+
+
+def extract_state(text: str) -> Tuple[Optional[int], str]:
+    """
+    提取模型自评的 [STATE:n]（限制在 0-4）并从文本中移除
+
+    Returns:
+        (兴奋度等级值，没有 STATE 标签时为 None, 移除标签后的文本)
+    """
+    if "[" not in text:
+        return None, text
+    match = _STATE_ANY.search(text)
+    if not match:
+        return None, text
+    level = max(0, min(4, int(match.group(1))))
+    return level, _STATE_ANY.sub('', text).strip()
+
+
+def extract_emotion(text: str) -> Optional[str]:
+    """提取 <emotion value="..."/> 标签的值"""
+    if "<" not in text:
+        return None
+    match = _EMOTION_TAG.search(text)
+    return match.group(1) if match else None
+
+
+def clean_display(text: str) -> str:
+    """UI 显示文字：移除 [...] / <...> 标签、*描述*、英文字母与表情符号"""
+    if "[" in text:
+        text = _DISPLAY_SQUARE.sub('', text)
+    if "<" in text:
+        text = _DISPLAY_ANGLE.sub('', text)
+    return _DISPLAY_NOISE.sub('', text).strip()
+
+
+def _open_span(text: str, opener: str, closer: str) -> int:
+    """
+    按 [...] / <...> 标签正则的方式从左到右扫描：返回第一个尚未闭合、之后仍可能闭合
+    （同一行内还没有换行）的 opener 位置；没有则返回 len(text)
+    """
+    i = text.find(opener)
+    while i != -1:
+        close = text.find(closer, i + 1)
+        newline = text.find("\n", i + 1)
+        if close != -1 and (newline == -1 or close < newline):
+            i = text.find(opener, close + 1)
+        elif newline == -1:
+            return i
+        else:
+            i = text.find(opener, i + 1)
+    return len(text)
+
+
+def _open_star(text: str) -> int:
+    """按 *描述* 正则的方式扫描：返回第一个尚未闭合的 * 的位置；没有则返回 len(text)"""
+    i = text.find("*")
+    while i != -1:
+        close = text.find("*", i + 1)
+        if close == -1:
+            return i
+        # "**"：第一个 * 无法开始匹配，从第二个 * 重新开始
+        i = close if close == i + 1 else text.find("*", close + 1)
+    return len(text)
+
+
+class DisplayStreamCleaner:
+    """
+    clean_display 的增量版本：逐段输入模型输出，返回可以立即显示的文字
+
+    跨分块的 [...] / <...> / *...* 在闭合（或确定不会闭合）之前暂缓输出，行尾空白等到后面出现文字才输出；
+    所有 feed() 与 flush() 的返回值拼接起来与 clean_display(完整文本) 逐字节一致。
+    """
+
+    # 三道清理依次进行：[...] -> <...> -> *描述* / 英文字母 / 表情符号
+    _STAGES = (
+        (_DISPLAY_SQUARE, lambda text: _open_span(text, "[", "]")),
+        (_DISPLAY_ANGLE, lambda text: _open_span(text, "<", ">")),
+        (_DISPLAY_NOISE, _open_star),
+    )
+
+    def __init__(self):
+        # 每道清理尚未确定的输入（从第一个未闭合的标签开始）；之前的部分已清理并交给下一道
+        self._pending = ["", "", ""]
+        self._started = False      # 是否已输出过非空白字符（用于去除开头空白）
+        self._space = ""           # 暂缓输出的空白
+
+    def _clean(self, text: str, final: bool) -> str:
+        """
+        逐道清理：每道只处理到第一个未闭合标签之前（final 时处理全部），其余留到下次；
+        切分点之前的标签都已闭合，分段替换与整段替换结果相同
+        """
+        for stage, (pattern, open_at) in enumerate(self._STAGES):
+            text = self._pending[stage] + text
+            cut = len(text) if final else open_at(text)
+            self._pending[stage] = text[cut:]
+            text = pattern.sub('', text[:cut])
+        return text
+
+    def _emit(self, delta: str) -> str:
+        if not self._started:
+            delta = delta.lstrip()
+            self._started = bool(delta)
+        if not delta:
+            return ""
+        body = delta.rstrip()
+        if not body:
+            self._space += delta
+            return ""
+        out = self._space + body
+        self._space = delta[len(body):]
+        return out
+
+    def feed(self, delta: str) -> str:
+        if not delta:
+            return ""
+        return self._emit(self._clean(delta, final=False))
+
+    def flush(self) -> str:
+        """输入结束：输出剩余部分（未闭合的标签按 clean_display 的规则保留），丢弃结尾空白"""
+        return self._emit(self._clean("", final=True))
+
+
+def extract_bracket_emotion(text: str) -> Dict[str, str]:
+    """从括号动作描写中提取情绪参数，例如 (咬着下唇，声音娇媚地问) -> positivity/curiosity/stability"""
+    emotion_params = {}
+    if "(" not in text and "（" not in text:
+        return emotion_params
+
+    for match in _PAREN_CONTENT.finditer(text):
+        bracket_content = match.group(1) or match.group(2)
+        for keyword, (pos, cur, sta) in BRACKET_EMOTIONS.items():
+            if keyword in bracket_content:
+                emotion_params["positivity"] = pos
+                emotion_params["curiosity"] = cur
+                emotion_params["stability"] = sta
+                logger.info(f"Extracted emotion from bracket '{bracket_content}': {emotion_params}")
+                break
+    return emotion_params
+
+
+def _speech_bracket_repl(match) -> str:
+    # 英文字母直接移除，括号内容替换为空格
+    return "" if match.group(1) else " "
+
+
+def _speech_punct_repl(match) -> str:
+    return match.group(1) or "..."
+
+
+def clean_for_speech(text: str) -> Tuple[str, Dict[str, str]]:
+    """
+    TTS 文字：移除 STATE、语音标签与所有括号内容（括号情绪转为参数），
+    移除英文字母、尖括号残留与表情符号，并正规化标点与空白
+
+    Returns:
+        (清理后的文本，为空时为「。」, 从括号中提取的情绪参数)
+    """
+    emotion_from_brackets = extract_bracket_emotion(text)
+
+    if "[" in text:
+        text = _SPEECH_STATE.sub('', text)
+        text = _VOICE_TAG.sub(' ', text)
+    text = _SPEECH_BRACKETS.sub(_speech_bracket_repl, text)
+    text = _SPEECH_PUNCT.sub(_speech_punct_repl, text)
+    text = _SPEECH_RESIDUE.sub('', text)
+    text = " ".join(text.split())
+
+    return (text if text else "。", emotion_from_brackets)
+
+
+def correct_physiology(text: str) -> str:
+    """语音桥接端的兜底生理校正（小豆豆/陰核不可被「插/幹/捅」）"""
+    if "小豆豆" not in text and "陰核" not in text:
+        return text
+    for err, fix in _PHYSIOLOGY_FIXES:
+        if err in text:
+            text = text.replace(err, fix)
+            logger.info(f"Physiological Correction Applied: {err} -> {fix}")
+    return text
+
+
+def has_speakable_text(speech_text: str) -> bool:
+    """清理后若只剩标点（例如纯动作描写），则无需送入 TTS"""
+    return bool(_SPEAKABLE.search(speech_text))
+
+
+class RenderedReply:
+    """一段回复的全部派生结果：UI 文字、TTS 文字、兴奋度、<emotion> 与括号情绪"""
+
+    __slots__ = ("text", "display_text", "speech_text", "state_level", "emotion", "bracket_emotion")
+
+    def __init__(
+        self,
+        text: str,
+        display_text: str,
+        speech_text: str,
+        state_level: Optional[int],
+        emotion: Optional[str],
+        bracket_emotion: Dict[str, str]
+    ):
+        self.text = text
+        self.display_text = display_text
+        self.speech_text = speech_text
+        self.state_level = state_level
+        self.emotion = emotion
+        self.bracket_emotion = bracket_emotion
+
+
+def render_reply(text: str, extract_state_tag: bool = True) -> RenderedReply:
+    """
+    一次性处理大脑回复，供语音桥接端各接口共用
+
+    Args:
+        text: 大脑回复（含标签）
+        extract_state_tag: 是否先提取并移除 [STATE:n]（/chat 以此自主切换兴奋度）
+    """
+    state_level = None
+    if extract_state_tag:
+        state_level, text = extract_state(text)
+    speech_text, bracket_emotion = clean_for_speech(text)
+    return RenderedReply(
+        text=text,
+        display_text=clean_display(text),
+        speech_text=speech_text,
+        state_level=state_level,
+        emotion=extract_emotion(text),
+        bracket_emotion=bracket_emotion,
+    )
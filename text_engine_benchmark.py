@@ -0,0 +1,71 @@
+"""
+Text Engine 吞吐量基准
+比较旧版文本处理流水线（text_engine_golden_test 中的冻结副本）与 text_engine 的每秒处理回复数。
+
+用法: python text_engine_benchmark.py [每组迭代次数]
+"""
+
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(0, '.')
+import text_engine
+from text_engine_golden_test import (
+    CORPUS,
+    random_reply,
+    legacy_logic_refiner,
+    legacy_auto_map_emotion_tags,
+    legacy_post_process_beautifier,
+    legacy_clean_for_memory,
+    legacy_chat_pipeline,
+)
+
+logging.disable(logging.CRITICAL)
+
+
+def legacy_brain(text):
+    reply = legacy_post_process_beautifier(legacy_auto_map_emotion_tags(legacy_logic_refiner(text), 2))
+    return legacy_clean_for_memory(reply)
+
+
+def engine_brain(text):
+    reply = text_engine.beautify(text_engine.map_emotion_tags(text_engine.refine_logic(text), 2))
+    return text_engine.strip_tags_for_memory(reply)
+
+
+def engine_bridge(text):
+    return text_engine.render_reply(text)
+
+
+def bench(func, replies, iterations):
+    """返回每秒处理的回复数"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in replies:
+            func(text)
+    elapsed = time.perf_counter() - start
+    return iterations * len(replies) / elapsed
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(7)
+    replies = CORPUS + [random_reply(rng) for _ in range(80)]
+    long_replies = ["".join(replies[i:i + 8]) for i in range(0, len(replies), 8)]
+
+    print(f"Replies per round: {len(replies)} (avg {sum(map(len, replies)) // len(replies)} chars), iterations: {iterations}")
+    print(f"{'stage':<28}{'legacy/s':>12}{'engine/s':>12}{'speedup':>10}")
+    for name, legacy, engine, data in (
+        ("brain post-process", legacy_brain, engine_brain, replies),
+        ("bridge /chat pipeline", legacy_chat_pipeline, engine_bridge, replies),
+        ("bridge /chat (long)", legacy_chat_pipeline, engine_bridge, long_replies),
+    ):
+        legacy_rate = bench(legacy, data, iterations)
+        engine_rate = bench(engine, data, iterations)
+        print(f"{name:<28}{legacy_rate:>12.0f}{engine_rate:>12.0f}{engine_rate / legacy_rate:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
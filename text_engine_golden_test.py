@@ -0,0 +1,287 @@
+"""
+Text Engine 黄金输出测试
+以旧版 phi_brain / voice_bridge 文本处理函数（下方原样冻结的副本）为基准，
+比对 text_engine 在固定语料与随机生成回复上的输出是否逐字节一致；
+并检查 DisplayStreamCleaner 对随机切分的分块逐段清理后，拼接结果与 clean_display 一致。
+
+用法: python text_engine_golden_test.py [随机样本数]
+"""
+
+import re
+import sys
+import random
+import logging
+
+sys.path.insert(0, '.')
+import text_engine
+
+logging.disable(logging.CRITICAL)
+
+
+# ============================================
+# 旧版实现（冻结副本，仅作为比对基准）
+# ============================================
+
+LEGACY_AROUSAL_TAGS = {0: [], 1: ["[sigh]"], 2: ["[giggle]", "[laughter]"], 3: ["[gasp]", "[moan]"], 4: ["[gasp]", "[moan]", "[squeal]"]}
+
+
+def legacy_logic_refiner(text):
+    correction_rules = [
+        (r'([干幹][\s]*小?豆豆)', r'舔弄小豆豆'),
+        (r'(插[\s]*小?豆豆)', r'撥弄小豆豆'),
+        (r'(捅[\s]*小?豆豆)', r'揉搓小豆豆'),
+        (r'([干幹插捅][\s]*陰核)', r'舔弄陰核'),
+    ]
+    refined_text = text
+    for pattern, replacement in correction_rules:
+        refined_text = re.sub(pattern, replacement, refined_text, flags=re.IGNORECASE)
+    has_clitoris = bool(re.search(r'小?豆豆|陰核', refined_text, re.IGNORECASE))
+    has_wrong_verb = bool(re.search(r'[干幹插捅](?![\s]*(?:小穴|嫩穴|陰道|屁眼|菊花|肛門))', refined_text))
+    if has_clitoris and has_wrong_verb:
+        refined_text = re.sub(
+            r'([干幹插捅])([\s]*)(小?豆豆|陰核)',
+            lambda m: {'干': '舔', '幹': '舔', '插': '撥弄', '捅': '揉搓'}.get(m.group(1), '舔') + m.group(2) + m.group(3),
+            refined_text,
+            flags=re.IGNORECASE
+        )
+    return refined_text
+
+
+def legacy_auto_map_emotion_tags(text, level):
+    tags_for_level = LEGACY_AROUSAL_TAGS.get(level, [])
+    if not tags_for_level:
+        return text
+    has_state_tag = bool(re.search(r'\[STATE\s*:\s*\d+\]', text, re.IGNORECASE))
+    if not has_state_tag:
+        text = f"[STATE:{level}]{text}"
+    existing_tags = re.findall(r'\[(?:laughter|sigh|chuckle|gasp|uh-huh|hmm|wink|giggle|moan|squeal)\]', text, re.IGNORECASE)
+    if existing_tags:
+        return text
+    if level in (3, 4):
+        text = re.sub(r'(\[STATE:\d+\])', f'\\1{tags_for_level[0]}', text, count=1)
+    elif level == 2:
+        text = re.sub(r'(\[STATE:\d+\])([^，。！？\n]+)', f'\\1{tags_for_level[0]}\\2', text, count=1)
+    return text
+
+
+def legacy_post_process_beautifier(text):
+    def merge_brackets(match):
+        inner = match.group(0)
+        parts = re.findall(r'[(（](.*?)[)）]', inner)
+        if len(parts) > 1:
+            return f"（{ '，'.join(parts) }）"
+        return inner
+    text = re.sub(r'([(（].*?[)）]){2,}', merge_brackets, text)
+    text = re.sub(r'([^\\n[(（]+)\s*([(（].{10,}[)）])', r'\1\n\2', text)
+    return text.strip()
+
+
+def legacy_clean_for_memory(raw_reply):
+    clean = re.sub(r'\[\w+:[^\]]+\]', '', raw_reply).strip()
+    clean = re.sub(r'\[\w+=[\w.]+\]', '', clean).strip()
+    clean = re.sub(r'\[(?:laughter|sigh|chuckle|gasp|uh-huh|hmm|wink|giggle|moan|squeal)\]', '', clean, flags=re.IGNORECASE).strip()
+    return clean
+
+
+def legacy_clean_text(text):
+    text = re.sub(r'\[.*?\]', '', text)
+    text = re.sub(r'<.*?>', '', text)
+    text = re.sub(r'\[\w+=[\w.]+\]', '', text)
+    text = re.sub(r'\*[^\*]+\*', '', text)
+    text = re.sub(r'[a-zA-Z]+', '', text)
+    text = re.sub(r'[^\u0000-\uFFFF]', '', text)
+    return text.strip()
+
+
+def legacy_extract_emotion_from_brackets(text):
+    emotion_params = {}
+    for match in re.findall(r'\(([^)]+)\)|（([^）]+)）', text):
+        bracket_content = match[0] or match[1]
+        for keyword, (pos, cur, sta) in text_engine.BRACKET_EMOTIONS.items():
+            if keyword in bracket_content:
+                emotion_params["positivity"] = pos
+                emotion_params["curiosity"] = cur
+                emotion_params["stability"] = sta
+                break
+    return emotion_params
+
+
+def legacy_clean_for_speech(text):
+    emotion_from_brackets = legacy_extract_emotion_from_brackets(text)
+    text = re.sub(r'\[STATE:\d\]', '', text)
+    for tag in ["laughter", "sigh", "chuckle", "gasp", "uh-huh", "hmm", "wink", "giggle", "moan", "squeal"]:
+        text = re.sub(rf'\[{re.escape(tag)}\]', ' ', text, flags=re.IGNORECASE)
+    prev_text = ""
+    while prev_text != text:
+        prev_text = text
+        text = re.sub(r'\(.*?\)|（.*?）|\[.*?\]|【.*?】|\{.*?\}', ' ', text)
+    text = re.sub(r'[a-zA-Z]+', '', text)
+    text = re.sub(r'\.{3,}', '...', text)
+    text = re.sub(r'(!|\?|。|！|？)\1+', r'\1', text)
+    text = re.sub(r'<[^>]*>', '', text)
+    text = re.sub(r'[^\u0000-\uFFFF]', '', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return (text if text else "。", emotion_from_brackets)
+
+
+def legacy_clause_buffer(text):
+    whitelist = [r'\[laughter\]', r'\[sigh\]', r'\[chuckle\]', r'\[gasp\]', r'\[uh-huh\]', r'\[hmm\]', r'\[wink\]', r'\[giggle\]', r'\[moan\]', r'\[squeal\]']
+    tag_map = {}
+    protected_text = text
+    for idx, pattern in enumerate(whitelist):
+        for match in reversed(list(re.finditer(pattern, protected_text, re.IGNORECASE))):
+            placeholder = f"__CARTESIA_TAG_{idx}_{match.start()}__"
+            tag_map[placeholder] = match.group(0)
+            protected_text = protected_text[:match.start()] + placeholder + protected_text[match.end():]
+    result = protected_text
+    for placeholder, original_tag in tag_map.items():
+        result = result.replace(placeholder, original_tag)
+    return result.strip()
+
+
+def legacy_pre_process_tags(text):
+    for err in ["幹小豆豆", "插小豆豆", "捅小豆豆", "幹陰核", "插陰核", "捅陰核"]:
+        if err in text:
+            text = text.replace(err, err.replace("幹", "瘋狂舔弄").replace("插", "高速撥弄").replace("捅", "用力吮吸"))
+    return text
+
+
+def legacy_chat_pipeline(ai_response_text):
+    """/chat 的旧流程：提取 STATE -> UI 文字 -> <emotion> -> 子句缓冲 -> 语音清理"""
+    state_level = None
+    state_match = re.search(r'\[STATE\s*:\s*(\d+)\]', ai_response_text, re.IGNORECASE)
+    if state_match:
+        state_level = max(0, min(4, int(state_match.group(1))))
+        ai_response_text = re.sub(r'\[STATE\s*:\s*\d+\]', '', ai_response_text, flags=re.IGNORECASE).strip()
+    display_text = legacy_clean_text(ai_response_text)
+    emotion_match = re.search(r'<emotion\s+value=["\']([^"\']+)["\']\s*/>', ai_response_text)
+    emotion = emotion_match.group(1) if emotion_match else None
+    speech_text, bracket_emotion = legacy_clean_for_speech(legacy_clause_buffer(ai_response_text))
+    return ai_response_text, display_text, speech_text, state_level, emotion, bracket_emotion
+
+
+def legacy_bridge_pipeline(ai_response_text):
+    """/api/v1/chat 的旧流程：不提取 STATE"""
+    display_text = legacy_clean_text(ai_response_text)
+    speech_text, bracket_emotion = legacy_clean_for_speech(legacy_clause_buffer(ai_response_text))
+    emotion_match = re.search(r'<emotion\s+value=["\']([^"\']+)["\']\s*/>', ai_response_text)
+    emotion = emotion_match.group(1) if emotion_match else None
+    return ai_response_text, display_text, speech_text, None, emotion, bracket_emotion
+
+
+# ============================================
+# 测试语料
+# ============================================
+
+CORPUS = [
+    "[STATE:2]主人，你來啦！(害羞地低下頭)菲菲好想你。[giggle]今天要陪我嗎？",
+    "[STATE:4][gasp]主人...菲菲...受不了了！！(身體劇烈顫抖，喘息著)(緊緊抱住主人)",
+    "[state: 3] 嗯...[moan] 主人好壞～（咬着下唇，声音娇媚地问）你想看菲菲更害羞的樣子嗎？？",
+    "(身體抖動)(貼近主人)(摩擦) 主人，你會永遠愛菲菲嗎？(害羞的低下頭)",
+    "好的主人。(微笑)(點頭)(行禮)",
+    "我想討論一下生命的意義...(開始哭泣)(身體發抖)",
+    "[speed=1.15][pitch=1.05][emotion=excited]主人你好壞喔！😈🔥",
+    "<emotion value=\"seductive\"/>主人～*輕笑* 菲菲在這裡等你很久了。Inserted emote here.",
+    "主人想幹小豆豆嗎？菲菲不准你插 陰核喔。(臉紅)",
+    "【旁白】她輕輕靠近。{內心：好緊張}主人……要抱抱。",
+    "（娇嗔地推開主人）討厭啦！！！你又欺負人家……\n（脸红到耳根）",
+    "[STATE:10]超出範圍的狀態值。[HMM]嗯？",
+    "沒有任何標籤的普通回覆。",
+    "",
+    "   ",
+    "(((嵌套(括號)測試)))還有[未閉合的標籤 與 (未閉合的括號",
+    "[sigh]唉……主人今天好忙喔。[uh-huh][Wink]",
+    "主人!!!??真的嗎。。。好開心！！！！",
+    "[STATE:1]菲菲(輕聲說)我(小聲地)在(看著你)這裡。",
+    "<break time=\"1s\"/>主人<prosody rate=\"slow\">慢一點</prosody>好不好",
+]
+
+FRAGMENTS = [
+    "主人", "菲菲好想你", "嗯", "討厭啦", "你想看菲菲更害羞的樣子嗎", "乖", "小豆豆", "陰核", "幹", "插", "捅", " ",
+    "\n", "。", "！", "？", "!", "?", "...", "……", "，", "～", "！！", "？？", "。。。",
+    "[STATE:0]", "[STATE:2]", "[STATE:4]", "[state: 3]", "[STATE:12]",
+    "[sigh]", "[giggle]", "[laughter]", "[gasp]", "[moan]", "[squeal]", "[Hmm]", "[uh-huh]",
+    "[speed=1.15]", "[pitch=0.90]", "[emotion=calm]", "[旁白]", "[", "]",
+    "(害羞地低下頭)", "(咬着下唇，声音娇媚地问)", "（娇嗔地推開）", "（脸红）", "(微笑)", "(點頭)",
+    "(身體劇烈地顫抖著，緊緊抱住主人不放)", "(", ")", "（", "）", "【動作】", "{內心}",
+    "<emotion value=\"playful\"/>", "<emotion value='shy' />", "<break/>", "<", ">",
+    "*輕笑*", "*", "Hello", "ok", "😈", "🔥", "😊",
+]
+
+
+def random_reply(rng):
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 24)))
+
+
+def random_soup(rng):
+    alphabet = "主人菲豆核幹插 \n。！？!?.…[]()（）【】{}<>*:=STAEsighmo0123😈"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+
+
+def stream_display(text, rng):
+    """把文本随机切成 1-6 字的分块，逐段送入 DisplayStreamCleaner 并拼接输出"""
+    cleaner = text_engine.DisplayStreamCleaner()
+    parts = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        parts.append(cleaner.feed(text[i:i + size]))
+        i += size
+    parts.append(cleaner.flush())
+    return "".join(parts)
+
+
+def check(name, expected, actual, text, failures):
+    if expected != actual:
+        failures.append((name, text, expected, actual))
+
+
+def run_case(text, failures):
+    check("refine_logic", legacy_logic_refiner(text), text_engine.refine_logic(text), text, failures)
+    for level in range(5):
+        check(f"map_emotion_tags[{level}]", legacy_auto_map_emotion_tags(text, level),
+              text_engine.map_emotion_tags(text, level), text, failures)
+    check("beautify", legacy_post_process_beautifier(text), text_engine.beautify(text), text, failures)
+    check("strip_tags_for_memory", legacy_clean_for_memory(text), text_engine.strip_tags_for_memory(text), text, failures)
+    check("clean_display", legacy_clean_text(text), text_engine.clean_display(text), text, failures)
+    check("clean_display_stream", legacy_clean_text(text), stream_display(text, random.Random(text)), text, failures)
+    check("clean_for_speech", legacy_clean_for_speech(text), text_engine.clean_for_speech(text), text, failures)
+    check("correct_physiology", legacy_pre_process_tags(text), text_engine.correct_physiology(text), text, failures)
+
+    for legacy, extract in ((legacy_chat_pipeline, True), (legacy_bridge_pipeline, False)):
+        rendered = text_engine.render_reply(text, extract_state_tag=extract)
+        actual = (rendered.text, rendered.display_text, rendered.speech_text,
+                  rendered.state_level, rendered.emotion, rendered.bracket_emotion)
+        check(f"render_reply[extract_state_tag={extract}]", legacy(text), actual, text, failures)
+
+    # 大脑端完整流水线：生理校正 -> 情绪标签 -> 美化
+    for level in range(5):
+        expected = legacy_post_process_beautifier(legacy_auto_map_emotion_tags(legacy_logic_refiner(text), level))
+        actual = text_engine.beautify(text_engine.map_emotion_tags(text_engine.refine_logic(text), level))
+        check(f"brain_pipeline[{level}]", expected, actual, text, failures)
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(20240601)
+    failures = []
+
+    cases = list(CORPUS)
+    cases += [random_reply(rng) for _ in range(samples)]
+    cases += [random_soup(rng) for _ in range(samples)]
+    for text in cases:
+        run_case(text, failures)
+
+    print(f"Cases: {len(cases)} (corpus {len(CORPUS)}, generated {samples}, char soup {samples})")
+    if failures:
+        print(f"FAIL: {len(failures)} mismatches")
+        for name, text, expected, actual in failures[:10]:
+            print(f"--- {name} ---\ninput:    {text!r}\nexpected: {expected!r}\nactual:   {actual!r}")
+        sys.exit(1)
+
+    print("PASS: text_engine output is identical to the legacy pipeline")
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
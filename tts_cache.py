@@ -0,0 +1,257 @@
+"""
+TTS Cache - 语音合成结果缓存
+以合成参数的哈希作为内容地址，将音讯存放在 static/output 下，按 LRU 淘汰并限制总大小。
+相同参数的并发请求合并为一次上游调用（single-flight），流式响应在传输途中顺带写入缓存（tee）。
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from metrics import AUDIO_IO
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件名前缀，便于与其他输出文件区分
+CACHE_FILE_PREFIX = "tts_"
+# 从磁盘回放时的分块大小
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class TTSCache:
+    """内容寻址、磁盘持久化的 TTS 音讯缓存（LRU + 大小上限 + single-flight）"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 200 * 1024 * 1024, enabled: bool = True):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录（与对外提供的 static/output 相同）
+            max_bytes: 缓存文件总大小上限，超出后按 LRU 淘汰
+            enabled: 关闭时所有请求直通上游
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+        # key -> 文件大小，顺序即 LRU 顺序（最久未用在前）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        # 进行中的上游请求：key -> Future（结果为是否成功写入缓存）
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(
+        text: str,
+        voice_id: str,
+        model_id: str,
+        voice_settings: Optional[Dict],
+        output_format: str
+    ) -> str:
+        """根据合成参数计算缓存键（稳定的 JSON 序列化后取 SHA-256）"""
+        payload = json.dumps(
+            {
+                "text": text,
+                "voice_id": voice_id,
+                "model_id": model_id,
+                "voice_settings": voice_settings or {},
+                "output_format": output_format,
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        # 文件扩展名跟随输出格式（mp3_44100_128 -> mp3）
+        return f"{digest}.{output_format.split('_')[0]}"
+
+    def path_for(self, key: str) -> str:
+        """缓存键对应的文件路径"""
+        return os.path.join(self.cache_dir, CACHE_FILE_PREFIX + key)
+
+    def filename_for(self, key: str) -> str:
+        """缓存键对应的文件名（用于构建 /static/output/ 链接）"""
+        return CACHE_FILE_PREFIX + key
+
+    def _load_index(self):
+        """启动时扫描目录重建索引，按修改时间恢复 LRU 顺序"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.startswith(CACHE_FILE_PREFIX) or name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[len(CACHE_FILE_PREFIX):], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+        if entries:
+            logger.info(f"TTS cache index restored: {len(entries)} files, {self._total_bytes} bytes")
+        self._evict()
+
+    def lookup(self, key: str, record_hit: bool = False) -> Optional[str]:
+        """
+        查询缓存；命中时更新 LRU 位置并返回文件路径
+
+        Args:
+            record_hit: 调用方将直接提供该文件（不经过 stream）时设为 True，计入命中统计
+        """
+        if not self.enabled or key not in self._index:
+            return None
+
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            # 文件已被外部删除，同步索引
+            self._forget(key)
+            return None
+
+        self._index.move_to_end(key)
+        if record_hit:
+            self.hits += 1
+        try:
+            # 刷新 mtime，使重启后仍能恢复 LRU 顺序
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    async def stream(
+        self,
+        key: str,
+        open_stream: Callable[[], AsyncIterator[bytes]]
+    ) -> AsyncIterator[bytes]:
+        """
+        通过缓存获取音讯流
+
+        - 命中：直接从磁盘回放
+        - 同一 key 已有上游请求进行中：等待其完成后从磁盘回放（失败则自行请求）
+        - 未命中：调用 open_stream() 请求上游，边转发边缓存，完整结束后写入磁盘
+        """
+        if not self.enabled:
+            async for chunk in open_stream():
+                yield chunk
+            return
+
+        path = self.lookup(key)
+        if path is None and key in self._inflight:
+            self.coalesced += 1
+            if await asyncio.shield(self._inflight[key]):
+                path = self.lookup(key)
+
+        if path is not None:
+            self.hits += 1
+            async for chunk in self._read_file(path):
+                yield chunk
+            return
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        stored = False
+        try:
+            chunks = []
+            async for chunk in open_stream():
+                chunks.append(chunk)
+                yield chunk
+            stored = await self._store(key, b"".join(chunks))
+        finally:
+            # 中途失败或客户端断开时不写入，等待者会回退为自行请求
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.set_result(stored)
+
+    async def _read_file(self, path: str) -> AsyncIterator[bytes]:
+        """在 threadpool 中读取缓存文件，避免阻塞事件循环"""
+        data = await asyncio.to_thread(self._read_bytes, path)
+        for i in range(0, len(data), READ_CHUNK_SIZE):
+            yield data[i:i + READ_CHUNK_SIZE]
+
+    @staticmethod
+    def _read_bytes(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def _store(self, key: str, data: bytes) -> bool:
+        """原子写入缓存文件（先写临时文件再 rename），并执行淘汰"""
+        if not data:
+            return False
+
+        path = self.path_for(key)
+        try:
+            with AUDIO_IO.time(op="cache_write"):
+                await asyncio.to_thread(self._write_atomic, path, data)
+        except OSError as e:
+            logger.error(f"TTS cache write failed for {path}: {e}")
+            return False
+
+        if key in self._index:
+            self._total_bytes -= self._index[key]
+        self._index[key] = len(data)
+        self._index.move_to_end(key)
+        self._total_bytes += len(data)
+        self._evict()
+        return key in self._index
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        # 临时文件名唯一：多个 worker 共享输出目录、同时写入同一个键时互不截断
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _evict(self):
+        """超出大小上限时按 LRU 删除最久未用的文件"""
+        while self._total_bytes > self.max_bytes and self._index:
+            key, _ = next(iter(self._index.items()))
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"TTS cache eviction failed for {key}: {e}")
+            self._forget(key)
+            self.evictions += 1
+
+    def _forget(self, key: str):
+        size = self._index.pop(key, 0)
+        self._total_bytes -= size
+
+    def stats(self) -> Dict:
+        """命中/未命中计数与容量信息"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
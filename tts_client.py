@@ -0,0 +1,172 @@
+"""
+TTS Client - 应用级共享的 ElevenLabs 客户端
+基于调优过的 httpx 连接池（keep-alive，可用时启用 HTTP/2），
+整个进程复用同一组连接，避免每轮对话重新建立 TCP/TLS 连接。
+合成请求经过共享限流器（PHI_RATE_ELEVENLABS_RPM / _TPM，TPM 按字符计），
+瞬时错误在首个音频字节之前以带抖动的指数退避重试。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import importlib.util
+from typing import Dict, Optional, AsyncIterator
+
+import httpx
+
+from rate_limiter import RETRYABLE_STATUSES, get_limiter, backoff_delay, max_retries, parse_retry_after
+from metrics import TTS_REQUESTS, TTS_TTFB, TTS_DURATION, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class PooledTTSClient:
+    """持有共享 httpx 连接池的 AsyncElevenLabs 客户端，并统计连接复用情况"""
+
+    def __init__(
+        self,
+        api_key: str,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+        timeout: float = 60.0
+    ):
+        """
+        初始化连接池与客户端（未指定的参数从环境变量读取）
+
+        Args:
+            api_key: ElevenLabs API Key
+            max_connections: 连接池最大连接数 (PHI_TTS_MAX_CONNECTIONS)
+            max_keepalive_connections: 最大保活连接数 (PHI_TTS_MAX_KEEPALIVE)
+            keepalive_expiry: 空闲连接保活秒数 (PHI_TTS_KEEPALIVE_EXPIRY)
+            http2: 是否启用 HTTP/2 (PHI_TTS_HTTP2)；默认在安装了 h2 时启用
+            timeout: 单次请求超时秒数
+        """
+        from elevenlabs.client import AsyncElevenLabs
+
+        if max_connections is None:
+            max_connections = int(os.getenv("PHI_TTS_MAX_CONNECTIONS", "20"))
+        if max_keepalive_connections is None:
+            max_keepalive_connections = int(os.getenv("PHI_TTS_MAX_KEEPALIVE", "10"))
+        if keepalive_expiry is None:
+            keepalive_expiry = float(os.getenv("PHI_TTS_KEEPALIVE_EXPIRY", "120"))
+        if http2 is None:
+            http2_setting = os.getenv("PHI_TTS_HTTP2", "auto").lower()
+            http2 = http2_setting in ("1", "true", "yes") or (
+                http2_setting == "auto" and importlib.util.find_spec("h2") is not None
+            )
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested for TTS client but 'h2' is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+
+        # 连接复用统计
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+        self.http_client = httpx.AsyncClient(
+            limits=self.limits,
+            http2=http2,
+            timeout=timeout,
+            event_hooks={"request": [self._attach_trace]},
+        )
+        self.client = AsyncElevenLabs(
+            api_key=api_key,
+            base_url=os.getenv("ELEVENLABS_BASE_URL") or None,
+            httpx_client=self.http_client,
+        )
+        self.limiter = get_limiter("elevenlabs", api_key)
+        logger.info(
+            f"TTS connection pool ready: max_connections={max_connections}, "
+            f"keepalive={max_keepalive_connections}/{keepalive_expiry}s, http2={http2}"
+        )
+
+    @property
+    def text_to_speech(self):
+        return self.client.text_to_speech
+
+    async def convert(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """
+        限流后调用 text_to_speech.convert，返回音频分块
+
+        429 / 5xx / 连接失败且尚未收到任何音频时重试（尊重 Retry-After），
+        已开始输出后的失败直接抛出，避免音频重复；最终失败时抛出原始异常。
+        """
+        from elevenlabs.core.api_error import ApiError
+
+        # 关闭 SDK 对非流式请求的隐式重试，统一在这里退避
+        kwargs.setdefault("request_options", {"max_retries": 0})
+        retries = max_retries()
+        began = time.monotonic()
+        outcome = "cancelled"
+        try:
+            for attempt in range(retries + 1):
+                await self.limiter.acquire(len(text))
+                started = False
+                try:
+                    async for chunk in self.client.text_to_speech.convert(text=text, **kwargs):
+                        if not started:
+                            started = True
+                            TTS_TTFB.observe(time.monotonic() - began)
+                        yield chunk
+                    outcome = "ok"
+                    TTS_DURATION.observe(time.monotonic() - began)
+                    return
+                except (ApiError, httpx.TransportError) as e:
+                    status = getattr(e, "status_code", None)
+                    if started or attempt >= retries or not (status is None or status in RETRYABLE_STATUSES):
+                        outcome = str(status or "connection")
+                        raise
+                    delay = backoff_delay(attempt, parse_retry_after(getattr(e, "headers", None)))
+                    if status == 429:
+                        self.limiter.penalize(delay)
+                    UPSTREAM_RETRIES.inc(upstream="elevenlabs", status=status or "connection")
+                    logger.warning(
+                        f"ElevenLabs TTS 错误 ({status or type(e).__name__})，等待 {delay:.1f} 秒后重试 ({attempt + 1}/{retries})"
+                    )
+                    await asyncio.sleep(delay)
+        except Exception:
+            if outcome == "cancelled":
+                outcome = "error"
+            raise
+        finally:
+            TTS_REQUESTS.inc(status=outcome)
+
+    async def _attach_trace(self, request: httpx.Request):
+        """为每个请求挂载 httpcore trace 回调，用于统计新建连接与 TLS 握手"""
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: Dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def stats(self) -> Dict:
+        """连接复用统计：稳态下 new_connections 不应随请求数增长"""
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+        }
+
+    async def aclose(self):
+        """关闭连接池（应用关闭时调用）"""
+        await self.http_client.aclose()
+        logger.info("TTS connection pool closed.")
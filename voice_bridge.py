@@ -11,17 +11,23 @@ import logging
 import uuid
 import time
 import json
-import re
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, Literal
+from urllib.parse import quote
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Security, status
-from fastapi.security.api_key import APIKeyHeader
-from fastapi.responses import StreamingResponse, Response, FileResponse, HTMLResponse
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, Field
-from dotenv import load_dotenv
+from boot import BootTimer, load_env
+
+# 啟動分階段計時（就緒時輸出耗時明細，並在 /health 中提供）
+boot = BootTimer()
+
+with boot.phase("framework"):
+    from fastapi import FastAPI, HTTPException, Security, status, Request, WebSocket, WebSocketDisconnect
+    from fastapi.security.api_key import APIKeyHeader
+    from fastapi.responses import StreamingResponse, Response, FileResponse, HTMLResponse
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.staticfiles import StaticFiles
+    from pydantic import BaseModel, Field
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -32,22 +38,18 @@ _base_dir = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.join(_base_dir, "static/output")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# 音訊清理邏輯
-async def cleanup_audio_file(file_path: str, delay: int = 600):
-    """在延遲時間後刪除音訊文件"""
-    await asyncio.sleep(delay)
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            logger.info(f"🗑️ Automatically cleaned up audio file: {file_path}")
-        except Exception as e:
-            logger.error(f"Failed to cleanup file {file_path}: {e}")
-
 # ============================================
 # 終極路徑修正與依賴修復（解決生產環境 500 錯誤）
 # ============================================
 def force_recovery_deps():
-    """強制路徑鎖定與依賴恢復邏輯"""
+    """
+    強制路徑鎖定與依賴恢復邏輯
+
+    會修改 sys.path 並可能在運行時執行 pip install，僅在設置 PHI_RECOVER_DEPS=1 時於啟動時調用；
+    正常部署應在構建階段安裝 requirements.txt。
+    """
+    patch_dir = os.path.join(os.getcwd(), "deps")
+
     # 1. 優先注入所有可能的生產環境包路徑
     possible_site_packages = [
         os.path.join(os.getcwd(), "deps"),
@@ -68,8 +70,7 @@ def force_recovery_deps():
     except ImportError:
         logger.warning("⚠️ google-generativeai still missing. Executing Emergency OS-level Install...")
         
-        # 定義本地補丁目錄
-        patch_dir = os.path.join(os.getcwd(), "deps")
+        # 本地補丁目錄
         os.makedirs(patch_dir, exist_ok=True)
         if patch_dir not in sys.path:
             sys.path.insert(0, patch_dir)
@@ -107,9 +108,6 @@ def force_recovery_deps():
         except Exception as e:
             logger.error(f"❌ ElevenLabs install failed: {e}")
 
-# 執行修復 (如果環境缺少依賴則自動補全)
-force_recovery_deps()
-
 # 确保当前目录在路径中（必須在 deps 之前，否則會找不到 phi_brain）
 _project_root = os.path.dirname(os.path.abspath(__file__))
 if _project_root not in sys.path:
@@ -135,30 +133,16 @@ async def get_api_key(api_key: str = Security(api_key_header)):
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="無效的 API Key，菲菲不跟你說話！")
 
 # ============================================
-# 强制重新加载 .env 环境变量（修复 401 错误）
+# 加载 .env 环境变量（只解析一次，兼容 BOM；生产环境直接使用系统环境变量）
 # ============================================
-_base_dir = os.path.dirname(os.path.abspath(__file__))
-_env_path = os.path.join(_base_dir, ".env")
+with boot.phase("env"):
+    load_env(_base_dir)
 
-# 优先从环境变量读取（Railway/生产环境）
-# 如果 .env 文件存在，也尝试加载（本地开发环境）
-if os.path.exists(_env_path):
-    load_dotenv(_env_path, override=True)
-    # 手动加载并处理可能的 BOM（双重保险）
-    try:
-        with open(_env_path, 'r', encoding='utf-8') as f:
-            env_content = f.read().lstrip('\ufeff')
-            for line in env_content.splitlines():
-                if '=' in line and not line.startswith('#') and line.strip():
-                    k, v = line.split('=', 1)
-                    os.environ[k.strip()] = v.strip()
-        logger.info("Manually parsed .env to bypass potential BOM issues.")
-    except Exception as e:
-        logger.warning(f"Manual .env parse failed: {e}")
-else:
-    # Railway/生产环境：直接从系统环境变量读取
-    logger.info("No .env file found, using system environment variables (Railway/production mode)")
-    load_dotenv(override=False)  # 不覆盖已存在的环境变量
+# 運行時依賴修復：預設關閉，啟動時不安裝任何套件、不修改 sys.path
+# （舊部署若依賴運行時補裝，可設 PHI_RECOVER_DEPS=1 恢復原行為）
+if os.getenv("PHI_RECOVER_DEPS", "0") == "1":
+    with boot.phase("recover_deps"):
+        force_recovery_deps()
 
 # 调试输出：确认 ELEVENLABS_API_KEY 是否正确加载
 _eleven_key = os.getenv("ELEVENLABS_API_KEY")
@@ -172,13 +156,46 @@ else:
 if not os.getenv("GEMINI_API_KEY"):
     logger.warning("GEMINI_API_KEY not found, but continuing...")
 
-from phi_brain import PhiBrain, PersonalityMode, ArousalLevel
+# 上游 SDK 只在對應適配器建立時導入（未配置的提供商不會被載入）
+with boot.phase("modules"):
+    from phi_brain import PhiBrain, PersonalityMode, ArousalLevel, BatchItem
+    from tts_cache import TTSCache
+    from tts_client import PooledTTSClient
+    from rate_limiter import limiter_stats
+    from admission import AdmissionController
+    from audio_links import AudioLinks
+    from audio_sweeper import AudioSweeper
+    from session_backend import create_session_backend
+    import metrics
+    from metrics import TEXT_PROCESSING, AUDIO_IO, HTTP_REQUESTS, HTTP_LATENCY
+    from text_engine import render_reply, clean_for_speech, correct_physiology, refine_logic, has_speakable_text, DisplayStreamCleaner
+
+# 應用級共享的 TTS 客戶端（在 lifespan 中建立，所有請求復用同一連接池）
+tts_client: Optional[PooledTTSClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """應用生命週期：啟動時建立共享 TTS 連接池並開始清掃輸出目錄，關閉時釋放"""
+    global tts_client
+    with boot.phase("tts_client"):
+        if ELEVENLABS_API_KEY:
+            tts_client = PooledTTSClient(api_key=ELEVENLABS_API_KEY)
+    audio_sweeper.start()
+    boot.ready()
+    try:
+        yield
+    finally:
+        await audio_sweeper.stop()
+        if tts_client is not None:
+            await tts_client.aclose()
+            tts_client = None
 
 # 初始化 FastAPI
 app = FastAPI(
     title="Phi Voice Bridge (Integrated)",
     description="ElevenLabs + PhiBrain 统一桥接器",
-    version="2.1.0"
+    version="2.1.0",
+    lifespan=lifespan
 )
 
 # 配置 CORS
@@ -188,13 +205,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Phi-Text", "X-Phi-Arousal"],
 )
 
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    """按路由模板統計請求數、狀態碼與響應開始前的耗時"""
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        if not route_path.startswith("/static"):
+            HTTP_REQUESTS.inc(method=request.method, route=route_path, status=status_code)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=route_path)
+
 # 核心配置
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "n41RXbR5qDhB6k5M6gyU")  # 默认使用用户提供的 Phi 音色
 MODEL_ID = "eleven_multilingual_v2" # 支持多语言的 V2 模型
 
+TTS_OUTPUT_FORMAT = "mp3_44100_128"
+
+# TTS 音訊快取（內容尋址，存放於 static/output，按 LRU 淘汰）
+with boot.phase("tts_cache"):
+    tts_cache = TTSCache(
+        OUTPUT_DIR,
+        max_bytes=int(os.getenv("PHI_TTS_CACHE_MAX_MB", "200")) * 1024 * 1024,
+        enabled=os.getenv("PHI_TTS_CACHE_ENABLED", "1") != "0"
+    )
+
+# 臨時音訊文件的生命週期：登記到期時間，由單一週期任務清掃（重啟後按 mtime 回收，並限制目錄總大小）
+audio_sweeper = AudioSweeper(OUTPUT_DIR)
+
+# 多 worker 共享存儲（PHI_SESSION_BACKEND）：會話歷史與音訊連結在所有 worker 間可見
+session_backend = create_session_backend()
+
+# /chat 的短期音訊連結（瀏覽器請求連結時才合成，邊合成邊播放；連結可能由另一個 worker 解析）
+audio_links = AudioLinks(backend=session_backend)
+
+# LLM / TTS 階段的準入控制：有界並發 + 有界等待隊列，過載時以 503 + Retry-After 快速失敗
+admission = AdmissionController()
+
 # 验证 ELEVENLABS_API_KEY
 if not ELEVENLABS_API_KEY:
     logger.error("CRITICAL: ELEVENLABS_API_KEY is missing! TTS will fail.")
@@ -228,10 +284,12 @@ try:
         raise ValueError(error_msg)
     
     logger.info(f"GEMINI_API_KEY found (length: {len(gemini_key)})")
-    brain = PhiBrain(
-        api_type="gemini",  # 迁移至 Gemini 2.0 Flash
-        personality=PersonalityMode.MIXED
-    )
+    with boot.phase("brain"):
+        brain = PhiBrain(
+            api_type="gemini",  # 迁移至 Gemini 2.0 Flash
+            personality=PersonalityMode.MIXED,
+            session_backend=session_backend
+        )
     logger.info("✅ PhiBrain (LLM) initialized successfully.")
 except Exception as e:
     import traceback
@@ -247,6 +305,11 @@ class TTSRequest(BaseModel):
     text_language: str = Field("zh", description="文本语言")
     arousal_level: Optional[int] = Field(0, description="兴奋度等级", ge=0, le=4)
     speed: Optional[float] = Field(1.0, description="语速")
+    session_id: Optional[str] = Field("default", description="會話 ID（不同會話的歷史與興奮度互相獨立）")
+    audio_delivery: Literal["url", "stream", "base64"] = Field(
+        "url",
+        description="音訊交付方式：url（短期音訊連結，預設）、stream（響應體即音訊流，文字放在響應頭）、base64（舊版 data URI）"
+    )
 
 class PhiVoiceRequest(BaseModel):
     user_input: str = Field(..., description="用戶欲傳達給心菲的文字")
@@ -256,6 +319,18 @@ class ChatRequest(BaseModel):
     message: str = Field(..., description="要傳送給菲菲的訊息")
     user_id: Optional[str] = Field("MISSAV_USER", description="外部用戶識別碼")
 
+# 批量接口單次請求的條目上限
+BATCH_MAX_ITEMS = int(os.getenv("PHI_BATCH_MAX_ITEMS", "500"))
+
+class BatchChatItem(BaseModel):
+    message: str = Field(..., description="要傳送給菲菲的訊息")
+    session_id: Optional[str] = Field(None, description="會話 ID（相同 ID 的條目按順序執行；留空則每條使用獨立的臨時會話）")
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS, description="批量條目")
+    concurrency: Optional[int] = Field(None, ge=1, le=64, description="並行數（預設 PHI_BATCH_CONCURRENCY）")
+    ordered: bool = Field(True, description="true 按輸入順序回傳；false 按完成順序回傳（每行帶 index）")
+
 @app.get("/api", response_class=HTMLResponse)
 async def get_api_docs():
     """返回專業的 API 對接文件頁面"""
@@ -271,29 +346,21 @@ async def health_check():
     brain_status = "ready" if brain is not None else "not_ready"
     tts_error = None
     
-    # 检查 ElevenLabs API Key
+    # 检查 ElevenLabs API Key 与共享客户端（不再为健康检查新建客户端）
     eleven_status = "ready" if ELEVENLABS_API_KEY else "not_ready"
-    
-    # 简单的客户端初始化检查
-    if ELEVENLABS_API_KEY:
-        try:
-            from elevenlabs.client import ElevenLabs
-            # 初始化客户端（不调用 API）
-            test_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-            eleven_status = "ready"
-        except ImportError as e:
-            eleven_status = "import_error"
-            tts_error = str(e)
-            logger.error(f"TTS Import Failed: {e}")
-        except Exception as e:
-            eleven_status = "error"
-            tts_error = str(e)
-            logger.error(f"TTS Health Check Failed: {e}")
+    if ELEVENLABS_API_KEY and tts_client is None:
+        eleven_status = "error"
+        tts_error = "Shared ElevenLabs client is not initialized"
     
     # 检查 GEMINI_API_KEY 诊断信息
     gemini_key = os.getenv("GEMINI_API_KEY")
     gemini_key_exists = gemini_key is not None and len(gemini_key) > 0
     
+    # 共享存储的统计会查询存储（SQLite COUNT），放到 threadpool 执行
+    shared_sessions = None
+    if brain and brain.shared_sessions:
+        shared_sessions = await asyncio.to_thread(brain.shared_sessions.stats)
+
     # 构建诊断信息
     diagnostics = {}
     if not brain:
@@ -311,9 +378,97 @@ async def health_check():
         "engine": "elevenlabs",
         "timestamp": datetime.now().isoformat(),
         "diagnostics": diagnostics if diagnostics else None,
-        "tts_error_detail": str(tts_error) if tts_error else None 
+        "tts_error_detail": str(tts_error) if tts_error else None,
+        "tts_cache": tts_cache.stats(),
+        "tts_pool": tts_client.stats() if tts_client else None,
+        "audio_links": audio_links.stats(),
+        "audio_files": audio_sweeper.stats(),
+        "sessions": brain.sessions.stats() if brain else None,
+        "shared_sessions": shared_sessions,
+        "context_window": brain.summary_stats() if brain else None,
+        "memory": brain.memory_index.stats() if brain and brain.memory_index else None,
+        "hedging": brain.hedging_stats() if brain else None,
+        "model_router": brain.model_router.stats() if brain else None,
+        "rate_limits": limiter_stats(),
+        "admission": admission.stats(),
+        "boot": boot.stats()
     }
 
+def _component_metrics():
+    """抓取時把各組件已有的統計轉換為指標"""
+    yield ("phi_tts_cache_lookups_total", "counter", "TTS cache lookups by result.", [
+        ({"result": "hit"}, tts_cache.hits),
+        ({"result": "miss"}, tts_cache.misses),
+        ({"result": "coalesced"}, tts_cache.coalesced),
+    ])
+    if tts_client is not None:
+        pool = tts_client.stats()
+        yield ("phi_tts_pool_connections_total", "counter", "TTS pool requests and new TCP/TLS connections.", [
+            ({"kind": "requests"}, pool["requests"]),
+            ({"kind": "new_connections"}, pool["new_connections"]),
+            ({"kind": "tls_handshakes"}, pool["tls_handshakes"]),
+        ])
+
+    stages = admission.stats()
+    yield ("phi_admission_in_flight", "gauge", "Requests currently holding a stage slot.",
+           [({"stage": name}, stats["in_flight"]) for name, stats in stages.items()])
+    yield ("phi_admission_queue_depth", "gauge", "Requests waiting for a stage slot.",
+           [({"stage": name}, stats["queue_depth"]) for name, stats in stages.items()])
+    yield ("phi_admission_admitted_total", "counter", "Requests admitted per stage.",
+           [({"stage": name}, stats["admitted"]) for name, stats in stages.items()])
+    yield ("phi_admission_rejected_total", "counter", "Requests shed with 503 per stage.",
+           [({"stage": name, "reason": reason}, stats[f"rejected_{reason}"])
+            for name, stats in stages.items() for reason in ("queue_full", "queue_timeout")])
+    yield ("phi_admission_wait_seconds", "gauge", "Recent queue wait percentiles per stage.",
+           [({"stage": name, "quantile": q}, stats[f"wait_{key}_ms"] / 1000)
+            for name, stats in stages.items() for q, key in (("0.5", "p50"), ("0.95", "p95"))])
+
+    limits = limiter_stats()
+    yield ("phi_rate_limiter_throttled_total", "counter", "Upstream calls delayed by the client-side rate limiter.",
+           [({"limiter": name}, stats["throttled"]) for name, stats in limits.items()])
+    yield ("phi_rate_limiter_throttled_seconds_total", "counter", "Total delay added by the client-side rate limiter.",
+           [({"limiter": name}, stats["throttled_seconds"]) for name, stats in limits.items()])
+    yield ("phi_rate_limiter_penalties_total", "counter", "Upstream 429 pauses applied by the rate limiter.",
+           [({"limiter": name}, stats["penalties"]) for name, stats in limits.items()])
+
+    files = audio_sweeper.stats()
+    yield ("phi_audio_files_pending", "gauge", "Temporary audio files registered for deletion.", [({}, files["pending"])])
+    yield ("phi_audio_output_files", "gauge", "Files in the audio output directory at the last sweep.", [({}, files["files"])])
+    yield ("phi_audio_output_bytes", "gauge", "Bytes in the audio output directory at the last sweep.", [({}, files["bytes_on_disk"])])
+    yield ("phi_audio_reclaimed_files_total", "counter", "Audio files deleted by the sweeper.", [({}, files["reclaimed_files"])])
+    yield ("phi_audio_reclaimed_bytes_total", "counter", "Bytes freed by the sweeper.", [({}, files["reclaimed_bytes"])])
+
+    yield ("phi_websocket_sessions", "gauge", "Open /ws/session connections.", [({}, VoiceSocket.active)])
+
+    hedging = brain.hedging_stats() if brain else None
+    if hedging:
+        yield ("phi_hedge_requests_total", "counter", "Hedged provider requests by outcome.", [
+            ({"outcome": "requests"}, hedging["requests"]),
+            ({"outcome": "hedged"}, hedging["hedged"]),
+            ({"outcome": "secondary_win"}, hedging["secondary_wins"]),
+            ({"outcome": "budget_skip"}, hedging["budget_skips"]),
+        ])
+        yield ("phi_hedge_delay_seconds", "gauge", "Current hedging delay.", [({}, hedging["current_delay"])])
+
+    if brain is not None:
+        routing = brain.model_router.stats()
+        models = routing["models"]
+        yield ("phi_model_latency_ewma_seconds", "gauge", "Rolling (EWMA) LLM latency per model used for routing.",
+               [({"model": model, "kind": kind}, stats[f"{kind}_ewma_seconds"])
+                for model, stats in models.items() for kind in ("ttft", "total")])
+        yield ("phi_model_error_rate_ewma", "gauge", "Rolling (EWMA) LLM error rate per model used for routing.",
+               [({"model": model}, stats["error_rate_ewma"]) for model, stats in models.items()])
+        yield ("phi_model_route_deep_extra_seconds", "gauge",
+               "Cumulative latency added by deep-model turns relative to the base model's rolling latency.",
+               [({}, routing["deep_extra_seconds"])])
+
+metrics.register_collector(_component_metrics)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式指標（各階段延遲直方圖與上游計數）"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/verify-keys")
 async def verify_keys():
     """
@@ -447,205 +602,151 @@ async def verify_keys():
         }
     }
 
-def _clean_text(text: str) -> str:
-    """清理用于 UI 显示的文本 (徹底過濾所有語音控制標籤與英語字母)"""
-    # 1. 移除所有 [...] 形式的標籤（State, 語音動作等）
-    text = re.sub(r'\[.*?\]', '', text)
-    
-    # 2. 移除所有 <...> 形式的標籤 (Emotion 等)
-    text = re.sub(r'<.*?>', '', text)
-    
-    # 3. 移除所有 SoVITS 殘留標籤 (如 [speed=...])
-    text = re.sub(r'\[\w+=[\w.]+\]', '', text)
-    
-    # 4. 移除 *笑聲* 等描述性文本
-    text = re.sub(r'\*[^\*]+\*', '', text)
-    
-    # 5. 強制淨化：移除所有英文字母 (a-zA-Z)
-    # 這是為了防止 LLM 洩漏 Inserted emote, itched to be 等技術描述
-    text = re.sub(r'[a-zA-Z]+', '', text)
-    
-    # 6. 移除所有表情符號 (Emoji)
-    text = re.sub(r'[^\u0000-\uFFFF]', '', text)
-    
-    return text.strip()
+# 句子結束符（流式子句切分）
+_SENTENCE_ENDING_CHARS = set("。！？.!?")
+_BRACKET_PAIRS = {"(": ")", "（": "）", "[": "]", "【": "】", "{": "}", "<": ">"}
 
-def _extract_emotion_from_brackets(text: str) -> dict:
+def _split_clauses(buffer: str) -> tuple[list, str]:
     """
-    从括号内容中提取情绪信息，转化为 Cartesia 情绪参数
-    
-    例如：(咬着下唇，声音娇媚地问) -> {"positivity": "high", "curiosity": "high"}
+    流式子句切分：從累積的 token 緩衝中切出完整子句
+
+    只在括號/標籤之外切分
+    （避免把 [speed=1.15]、(動作。) 之類的內容切斷），連續的結束符（如「...」「！？」）歸入同一子句。
+    返回: (完整子句列表, 尚未完成的剩餘文本)
     """
-    emotion_map = {
-        # 关键词 -> (positivity, curiosity, stability)
-        "娇媚": ("high", "high", "medium"),
-        "诱惑": ("high", "high", "medium"),
-        "挑逗": ("high", "high", "low"),
-        "害羞": ("medium", "medium", "low"),
-        "脸红": ("medium", "medium", "low"),
-        "紧张": ("medium", "medium", "low"),
-        "兴奋": ("high", "high", "low"),
-        "激动": ("high", "high", "low"),
-        "渴望": ("high", "high", "low"),
-        "喘息": ("high", "medium", "low"),
-        "娇嗔": ("high", "medium", "low"),
-        "呻吟": ("high", "low", "low"),
-        "咬着": ("high", "medium", "low"),
-        "舔": ("high", "medium", "low"),
-        "揉": ("high", "medium", "low"),
-        "吮": ("high", "medium", "low"),
-    }
-    
-    # 提取所有括号内容
-    bracket_pattern = r'\(([^)]+)\)|（([^）]+)）'
-    matches = re.findall(bracket_pattern, text)
-    
-    emotion_params = {}
-    for match in matches:
-        bracket_content = match[0] or match[1]  # 处理中英文括号
-        for keyword, (pos, cur, sta) in emotion_map.items():
-            if keyword in bracket_content:
-                emotion_params["positivity"] = pos
-                emotion_params["curiosity"] = cur
-                emotion_params["stability"] = sta
-                logger.info(f"Extracted emotion from bracket '{bracket_content}': {emotion_params}")
+    clauses = []
+    expected_closers = []
+    start = 0
+    i = 0
+    length = len(buffer)
+    while i < length:
+        ch = buffer[i]
+        if ch in _BRACKET_PAIRS:
+            expected_closers.append(_BRACKET_PAIRS[ch])
+        elif expected_closers and ch == expected_closers[-1]:
+            expected_closers.pop()
+        elif not expected_closers and ch in _SENTENCE_ENDING_CHARS:
+            # 吞掉連續的結束符；若已到緩衝末尾，可能還有後續結束符，暫不切分
+            j = i + 1
+            while j < length and buffer[j] in _SENTENCE_ENDING_CHARS:
+                j += 1
+            if j == length:
                 break
-    
-    return emotion_params
+            clause = buffer[start:j].strip()
+            if clause:
+                clauses.append(clause)
+            start = j
+            i = j
+            continue
+        i += 1
+    return clauses, buffer[start:]
+
+def _tts_cache_key(speech_text: str, voice_settings: dict) -> str:
+    """TTS 快取鍵：由文本、音色、模型、語音參數與輸出格式共同決定"""
+    return TTSCache.make_key(speech_text, VOICE_ID, MODEL_ID, voice_settings, TTS_OUTPUT_FORMAT)
+
+def _tts_stream(speech_text: str, voice_settings: dict, optimize_streaming_latency: Optional[str] = None):
+    """
+    經由 TTS 快取取得 ElevenLabs 音訊流（異步迭代器）
+    命中時直接從磁盤讀取；未命中時請求 ElevenLabs 並在傳輸途中寫入快取。
+    """
+    def open_stream():
+        if tts_client is None:
+            raise ValueError("ELEVENLABS_API_KEY is missing or the shared TTS client is not initialized")
+
+        extra = {}
+        if optimize_streaming_latency is not None:
+            extra["optimize_streaming_latency"] = optimize_streaming_latency
+        # 共享的 AsyncElevenLabs 客戶端：復用連接池中的 keep-alive 連接，經由共享限流器與退避重試
+        return tts_client.convert(
+            voice_id=VOICE_ID,
+            output_format=TTS_OUTPUT_FORMAT,
+            text=speech_text,
+            model_id=MODEL_ID,
+            voice_settings=voice_settings,
+            **extra
+        )
+
+    return tts_cache.stream(_tts_cache_key(speech_text, voice_settings), open_stream)
+
+async def _tts_bytes(speech_text: str, voice_settings: dict, optimize_streaming_latency: Optional[str] = None) -> bytes:
+    """經由 TTS 快取取得完整音訊數據"""
+    return b"".join([chunk async for chunk in _tts_stream(speech_text, voice_settings, optimize_streaming_latency)])
+
+def _tts_http_error(tts_error: Exception) -> HTTPException:
+    """將 ElevenLabs 調用失敗轉換為對應狀態碼的 HTTPException"""
+    error_msg = str(tts_error)
+    logger.error(f"ElevenLabs TTS API call failed: {error_msg}")
+    if "401" in error_msg or "unauthorized" in error_msg.lower():
+        return HTTPException(
+            status_code=401,
+            detail=f"ElevenLabs API 认证失败（401）：API Key 无效或已过期。错误: {error_msg}"
+        )
+    elif "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
+        return HTTPException(
+            status_code=429,
+            detail="ElevenLabs API 请求过于频繁（429）：已达到速率限制。请稍后再试或检查配额设置。"
+        )
+    return HTTPException(status_code=500, detail=f"ElevenLabs TTS 调用失败: {error_msg}")
 
-def _clean_for_speech(text: str) -> tuple[str, dict]:
+async def _tts_response(speech_text: str, voice_settings: dict, headers: Optional[Dict[str, str]] = None) -> Response:
     """
-    針對 TTS 引擎的深度清理（靈魂淨化版）
-    返回: (清理后的文本, 从括号中提取的情绪参数字典)
+    以音訊流回傳合成結果（不在記憶體中拼接整段音訊）
+    快取命中時直接回傳磁盤文件；否則先取得第一個分塊，使上游錯誤仍能以正確狀態碼回傳，再邊合成邊傳輸。
     """
-    # 0. 先提取括号中的情绪信息（在移除括号前）
-    emotion_from_brackets = _extract_emotion_from_brackets(text)
-    
-    # 1. 徹底移除 [STATE:n]
-    text = re.sub(r'\[STATE:\d\]', '', text)
-    
-    # 2. 移除所有 <...> 形式的標籤，除了 <emotion /> (我們後面會處理)
-    # 但為了防止洩漏，我們乾脆先移除所有尖括號內容，保留對話
-    # 注意：<emotion> 標籤我們會在 /chat 邏輯中單獨提取，這裡主要是清理剩餘雜訊
-    
-    # 3. 移除所有語音標籤（ElevenLabs 不支持 Cartesia 標籤，會直接讀出英文單詞）
-    # 白名單標籤列表（僅供參考，實際會被移除）
-    whitelist_tags = [
-        "laughter", "sigh", "chuckle", "gasp", "uh-huh", "hmm",
-        "wink", "giggle", "moan", "squeal"
-    ]
-    
-    # 直接移除所有 Cartesia 語音標籤（ElevenLabs 不支持）
-    for tag in whitelist_tags:
-        text = re.sub(rf'\[{re.escape(tag)}\]', ' ', text, flags=re.IGNORECASE)
-
-    # 4. 移除所有括號內容 (包含內部可能的亂碼) - 不再直接讀出來，而是轉化為情緒參數
-    # 使用循環處理嵌套括號，確保徹底清除
-    prev_text = ""
-    while prev_text != text:
-        prev_text = text
-        text = re.sub(r'\(.*?\)|（.*?）|\[.*?\]|【.*?】|\{.*?\}', ' ', text)
-    
-    # 5. 強制英語淨化 (Fail-safe)：移除所有剩餘的英文字母
-    # ElevenLabs 不支持英文標籤，必須完全移除
-    text = re.sub(r'[a-zA-Z]+', '', text)
-    
-    # 6. 標點符號正規化
-    text = re.sub(r'\.{3,}', '...', text)
-    text = re.sub(r'(!|\?|。|！|？)\1+', r'\1', text)
-    
-    # 7. 最終清理：移除所有尖括號殘留、表情符號 (Emoji) 與多餘空格
-    text = re.sub(r'<[^>]*>', '', text)
-    text = re.sub(r'[^\u0000-\uFFFF]', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    return (text if text else "。", emotion_from_brackets)
+    cached_path = tts_cache.lookup(_tts_cache_key(speech_text, voice_settings), record_hit=True)
+    if cached_path:
+        return FileResponse(cached_path, media_type="audio/mpeg", headers=headers)
 
-def _clause_buffer(text: str) -> str:
+    # 傳輸期間佔用一個 TTS 名額
+    stream = admission.tts.hold(_tts_stream(speech_text, voice_settings, optimize_streaming_latency="2"))
+    try:
+        first_chunk = await stream.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except HTTPException:
+        raise
+    except Exception as tts_error:
+        raise _tts_http_error(tts_error)
+
+    async def body():
+        try:
+            if first_chunk:
+                yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    return StreamingResponse(body(), media_type="audio/mpeg", headers=headers)
+
+def _phi_voice_settings(arousal_level: ArousalLevel, emotion_from_brackets: dict) -> dict:
     """
-    子句缓冲机制 (Clause Buffering)
-    确保文本是完整的句子，避免破碎的字节流导致循环崩溃
-    
-    注意：此函数会临时保留标签以便句子分割，但标签会在后续的 _clean_for_speech 
-    函数中被移除（因为 ElevenLabs 不支持这些标签）。
+    /api/v1/phi_voice 系列接口的興奮度 -> ElevenLabs 參數映射
+    ElevenLabs 不支持 [STATE], [speed] 等標籤，我們通過 stability/similarity_boost 控制
     """
-    # re 模块已在文件顶部导入，无需重复导入
-    
-    # Cartesia 支持的标签白名单（这些标签不应该被移除）
-    cartesia_tags_whitelist = [
-        r'\[laughter\]', r'\[sigh\]', r'\[chuckle\]', r'\[gasp\]',
-        r'\[uh-huh\]', r'\[hmm\]', r'\[wink\]', r'\[giggle\]',
-        r'\[moan\]', r'\[squeal\]'
-    ]
-    
-    # 临时保护 Cartesia 标签：用占位符替换
-    tag_map = {}
-    protected_text = text
-    for idx, pattern in enumerate(cartesia_tags_whitelist):
-        # 查找所有匹配的标签
-        matches = list(re.finditer(pattern, protected_text, re.IGNORECASE))
-        # 从后往前替换，避免位置偏移
-        for match in reversed(matches):
-            placeholder = f"__CARTESIA_TAG_{idx}_{match.start()}__"
-            tag_map[placeholder] = match.group(0)  # 存储原始标签
-            protected_text = protected_text[:match.start()] + placeholder + protected_text[match.end():]
+    # 參數映射邏輯：
+    # - Stability: 越低越不穩定，情緒越激動 (Range 0.0 - 1.0)
+    # - Similarity: 越高越像原聲，越低可能有更多變化 (Range 0.0 - 1.0)
+    # - Style: 誇張程度 (Range 0.0 - 1.0)
     
-    # 移除其他标签（STATE 标签、SoVITS 标签等），但保留 Cartesia 标签
-    # 移除 STATE 标签和 SoVITS 标签
-    clean_text = re.sub(r'\[STATE\s*:\s*\d+\]', '', protected_text, flags=re.IGNORECASE)
-    clean_text = re.sub(r'\[speed=[\w.]+\]', '', clean_text)
-    clean_text = re.sub(r'\[pitch=[\w.]+\]', '', clean_text)
-    clean_text = re.sub(r'\[emotion=[\w.]+\]', '', clean_text)
-    clean_text = re.sub(r'<emotion[^>]*>', '', clean_text)
-    clean_text = re.sub(r'<[^>]+>', '', clean_text)  # 移除其他 XML 标签
-    
-    # 按句子分割（句号、问号、感叹号）
-    sentence_endings = r'[。！？.!?]'
-    sentences = re.split(f'({sentence_endings})', clean_text)
-    
-    # 重新组合句子（保留分隔符）
-    complete_sentences = []
-    for i in range(0, len(sentences) - 1, 2):
-        if i + 1 < len(sentences):
-            sentence = sentences[i] + sentences[i + 1]
-            if sentence.strip():
-                complete_sentences.append(sentence.strip())
-    
-    # 恢复 Cartesia 标签的辅助函数
-    def restore_tags(text_with_placeholders):
-        result = text_with_placeholders
-        for placeholder, original_tag in tag_map.items():
-            result = result.replace(placeholder, original_tag)
-        return result
-    
-    # 如果没有句子分隔符，恢复标签后返回原始文本
-    if not complete_sentences:
-        return restore_tags(protected_text).strip()
-    
-    # 确保最后一个句子完整（如果不是以句子结束符结尾，保留原文本）
-    last_sentence = sentences[-1].strip() if sentences else ""
-    if last_sentence and not re.search(sentence_endings, last_sentence):
-        # 如果最后一段不是完整句子，恢复标签后返回原文本
-        return restore_tags(protected_text).strip()
+    eleven_params = {
+        ArousalLevel.CALM: {"stability": 0.8, "similarity_boost": 0.75, "style": 0.0},
+        ArousalLevel.NORMAL: {"stability": 0.5, "similarity_boost": 0.75, "style": 0.0},
+        ArousalLevel.EXCITED: {"stability": 0.4, "similarity_boost": 0.6, "style": 0.3},
+        ArousalLevel.INTENSE: {"stability": 0.3, "similarity_boost": 0.5, "style": 0.6},
+        ArousalLevel.PEAK: {"stability": 0.25, "similarity_boost": 0.4, "style": 0.8} # 極度激動
+    }
     
-    # 文本完整，恢复标签并返回
-    return restore_tags(protected_text).strip()
-
-def _pre_process_tags(text: str) -> str:
-    """標籤預處理：根據生理邏輯自動修正錯誤描述"""
-    # 1. 物理常識校正：小豆豆不可被「插/幹/捅」
-    # 匹配對「小豆豆/陰核」進行插入類動作的描述
-    impossibilities = ["幹小豆豆", "插小豆豆", "捅小豆豆", "幹陰核", "插陰核", "捅陰核"]
-    for err in impossibilities:
-        if err in text:
-            fix = err.replace("幹", "瘋狂舔弄").replace("插", "高速撥弄").replace("捅", "用力吮吸")
-            text = text.replace(err, fix)
-            logger.info(f"Physiological Correction Applied: {err} -> {fix}")
+    current_config = eleven_params.get(arousal_level, eleven_params[ArousalLevel.NORMAL])
     
-    # 2. 自動補全情緒標籤 - ElevenLabs 更依賴語義，但我們仍可以補全以供參考
-    # (如果未來需要，可以在這裡加入提示詞修改)
-        
-    return text
+    # 如果括號內有明確情緒，進一步微調 (簡單邏輯：如果有情緒提取，增加 style，降低 stability)
+    if emotion_from_brackets:
+        current_config["stability"] = max(0.1, current_config["stability"] - 0.1)
+        current_config["style"] = min(1.0, current_config["style"] + 0.2)
+        logger.info(f"Adjusted ElevenLabs params due to emotional brackets: {current_config}")
+
+    return current_config
 
 @app.post("/api/v1/phi_voice")
 async def phi_voice_proxy(request: PhiVoiceRequest):
@@ -655,79 +756,341 @@ async def phi_voice_proxy(request: PhiVoiceRequest):
     """
     if not brain:
         raise HTTPException(status_code=500, detail="PhiBrain is not initialized.")
+    admission.check()
 
     try:
         # 1. 獲取 LLM 回覆 (使用 session_id 支持多會話)
         # generate_response(user_message, context, include_tags, session_id)
-        ai_response_text, metadata = brain.generate_response(
-            request.user_input, 
-            session_id=request.session_id
-        )
-
-        # 2. 子句缓冲验证（确保文本完整）
-        buffered_text = _clause_buffer(ai_response_text)
-        
-        # 3. 標籤預處理 (物理校正與標籤自動注入)
-        processed_text = _pre_process_tags(buffered_text)
+        async with admission.llm.admit():
+            ai_response_text, metadata = await brain.agenerate_response(
+                request.user_input, 
+                session_id=request.session_id
+            )
 
-        # 4. 提取情緒標籤
-        cartesia_emotion = None
-        emotion_match = re.search(r'<emotion\s+value=["\']([^"\']+)["\']\s*/>', processed_text)
-        if emotion_match:
-            cartesia_emotion = emotion_match.group(1)
+        # 2. 標籤預處理 (物理校正)
+        with TEXT_PROCESSING.time(step="correct_physiology"):
+            processed_text = correct_physiology(ai_response_text)
 
-        # 5. 語音化清理（返回文本和从括号提取的情绪参数）
-        speech_text, emotion_from_brackets = _clean_for_speech(processed_text)
+        # 3. 語音化清理（返回文本和从括号提取的情绪参数）
+        with TEXT_PROCESSING.time(step="clean_for_speech"):
+            speech_text, emotion_from_brackets = clean_for_speech(processed_text)
 
-        # 6. 获興奮度並映射到 ElevenLabs 參數
-        # ElevenLabs 不支持 [STATE], [speed] 等標籤，我們通過 stability/similarity_boost 控制
-        
-        # 參數映射邏輯：
-        # - Stability: 越低越不穩定，情緒越激動 (Range 0.0 - 1.0)
-        # - Similarity: 越高越像原聲，越低可能有更多變化 (Range 0.0 - 1.0)
-        # - Style: 誇張程度 (Range 0.0 - 1.0)
-        
-        eleven_params = {
-            ArousalLevel.CALM: {"stability": 0.8, "similarity_boost": 0.75, "style": 0.0},
-            ArousalLevel.NORMAL: {"stability": 0.5, "similarity_boost": 0.75, "style": 0.0},
-            ArousalLevel.EXCITED: {"stability": 0.4, "similarity_boost": 0.6, "style": 0.3},
-            ArousalLevel.INTENSE: {"stability": 0.3, "similarity_boost": 0.5, "style": 0.6},
-            ArousalLevel.PEAK: {"stability": 0.25, "similarity_boost": 0.4, "style": 0.8} # 極度激動
-        }
-        
-        current_config = eleven_params.get(brain.arousal_level, eleven_params[ArousalLevel.NORMAL])
-        
-        # 如果括號內有明確情緒，進一步微調 (簡單邏輯：如果有情緒提取，增加 style，降低 stability)
-        if emotion_from_brackets:
-            current_config["stability"] = max(0.1, current_config["stability"] - 0.1)
-            current_config["style"] = min(1.0, current_config["style"] + 0.2)
-            logger.info(f"Adjusted ElevenLabs params due to emotional brackets: {current_config}")
+        # 4. 获興奮度並映射到 ElevenLabs 參數
+        session = await brain.aget_session(request.session_id)
+        current_config = _phi_voice_settings(session.arousal_level, emotion_from_brackets)
 
-        # 7. 調用 ElevenLabs API
-        from elevenlabs.client import ElevenLabs
-        
+        # 5. 調用 ElevenLabs API（快取命中時直接回傳磁盤文件）
         if not ELEVENLABS_API_KEY:
              raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY is missing!")
-             
-        client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        
+
         logger.info(f"Generating ElevenLabs audio. Text: {speech_text[:20]}... | Params: {current_config}")
         
-        audio_stream = client.text_to_speech.convert(
-            voice_id=VOICE_ID,
-            optimize_streaming_latency="2", # 1-4, 4 is max latency but best quality. 2 is balanced.
-            output_format="mp3_44100_128",
-            text=speech_text,
-            model_id=MODEL_ID,
-            voice_settings=current_config
-        )
-
-        return StreamingResponse(audio_stream, media_type="audio/mpeg")
+        # 快取命中時直接回傳磁盤文件；否則邊合成邊串流 (optimize_streaming_latency=2 兼顧延遲與音質)
+        return await _tts_response(speech_text, current_config)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"API Proxy Error: {str(e)}", exc_info=True)
         return Response(content=json.dumps({"error": str(e)}), status_code=500, media_type="application/json")
 
+# 流式接口每個請求同時進行中的 TTS 子句數（第一句之後的子句在背景預先合成）
+STREAM_TTS_CONCURRENCY = int(os.getenv("PHI_STREAM_TTS_CONCURRENCY", "3"))
+
+def _prepare_clause_for_speech(clause: str) -> tuple[str, dict]:
+    """對單個完整子句執行與整段回覆相同的語音化處理"""
+    with TEXT_PROCESSING.time(step="clause"):
+        return clean_for_speech(correct_physiology(refine_logic(clause)))
+
+@app.post("/api/v1/phi_voice/stream")
+async def phi_voice_stream(request: PhiVoiceRequest):
+    """
+    句子級流水線接口 (LLM -> TTS Pipelining)
+    邊接收 LLM token 邊切分完整子句，每個子句清理後立即送入 ElevenLabs，
+    音訊按子句順序串流回傳。只有第一個子句位於首音延遲的關鍵路徑上。
+    """
+    if not brain:
+        raise HTTPException(status_code=500, detail="PhiBrain is not initialized.")
+    if not ELEVENLABS_API_KEY:
+        raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY is missing!")
+    admission.check()
+
+    arousal_level = (await brain.aget_session(request.session_id)).arousal_level
+    tts_slots = asyncio.Semaphore(STREAM_TTS_CONCURRENCY)
+
+    async def synthesize(speech_text: str, settings: dict) -> bytes:
+        async with tts_slots, admission.tts.admit():
+            return await _tts_bytes(speech_text, settings, optimize_streaming_latency="2")
+
+    async def audio_chunks():
+        tts_queue: asyncio.Queue = asyncio.Queue()
+        pending = []
+
+        def schedule(clause: str):
+            speech_text, emotion_from_brackets = _prepare_clause_for_speech(clause)
+            if not has_speakable_text(speech_text):
+                return
+            settings = _phi_voice_settings(arousal_level, emotion_from_brackets)
+            logger.info(f"Streaming clause to ElevenLabs: {speech_text[:20]}...")
+            task = asyncio.create_task(synthesize(speech_text, settings))
+            pending.append(task)
+            tts_queue.put_nowait(task)
+
+        async def produce():
+            # 讀取 LLM 增量並切分子句，完成一句就立刻排入 TTS
+            try:
+                buffer = ""
+                async with admission.llm.admit():
+                    async for delta in brain.astream_response(request.user_input, session_id=request.session_id, yield_error=True):
+                        buffer += delta
+                        clauses, buffer = _split_clauses(buffer)
+                        for clause in clauses:
+                            schedule(clause)
+                if buffer.strip():
+                    schedule(buffer.strip())
+            finally:
+                tts_queue.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            # 按子句順序輸出音訊；後續子句在前面的音訊傳輸期間已並行合成
+            while True:
+                task = await tts_queue.get()
+                if task is None:
+                    break
+                yield await task
+            await producer
+        except Exception as e:
+            logger.error(f"Streaming Pipeline Error: {str(e)}", exc_info=True)
+        finally:
+            producer.cancel()
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(audio_chunks(), media_type="audio/mpeg")
+
+# ============================================
+# WebSocket 會話 (/ws/session/{session_id})
+# ============================================
+# 客戶端 -> 服務端（JSON 文本幀）:
+#   {"type": "message", "text": "..."}   開始新一輪（進行中的一輪會先被打斷）
+#   {"type": "interrupt"}                 打斷當前一輪
+#   {"type": "ping"}
+# 服務端 -> 客戶端:
+#   ready / turn_start / text（子句的顯示文字）/ state（興奮度變化）/
+#   audio_start、二進制音訊幀、audio_end（按子句順序）/ turn_end / interrupted / error / pong
+
+# 子句音訊流結束標記
+_AUDIO_END = object()
+
+class _ClauseAudio:
+    """單個子句的 TTS：後台任務把音訊分塊搬進隊列，前面的子句傳輸時後面的子句已在合成"""
+
+    def __init__(self, seq: int, speech_text: str, settings: dict, tts_slots: asyncio.Semaphore):
+        self.seq = seq
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._pump(speech_text, settings, tts_slots))
+
+    async def _pump(self, speech_text: str, settings: dict, tts_slots: asyncio.Semaphore):
+        try:
+            async with tts_slots, admission.tts.admit():
+                async for chunk in _tts_stream(speech_text, settings, optimize_streaming_latency="2"):
+                    self.queue.put_nowait(chunk)
+            self.queue.put_nowait(_AUDIO_END)
+        except Exception as e:
+            self.queue.put_nowait(e)
+
+class VoiceSocket:
+    """單個 WebSocket 連接：長連接上逐輪接收用戶消息，推送文字、狀態變化與音訊分塊，支持打斷"""
+
+    active = 0
+
+    def __init__(self, websocket: WebSocket, session_id: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.turn = 0
+        self.current: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+
+    async def send_json(self, payload: dict):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(payload, ensure_ascii=False))
+
+    async def send_bytes(self, data: bytes):
+        async with self._send_lock:
+            await self.websocket.send_bytes(data)
+
+    async def run(self):
+        session = await brain.aget_session(self.session_id)
+        await self.send_json({"type": "ready", "session_id": self.session_id, "arousal": session.arousal_level.name})
+        while True:
+            try:
+                message = json.loads(await self.websocket.receive_text())
+            except (json.JSONDecodeError, TypeError, KeyError):
+                # KeyError: 收到二進制幀
+                await self.send_json({"type": "error", "status": 400, "detail": "消息必須是 JSON 對象"})
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+
+            if kind == "message":
+                text = str(message.get("text") or "").strip()
+                if not text:
+                    await self.send_json({"type": "error", "status": 400, "detail": "text 不能為空"})
+                    continue
+                await self.interrupt()
+                self.turn += 1
+                self.current = asyncio.create_task(self._run_turn(self.turn, text))
+            elif kind == "interrupt":
+                await self.interrupt()
+            elif kind == "ping":
+                await self.send_json({"type": "pong"})
+            else:
+                await self.send_json({"type": "error", "status": 400, "detail": f"未知的消息類型: {kind}"})
+
+    async def interrupt(self) -> bool:
+        """取消進行中的一輪（LLM 流與未完成的 TTS 一併取消，本輪不寫入會話歷史）"""
+        task, self.current = self.current, None
+        if task is None or task.done():
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        logger.info(f"🛑 WebSocket turn {self.turn} interrupted (session: {self.session_id})")
+        try:
+            await self.send_json({"type": "interrupted", "turn": self.turn})
+        except Exception:
+            pass
+        return True
+
+    async def _run_turn(self, turn: int, text: str):
+        try:
+            admission.check()
+            await self._stream_turn(turn, text)
+        except HTTPException as e:
+            await self.send_json({
+                "type": "error", "turn": turn, "status": e.status_code, "detail": e.detail,
+                "retry_after": (e.headers or {}).get("Retry-After")
+            })
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"WebSocket turn error: {str(e)}", exc_info=True)
+            try:
+                await self.send_json({"type": "error", "turn": turn, "status": 500, "detail": str(e)})
+            except Exception:
+                pass
+
+    async def _stream_turn(self, turn: int, text: str):
+        session = await brain.aget_session(self.session_id)
+        tts_slots = asyncio.Semaphore(STREAM_TTS_CONCURRENCY)
+        audio_queue: asyncio.Queue = asyncio.Queue()
+        clauses_audio: List[_ClauseAudio] = []
+
+        async def schedule(clause: str):
+            # 子句的 STATE 標籤即時生效，後續子句使用新的興奮度合成
+            rendered = render_reply(clause)
+            if rendered.state_level is not None and rendered.state_level != session.arousal_level.value:
+                await brain.aset_arousal_level(ArousalLevel(rendered.state_level), session_id=self.session_id)
+                logger.info(f"Autonomous State Switch: {session.arousal_level.name}")
+                await self.send_json({"type": "state", "turn": turn, "arousal": session.arousal_level.name})
+            if rendered.display_text:
+                await self.send_json({"type": "text", "turn": turn, "delta": rendered.display_text})
+
+            speech_text, emotion_from_brackets = _prepare_clause_for_speech(rendered.text)
+            if not has_speakable_text(speech_text):
+                return
+            settings = _phi_voice_settings(session.arousal_level, emotion_from_brackets)
+            job = _ClauseAudio(len(clauses_audio), speech_text, settings, tts_slots)
+            clauses_audio.append(job)
+            audio_queue.put_nowait(job)
+
+        async def send_audio():
+            # 按子句順序推送音訊：audio_start -> 二進制幀 -> audio_end
+            while True:
+                job = await audio_queue.get()
+                if job is None:
+                    return
+                await self.send_json({"type": "audio_start", "turn": turn, "seq": job.seq, "format": "mp3"})
+                while True:
+                    item = await job.queue.get()
+                    if item is _AUDIO_END:
+                        break
+                    if isinstance(item, Exception):
+                        error = _tts_http_error(item)
+                        await self.send_json({"type": "error", "turn": turn, "seq": job.seq, "status": error.status_code, "detail": error.detail})
+                        break
+                    await self.send_bytes(item)
+                await self.send_json({"type": "audio_end", "turn": turn, "seq": job.seq})
+
+        await self.send_json({"type": "turn_start", "turn": turn})
+        sender = asyncio.create_task(send_audio())
+        try:
+            stream = brain.astream_response(text, session_id=self.session_id, yield_error=True)
+            buffer = ""
+            async with admission.llm.admit():
+                async for delta in stream:
+                    buffer += delta
+                    clauses, buffer = _split_clauses(buffer)
+                    for clause in clauses:
+                        await schedule(clause)
+            if buffer.strip():
+                await schedule(buffer.strip())
+            audio_queue.put_nowait(None)
+            await sender
+
+            rendered = render_reply(stream.reply or "")
+            await self.send_json({
+                "type": "turn_end",
+                "turn": turn,
+                "text": rendered.display_text,
+                "raw_text": stream.reply,
+                "arousal": session.arousal_level.name,
+                "model": (stream.metadata or {}).get("model_used")
+            })
+        finally:
+            sender.cancel()
+            for job in clauses_audio:
+                job.task.cancel()
+
+@app.websocket("/ws/session/{session_id}")
+async def session_socket(websocket: WebSocket, session_id: str):
+    """長連接會話：一次握手，多輪對話；文字與音訊在就緒時即推送，新消息或 interrupt 可打斷當前一輪"""
+    await websocket.accept()
+    if not brain:
+        await websocket.send_text(json.dumps({"type": "error", "status": 500, "detail": "PhiBrain is not initialized."}))
+        await websocket.close(code=1011)
+        return
+
+    connection = VoiceSocket(websocket, session_id)
+    VoiceSocket.active += 1
+    try:
+        await connection.run()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        VoiceSocket.active -= 1
+        await connection.interrupt()
+
+def _chat_voice_settings(arousal_level: ArousalLevel, emotion_from_brackets: dict) -> dict:
+    """/chat 與 /chat/stream 的 ElevenLabs 參數：依興奮度映射，括號內有明確情緒時進一步微調"""
+    eleven_params = {
+        ArousalLevel.CALM: {"stability": 0.85, "similarity_boost": 0.8, "style": 0.0},
+        ArousalLevel.NORMAL: {"stability": 0.7, "similarity_boost": 0.8, "style": 0.0},
+        ArousalLevel.EXCITED: {"stability": 0.5, "similarity_boost": 0.7, "style": 0.25},
+        ArousalLevel.INTENSE: {"stability": 0.4, "similarity_boost": 0.6, "style": 0.5},
+        ArousalLevel.PEAK: {"stability": 0.3, "similarity_boost": 0.5, "style": 0.8}
+    }
+
+    current_config = eleven_params.get(arousal_level, eleven_params[ArousalLevel.NORMAL])
+
+    if emotion_from_brackets:
+        current_config["stability"] = max(0.1, current_config["stability"] - 0.1)
+        current_config["style"] = min(1.0, current_config["style"] + 0.15)
+        logger.info(f"Adjusted ElevenLabs params due to emotional brackets: {current_config}")
+    return current_config
+
 @app.post("/chat")
 async def unified_chat(request: TTSRequest):
     if not brain:
@@ -744,6 +1107,7 @@ async def unified_chat(request: TTSRequest):
         
         logger.error(f"Chat request failed: {error_detail}")
         raise HTTPException(status_code=500, detail=error_detail)
+    admission.check()
 
     try:
         # 1. 大脑思考
@@ -752,7 +1116,8 @@ async def unified_chat(request: TTSRequest):
         
         # generate_response 返回 (reply_text, metadata)
         try:
-            ai_response_text, metadata = brain.generate_response(request.text)
+            async with admission.llm.admit():
+                ai_response_text, metadata = await brain.agenerate_response(request.text, session_id=request.session_id)
         except ValueError as brain_error:
             # 检查是否是 429 错误
             error_str = str(brain_error)
@@ -766,45 +1131,35 @@ async def unified_chat(request: TTSRequest):
                 # 其他错误，继续抛出
                 raise
         
+        session = await brain.aget_session(request.session_id)
+
         # 确保 ai_response_text 是字符串
         if not isinstance(ai_response_text, str):
             ai_response_text = str(ai_response_text)
             
+        # 2. 文本處理：一次得到 STATE、UI 文字、語音文字、<emotion> 與括號情緒
+        with TEXT_PROCESSING.time(step="render_reply"):
+            rendered = render_reply(ai_response_text)
+        ai_response_text = rendered.text
+
         # --- 自主情感解析 ---
-        state_match = re.search(r'\[STATE\s*:\s*(\d+)\]', ai_response_text, re.IGNORECASE)
-        if state_match:
-            new_level_val = int(state_match.group(1))
-            # 限制在 0-4 之间
-            new_level_val = max(0, min(4, new_level_val))
-            brain.arousal_level = ArousalLevel(new_level_val)
-            # 从文本中移除 STATE 标签 (不分大小寫與空格)
-            ai_response_text = re.sub(r'\[STATE\s*:\s*\d+\]', '', ai_response_text, flags=re.IGNORECASE).strip()
-            logger.info(f"Autonomous State Switch: {brain.arousal_level.name}")
+        if rendered.state_level is not None:
+            await brain.aset_arousal_level(ArousalLevel(rendered.state_level), session_id=request.session_id)
+            logger.info(f"Autonomous State Switch: {session.arousal_level.name}")
         # ------------------
-            
-        # 2. 語音化處理
-        display_text = _clean_text(ai_response_text)
-        
-        # --- 情感標籤提前提取 ---
-        # 必須在 clean_for_speech 之前提取，因為後者會淨化掉 <>
-        cartesia_emotion = None
-        emotion_match = re.search(r'<emotion\s+value=["\']([^"\']+)["\']\s*/>', ai_response_text)
-        if emotion_match:
-            cartesia_emotion = emotion_match.group(1)
+
+        display_text = rendered.display_text
+        cartesia_emotion = rendered.emotion
+        if cartesia_emotion:
             logger.info(f"Detected Emotion for API: {cartesia_emotion}")
-        
-        # 執行子句缓冲验证
-        buffered_text = _clause_buffer(ai_response_text)
-        
-        # 執行深度清理（返回文本和从括号提取的情绪参数）
-        speech_text, emotion_from_brackets = _clean_for_speech(buffered_text)
+        speech_text, emotion_from_brackets = rendered.speech_text, rendered.bracket_emotion
         
         # --- 興奮度參數映射 (Speed/Pitch/Emotion) ---
         # 獲取當前大腦賦予的穩定標籤
-        sovits_params = brain.sovits_tags.get(brain.arousal_level, brain.sovits_tags[ArousalLevel.NORMAL])
+        sovits_params = brain.sovits_tags.get(session.arousal_level, brain.sovits_tags[ArousalLevel.NORMAL])
         
         # 🎭 动态语速控制：PEAK 状态时降低语速，模拟欲言又止、气喘吁吁的感觉
-        if brain.arousal_level == ArousalLevel.PEAK:
+        if session.arousal_level == ArousalLevel.PEAK:
             # PEAK 状态：语速降低到 0.9，模拟气喘吁吁
             target_speed = 0.9
             logger.info(f"PEAK state detected: Speed reduced to 0.9 for breathless effect")
@@ -821,70 +1176,43 @@ async def unified_chat(request: TTSRequest):
         logger.info(f"AI Thinking Done. UI: {display_text} | Speech: {speech_text}")
 
         # ElevenLabs Integration
-        from elevenlabs.client import ElevenLabs
-        
         # 验证 API Key
         if not ELEVENLABS_API_KEY:
             raise HTTPException(status_code=500, detail="ELEVENLABS_API_KEY is missing. Please check environment variables.")
         
-        logger.info(f"Initializing ElevenLabs client...")
-        
-        try:
-            client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        except Exception as eleven_init_error:
-            error_msg = str(eleven_init_error)
-            logger.error(f"ElevenLabs client initialization failed: {error_msg}")
-            raise HTTPException(status_code=500, detail=f"ElevenLabs 初始化失败: {error_msg}")
-        
-        # 映射 ArousalLevel 到 ElevenLabs 参数
-        eleven_params = {
-            ArousalLevel.CALM: {"stability": 0.85, "similarity_boost": 0.8, "style": 0.0},
-            ArousalLevel.NORMAL: {"stability": 0.7, "similarity_boost": 0.8, "style": 0.0},
-            ArousalLevel.EXCITED: {"stability": 0.5, "similarity_boost": 0.7, "style": 0.25},
-            ArousalLevel.INTENSE: {"stability": 0.4, "similarity_boost": 0.6, "style": 0.5},
-            ArousalLevel.PEAK: {"stability": 0.3, "similarity_boost": 0.5, "style": 0.8}
-        }
-        
-        current_config = eleven_params.get(brain.arousal_level, eleven_params[ArousalLevel.NORMAL])
-        
-        # 如果括号内有明确情绪，进一步微调
-        if emotion_from_brackets:
-            current_config["stability"] = max(0.1, current_config["stability"] - 0.1)
-            current_config["style"] = min(1.0, current_config["style"] + 0.15)
-            logger.info(f"Adjusted ElevenLabs params due to emotional brackets: {current_config}")
-
-        # 流式传输优化：直接返回音讯流
-        try:
-            audio_stream = client.text_to_speech.convert(
-                voice_id=VOICE_ID,
-                optimize_streaming_latency="2",
-                output_format="mp3_44100_128",
-                text=speech_text,
-                model_id=MODEL_ID,
-                voice_settings=current_config
-            )
-        except Exception as tts_error:
-            error_msg = str(tts_error)
-            logger.error(f"ElevenLabs TTS API call failed: {error_msg}")
-            if "401" in error_msg or "unauthorized" in error_msg.lower():
-                raise HTTPException(
-                    status_code=401,
-                    detail=f"ElevenLabs API 认证失败（401）：API Key 无效或已过期。错误: {error_msg}"
-                )
-            elif "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                raise HTTPException(
-                    status_code=429,
-                    detail="ElevenLabs API 请求过于频繁（429）：已达到速率限制。请稍后再试或检查配额设置。"
-                )
-            else:
-                raise HTTPException(status_code=500, detail=f"ElevenLabs TTS 调用失败: {error_msg}")
+        # 映射 ArousalLevel 到 ElevenLabs 参数（括号内有明确情绪时进一步微调）
+        current_config = _chat_voice_settings(session.arousal_level, emotion_from_brackets)
+
+        if request.audio_delivery == "url":
+            # 只回傳短期音訊連結，瀏覽器請求連結時才合成並邊合成邊播放
+            token = await audio_links.aissue(speech_text, current_config)
+            return {
+                "text": display_text,
+                "raw_text": ai_response_text,
+                "audio": f"/chat/audio/{token}",
+                "arousal": session.arousal_level.name,
+                "expires_in": int(audio_links.ttl)
+            }
+
+        if request.audio_delivery == "stream":
+            # 響應體即音訊流，文字與興奮度放在響應頭（URL 編碼）
+            return await _tts_response(speech_text, current_config, headers={
+                "X-Phi-Text": quote(display_text),
+                "X-Phi-Arousal": session.arousal_level.name
+            })
+
+        # 舊版：经由 TTS 快取获取完整音讯并以 base64 data URI 嵌入 JSON
+        async with admission.tts.admit():
+            try:
+                audio_data = await _tts_bytes(speech_text, current_config, optimize_streaming_latency="2")
+            except Exception as tts_error:
+                raise _tts_http_error(tts_error)
         
         import base64
         
-        # 收集音訊數據（流式處理）
         try:
-            audio_data = b"".join(audio_stream)
-            audio_b64 = base64.b64encode(audio_data).decode('utf-8')
+            with AUDIO_IO.time(op="base64"):
+                audio_b64 = base64.b64encode(audio_data).decode('utf-8')
         except Exception as audio_error:
             logger.error(f"Audio data collection failed: {audio_error}")
             raise HTTPException(status_code=500, detail=f"音频数据处理失败: {audio_error}")
@@ -893,7 +1221,7 @@ async def unified_chat(request: TTSRequest):
             "text": display_text,         # 用于显示在 UI 上的纯净文字
             "raw_text": ai_response_text, # 保留原始文字（带标签）以供调试
             "audio": f"data:audio/mp3;base64,{audio_b64}",  # 使用 MP3 格式
-            "arousal": brain.arousal_level.name
+            "arousal": session.arousal_level.name
         }
 
     except HTTPException:
@@ -911,6 +1239,89 @@ async def unified_chat(request: TTSRequest):
         else:
             raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: str, payload: dict) -> str:
+    """一條 Server-Sent Events 消息（data 為單行 JSON）"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: TTSRequest):
+    """
+    SSE 文字流式接口（/chat 的流式版本）
+    模型輸出的每個分塊經增量清理後立即以 `delta` 事件推送（跨分塊的標籤在閉合前暫緩），
+    首字延遲等於模型的首 token 延遲；結束時 `done` 事件帶最終文字、興奮度與短期音訊連結，
+    音訊在瀏覽器請求連結時才合成。失敗時推送 `error` 事件。
+    """
+    if not brain:
+        raise HTTPException(status_code=500, detail="大脑 (LLM) 未就绪，请检查 API Key")
+    admission.check()
+
+    async def events():
+        cleaner = DisplayStreamCleaner()
+        # 錯誤回覆只放在 stream.reply / metadata 中，不會作為增量產出，也不會送進清理器
+        stream = brain.astream_response(request.text, session_id=request.session_id)
+        try:
+            async with admission.llm.admit():
+                async for delta in stream:
+                    text = cleaner.feed(delta)
+                    if text:
+                        yield _sse_event("delta", {"text": text})
+
+            metadata = stream.metadata or {}
+            if metadata.get("error"):
+                error_str = metadata["error"]
+                if "429" in error_str or "请求频率过高" in error_str:
+                    yield _sse_event("error", {"status": 429, "detail": "主人~菲菲累了，请等 60 秒再找我~（速率限制）"})
+                else:
+                    yield _sse_event("error", {"status": 500, "detail": stream.reply})
+                return
+
+            tail = cleaner.flush()
+            if tail:
+                yield _sse_event("delta", {"text": tail})
+
+            # 與 /chat 相同的收尾：STATE 自主切換興奮度，最終文字與音訊連結
+            session = await brain.aget_session(request.session_id)
+            with TEXT_PROCESSING.time(step="render_reply"):
+                rendered = render_reply(stream.reply or "")
+            if rendered.state_level is not None:
+                await brain.aset_arousal_level(ArousalLevel(rendered.state_level), session_id=request.session_id)
+                logger.info(f"Autonomous State Switch: {session.arousal_level.name}")
+
+            audio = None
+            if ELEVENLABS_API_KEY and has_speakable_text(rendered.speech_text):
+                settings = _chat_voice_settings(session.arousal_level, rendered.bracket_emotion)
+                audio = f"/chat/audio/{await audio_links.aissue(rendered.speech_text, settings)}"
+            yield _sse_event("done", {
+                "text": rendered.display_text,
+                "raw_text": rendered.text,
+                "arousal": session.arousal_level.name,
+                "audio": audio,
+                "expires_in": int(audio_links.ttl),
+                "model": metadata.get("model_used")
+            })
+        except HTTPException as e:
+            yield _sse_event("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            # 響應已開始，無法再改狀態碼：以 error 事件結束，而不是直接斷流
+            logger.error(f"Chat Stream Error: {str(e)}", exc_info=True)
+            yield _sse_event("error", {"status": 500, "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/chat/audio/{token}")
+async def chat_audio(token: str):
+    """/chat 回傳的短期音訊連結：經由 TTS 快取合成並串流回傳（有效期內可重複請求）"""
+    link = await audio_links.aresolve(token)
+    if link is None:
+        raise HTTPException(status_code=404, detail="音訊連結不存在或已過期")
+    admission.tts.check()
+    speech_text, voice_settings = link
+    return await _tts_response(speech_text, voice_settings)
+
 # 静态文件挂载（使用 FastAPI StaticFiles）
 _base_dir = os.path.dirname(os.path.abspath(__file__))
 static_dir = os.path.join(_base_dir, "static")
@@ -941,34 +1352,27 @@ async def root():
 @app.post("/api/v1/chat")
 async def missav_bridge(
     request: ChatRequest, 
-    background_tasks: BackgroundTasks,
     api_key: str = Security(get_api_key)
 ):
     """
     專供外部系統（如 MISSAV）調用的精緻封裝接口。
-    同步處理語音生成，並自動安排背景清理任務。
+    同步處理語音生成，生成的文件登記到期時間，由清掃任務統一刪除。
     """
     if not brain:
         raise HTTPException(status_code=500, detail="PhiBrain 大腦未就緒")
+    admission.check()
 
     try:
-        from fastapi.concurrency import run_in_threadpool
-        
-        # 1. 獲取 LLM 回覆 (使用 threadpool 避免阻塞事件迴圈)
-        ai_response_text, metadata = await run_in_threadpool(brain.generate_response, request.message)
-        
-        # 2. 獲取 UI 顯示文字
-        display_text = _clean_text(ai_response_text)
+        # 1. 獲取 LLM 回覆 (原生異步調用，不阻塞事件迴圈；以外部用戶識別碼作為會話 ID)
+        async with admission.llm.admit():
+            ai_response_text, metadata = await brain.agenerate_response(request.message, session_id=request.user_id)
+        session = await brain.aget_session(request.user_id)
         
-        # 3. 語音化清理 (嵌套括號已在內部循環處理)
-        buffered_text = _clause_buffer(ai_response_text)
-        speech_text, emotion_from_brackets = _clean_for_speech(buffered_text)
-        
-        # 4. 從文本提取標籤
-        cartesia_emotion = None
-        emotion_match = re.search(r'<emotion\s+value=["\']([^"\']+)["\']\s*/>', ai_response_text)
-        if emotion_match:
-            cartesia_emotion = emotion_match.group(1)
+        # 2-4. 文本處理：UI 顯示文字、語音文字與括號情緒 (此接口不依 STATE 標籤切換兴奋度)
+        with TEXT_PROCESSING.time(step="render_reply"):
+            rendered = render_reply(ai_response_text, extract_state_tag=False)
+        display_text = rendered.display_text
+        speech_text, emotion_from_brackets = rendered.speech_text, rendered.bracket_emotion
 
         # 5. 構建合成參數 (使用主人指定的 0.7/0.8 穩定度)
         local_sovits_tags = {
@@ -979,8 +1383,8 @@ async def missav_bridge(
             ArousalLevel.PEAK: {"speed": 1.3, "pitch": 1.2}
         }
         
-        sovits_params = local_sovits_tags.get(brain.arousal_level, local_sovits_tags[ArousalLevel.NORMAL])
-        target_speed = 0.9 if brain.arousal_level == ArousalLevel.PEAK else sovits_params.get("speed", 1.0)
+        sovits_params = local_sovits_tags.get(session.arousal_level, local_sovits_tags[ArousalLevel.NORMAL])
+        target_speed = 0.9 if session.arousal_level == ArousalLevel.PEAK else sovits_params.get("speed", 1.0)
         target_pitch = sovits_params.get("pitch", 1.0)
         
         base_emotion_config = {
@@ -991,7 +1395,7 @@ async def missav_bridge(
             ArousalLevel.PEAK: {"curiosity": "high", "stability": "low", "positivity": "high"}
         }
         
-        emotion_config = base_emotion_config.get(brain.arousal_level, {}).copy()
+        emotion_config = base_emotion_config.get(session.arousal_level, {}).copy()
         if emotion_from_brackets:
             emotion_config.update(emotion_from_brackets)
             
@@ -1013,42 +1417,27 @@ async def missav_bridge(
             ArousalLevel.PEAK: {"stability": 0.3, "similarity_boost": 0.5, "style": 0.8}
         }
         
-        current_config = eleven_params.get(brain.arousal_level, eleven_params[ArousalLevel.NORMAL])
+        current_config = eleven_params.get(session.arousal_level, eleven_params[ArousalLevel.NORMAL])
         
         # 簡單的情緒微調
         if emotion_from_brackets:
             current_config["stability"] = max(0.1, current_config["stability"] - 0.1)
             current_config["style"] = min(1.0, current_config["style"] + 0.15)
             
-        # 6. 生成語音並寫入文件 (使用 threadpool)
-        def _generate_audio(text, settings):
-            from elevenlabs.client import ElevenLabs
-            if not ELEVENLABS_API_KEY:
-                raise ValueError("ELEVENLABS_API_KEY is missing")
-                
-            client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-            
-            # 使用 convert 生成完整音頻
-            audio_generator = client.text_to_speech.convert(
-                voice_id=VOICE_ID,
-                output_format="mp3_44100_128",
-                text=text,
-                model_id=MODEL_ID,
-                voice_settings=settings
-            )
-            return b"".join(audio_generator)
-
-        audio_data = await run_in_threadpool(_generate_audio, speech_text, current_config)
+        # 6. 生成語音並寫入文件 (經由 TTS 快取，相同內容不重複合成)
+        async with admission.tts.admit():
+            audio_data = await _tts_bytes(speech_text, current_config)
         
         # 使用 UUID 命名並存儲
         filename = f"phi_{uuid.uuid4().hex}.mp3"
         file_path = os.path.join(OUTPUT_DIR, filename)
         
-        with open(file_path, "wb") as f:
-            f.write(audio_data)
+        with AUDIO_IO.time(op="file_write"):
+            with open(file_path, "wb") as f:
+                f.write(audio_data)
             
-        # 註冊背景清理任務 (600 秒後刪除)
-        background_tasks.add_task(cleanup_audio_file, file_path, 600)
+        # 登記到期時間，由清掃任務刪除
+        audio_sweeper.register(file_path)
         
         # 構建外部訪問連結
         # 這裡假設部署在 Railway，我們需要構建絕對路徑
@@ -1060,14 +1449,43 @@ async def missav_bridge(
             "reply": ai_response_text,    # 完整的大腦回應
             "text": display_text,         # 淨化後的 UI 展示文字
             "audio": audio_url,           # 生成的語音連結
-            "phi_status": brain.arousal_level.name,
-            "expires_in": 600             # 提示外部系統該資源有效期
+            "phi_status": session.arousal_level.name,
+            "expires_in": int(audio_sweeper.ttl)  # 提示外部系統該資源有效期
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Bridge API Error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/v1/batch")
+async def batch_chat(
+    request: BatchChatRequest,
+    api_key: str = Security(get_api_key)
+):
+    """
+    批量對話接口（離線評估、批量內容生成）
+    條目並發生成（每條佔用一個 LLM 准入名額），結果以 NDJSON 逐行串流回傳：
+    每行一個 JSON 物件 {index, session_id, reply, error, latency_ms, metadata}，單條失敗只體現在該行的 error。
+    """
+    if not brain:
+        raise HTTPException(status_code=500, detail="PhiBrain 大腦未就緒")
+    admission.check()
+
+    items = [BatchItem(item.message, session_id=item.session_id) for item in request.items]
+
+    async def ndjson_lines():
+        async for result in brain.agenerate_batch(
+            items,
+            concurrency=request.concurrency,
+            ordered=request.ordered,
+            item_slot=admission.llm.admit
+        ):
+            yield json.dumps(result.to_dict(), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)